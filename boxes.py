@@ -0,0 +1,181 @@
+# boxes.py
+# Columnar container for detector boxes, shared by the detectors, the pipeline and the tools:
+# one (N, 6) float32 array [x1, y1, x2, y2, conf, class], every operation is vectorized
+# (no per-box Python loop, tuple unpacking or int() cast on the hot path).
+import numpy as np
+
+
+def as_xyxy(boxes):
+    # (N, 4) float32 coordinates of a Boxes, a box array (N, 4+) or a single box
+    if isinstance(boxes, Boxes):
+        return boxes.xyxy
+    boxes = np.asarray(boxes, dtype=np.float32)
+    if boxes.size == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    return boxes.reshape(-1, boxes.shape[-1])[:, :4]
+
+
+def iou_matrix(a, b):
+    """
+    IoU of every box of a (N, 4+) with every box of b (M, 4+), returns (N, M).
+    """
+    a = as_xyxy(a)
+    b = as_xyxy(b)
+    w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class Boxes:
+    def __init__(self, data=None):
+        """
+        Args:
+            data: [[x1, y1, x2, y2, conf, class], ...] as a list, an array or a Boxes, e.g. results[0].boxes.numpy().data.
+        """
+        if isinstance(data, Boxes):
+            data = data.data
+        self.data = np.asarray(data if data is not None else [], dtype=np.float32).reshape(-1, 6)
+
+    @classmethod
+    def concat(cls, boxes_list):
+        boxes_list = [boxes.data for boxes in boxes_list if len(boxes) != 0]
+        return cls(np.concatenate(boxes_list) if boxes_list else None)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        # rows, so `x1, y1, x2, y2, conf, cls = box` still works for non hot path code
+        return iter(self.data)
+
+    def __getitem__(self, index):
+        # int -> row, slice / mask / index array -> Boxes
+        if isinstance(index, (int, np.integer)):
+            return self.data[index]
+        return Boxes(self.data[index])
+
+    def __repr__(self):
+        return f"Boxes({self.data.tolist()})"
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5].astype(np.int32)
+
+    @property
+    def width(self):
+        return self.data[:, 2] - self.data[:, 0]
+
+    @property
+    def height(self):
+        return self.data[:, 3] - self.data[:, 1]
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    def int_xyxy(self):
+        # integer pixel coordinates, cast once for all boxes
+        return self.data[:, :4].astype(np.int32)
+
+    def horizontal(self):
+        # bool per box, wider than high
+        return np.abs(self.width) > np.abs(self.height)
+
+    def thickness(self):
+        # line thickness of a text box, its short side
+        return np.minimum(self.width, self.height)
+
+    def filter(self, min_conf):
+        return self[self.conf >= min_conf]
+
+    def of_class(self, *classes):
+        return self[np.isin(self.cls, classes)]
+
+    def sorted(self, key='conf'):
+        """
+        key: 'conf' (descending), 'x' (x1 left to right) or 'y' (y1 top to bottom).
+        """
+        if key == 'conf':
+            return self[np.argsort(-self.conf, kind='stable')]
+        return self[np.argsort(self.data[:, 0 if key == 'x' else 1], kind='stable')]
+
+    def top1_per_class(self):
+        # most confident box of each class, sorted by confidence
+        boxes = self.sorted('conf')
+        _, first = np.unique(boxes.cls, return_index=True)
+        return boxes[np.sort(first)]
+
+    def iou(self, other):
+        return iou_matrix(self.data, other)
+
+    def inside_ratio(self, other):
+        # (N, M) fraction of the area of each box inside each box of other
+        other = as_xyxy(other)
+        w = np.clip(np.minimum(self.data[:, None, 2], other[None, :, 2]) - np.maximum(self.data[:, None, 0], other[None, :, 0]), 0, None)
+        h = np.clip(np.minimum(self.data[:, None, 3], other[None, :, 3]) - np.maximum(self.data[:, None, 1], other[None, :, 1]), 0, None)
+        return w * h / np.maximum(self.area[:, None], 1e-9)
+
+    def gap(self, other):
+        # (N, M) distance between the edges of each box and each box of other, 0 if they overlap
+        other = as_xyxy(other)
+        dx = np.maximum(np.maximum(other[None, :, 0] - self.data[:, None, 2], self.data[:, None, 0] - other[None, :, 2]), 0)
+        dy = np.maximum(np.maximum(other[None, :, 1] - self.data[:, None, 3], self.data[:, None, 1] - other[None, :, 3]), 0)
+        return np.sqrt(dx * dx + dy * dy)
+
+    def padded(self, width, height, p=5):
+        """
+        Integer crop coordinates padded by p pixels, boxes whose padding would leave the image are not padded.
+        """
+        xyxy = self.int_xyxy()
+        out = (xyxy[:, 0] - p < 0) | (xyxy[:, 1] - p < 0) | (xyxy[:, 2] + p > width) | (xyxy[:, 3] + p > height)
+        return np.where(out[:, None], xyxy, xyxy + np.array([-p, -p, p, p], dtype=np.int32))
+
+    def expanded(self, dx, dy, width, height):
+        # integer coordinates expanded by dx / dy and clamped to the image
+        xyxy = self.data[:, :4] + np.array([-dx, -dy, dx, dy], dtype=np.float32)
+        return np.clip(xyxy, 0, [width, height, width, height]).astype(np.int32)
+
+    def offset(self, dx, dy):
+        data = self.data.copy()
+        data[:, [0, 2]] += dx
+        data[:, [1, 3]] += dy
+        return Boxes(data)
+
+    def scaled(self, factor, factor_y=None):
+        # factor_y: different vertical factor (e.g. resize to a fixed display size)
+        data = self.data.copy()
+        data[:, [0, 2]] *= factor
+        data[:, [1, 3]] *= factor if factor_y is None else factor_y
+        return Boxes(data)
+
+    def union(self):
+        # [x1, y1, x2, y2] enclosing all boxes
+        return [float(self.data[:, 0].min()), float(self.data[:, 1].min()), float(self.data[:, 2].max()), float(self.data[:, 3].max())]
+
+    def nms(self, iou_threshold=0.5):
+        """
+        Class-wise NMS (e.g. boxes merged from overlapping ROIs / tiles), sorted by confidence.
+        """
+        boxes = self.sorted('conf')
+        same_class = boxes.cls[:, None] == boxes.cls[None, :]
+        overlaps = (boxes.iou(boxes) > iou_threshold) & same_class
+        keep = np.ones(len(boxes), dtype=bool)
+        for i in range(len(boxes)):
+            if keep[i]:
+                # suppress the less confident overlapping boxes
+                keep[i + 1:] &= ~overlaps[i, i + 1:]
+        return boxes[keep]
+
+    def tolist(self):
+        return self.data.tolist()
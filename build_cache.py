@@ -0,0 +1,143 @@
+# build_cache.py
+# Incremental build support for the data preparation steps.
+# Every output file (crop, v2h image, YOLO label file, ...) is stored with a key, the hash of everything it was built from
+# (source image bytes, box coordinates, tool version, ...). A step skips an output whose key did not change and that
+# still exists, so re-running a step after a new CVAT export only processes new or changed annotations.
+# Source file hashes are cached by (size, mtime), unchanged files are never read again.
+# The cache is a SQLite file, loaded into memory at start and written back by save().
+# An output is only recorded once it is completely written (update() after the write, or update_after() with the
+# future of a background write), so an interrupted run never leaves a truncated output recorded as fresh.
+import os
+import sqlite3
+import hashlib
+import threading
+
+
+def make_key(*parts):
+    """
+    Hash the given parts (str, int, float, tuples of them) into a hex key.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class BuildCache:
+    def __init__(self, cache_file, step):
+        """
+        Args:
+            cache_file (str): SQLite file, usually .build_cache.sqlite in the step output folder.
+            step (str): Name of the step, outputs of different steps can share one cache file.
+        """
+        self.cache_file = cache_file
+        self.step = step
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(cache_file)
+        self.db.execute("CREATE TABLE IF NOT EXISTS outputs (output TEXT PRIMARY KEY, step TEXT, key TEXT, info TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+
+        self.outputs = {row[0]: (row[1], row[2]) for row in
+                        self.db.execute("SELECT output, key, info FROM outputs WHERE step = ?", (step,))}
+        self.file_hashes = {row[0]: (row[1], row[2], row[3]) for row in
+                            self.db.execute("SELECT path, size, mtime_ns, digest FROM file_hashes")}
+        self.changed_outputs = {}
+        self.changed_file_hashes = {}
+        self.seen_outputs = set()
+        self.pending = set() # outputs of update_after whose write has not finished
+        self.removed_outputs = set() # being rebuilt, the old record is deleted until the new one is complete
+
+    def file_digest(self, path):
+        # content hash of a source file, re-hashed only if its size or mtime changed (thread-safe)
+        st = os.stat(path)
+        cached = self.file_hashes.get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self.lock:
+            self.file_hashes[path] = (st.st_size, st.st_mtime_ns, digest)
+            self.changed_file_hashes[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def is_fresh(self, output, key):
+        # True if `output` exists and was built from the same inputs
+        with self.lock:
+            self.seen_outputs.add(output)
+        cached = self.outputs.get(output)
+        return cached is not None and cached[0] == key and os.path.exists(output)
+
+    def info(self, output):
+        cached = self.outputs.get(output)
+        return cached[1] if cached is not None else None
+
+    def update(self, output, key, info=None):
+        # record that `output` has been built from `key`
+        with self.lock:
+            self.seen_outputs.add(output)
+            self.outputs[output] = (key, info)
+            self.changed_outputs[output] = (key, info)
+            self.removed_outputs.discard(output)
+
+    def update_after(self, future, output, key, info=None):
+        """
+        Record `output` once the background write `future` has finished, only if it succeeded:
+        no exception and a result other than False (e.g. cv2.imwrite returns False when it could not write).
+        """
+        with self.lock:
+            self.seen_outputs.add(output)
+            self.pending.add(output)
+            # the file is being overwritten, the previous record must not make a truncated file look fresh
+            if self.outputs.pop(output, None) is not None:
+                self.removed_outputs.add(output)
+            self.changed_outputs.pop(output, None)
+
+        def done(future):
+            with self.lock:
+                self.pending.discard(output)
+            if not future.cancelled() and future.exception() is None and future.result() is not False:
+                self.update(output, key, info)
+        future.add_done_callback(done)
+
+    def prune(self):
+        """
+        Delete the outputs of this step that were not seen in this run (annotation or source image removed).
+        Returns the number of deleted outputs.
+        """
+        stale = [output for output in self.outputs if output not in self.seen_outputs]
+        for output in stale:
+            if os.path.exists(output):
+                os.remove(output)
+            del self.outputs[output]
+        self.db.executemany("DELETE FROM outputs WHERE output = ?", [(output,) for output in stale])
+        return len(stale)
+
+    def save(self):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO outputs (output, step, key, info) VALUES (?, ?, ?, ?)",
+                                [(output, self.step, key, info) for output, (key, info) in self.changed_outputs.items()])
+            self.db.executemany("DELETE FROM outputs WHERE output = ?", [(output,) for output in self.removed_outputs])
+            self.db.executemany("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                                [(path,) + value for path, value in self.changed_file_hashes.items()])
+            self.db.commit()
+            self.changed_outputs = {}
+            self.changed_file_hashes = {}
+            self.removed_outputs = set()
+
+    def close(self):
+        self.save()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # on an error / Ctrl+C, only the outputs completely written so far are saved
+        if exc_type is not None and self.pending:
+            print(f"{len(self.pending)} outputs still being written are not recorded, they are rebuilt on the next run.")
+            self.pending = set()
+        self.close()
@@ -4,6 +4,8 @@ from ultralytics import YOLO
 import numpy as np
 import cv2
 
+from boxes import Boxes
+
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 model_relative_path = 'models/yolov8_char_det/best_small.pt'
 model_path = os.path.normpath(os.path.join(__dir__, model_relative_path))
@@ -12,10 +14,13 @@ confidence_threshold = 0.5
 
 # Yolo8 Character Detector for container number
 class CharDetector:
-    def __init__(self):
-        self.model = YOLO(model_path)
-        self.warmup()
-        print("CharDetector loaded and warmed up successfully.")
+    def __init__(self, model_path=model_path, warmup=True):
+        # model_path can also point to an exported/quantized model (e.g. *.onnx from quantize_models.py)
+        # warmup=False: no model call here, e.g. in the parent of pre-fork workers (see prefork.py)
+        self.model = YOLO(model_path, task='detect')
+        if warmup:
+            self.warmup()
+        print(f"CharDetector loaded{' and warmed up' if warmup else ''} successfully.")
 
     def warmup(self):
         _dummy_image = np.zeros((640, 640, 3), dtype=np.uint8)
@@ -24,33 +29,46 @@ class CharDetector:
     def detect(self, image):
         # cv2.imwrite("temp_images/cropped.jpg", image)
         height, width, _ = image.shape
-        is_vertical = False
         if height > width:
             print("input cn cropped image is vertical.")
-            is_vertical = True
         else:
             print("input cn cropped image is horizontal.")
 
         st = time.time()
         res = self.model(image, verbose=False)
         boxes = res[0].boxes.numpy().data
+        print(f"{len(boxes)} char boxes detected. Took {time.time() - st:.3f} seconds.")
+        return self.process(image, boxes)
+
+    def detect_batch(self, images):
+        # one model call for a list of cropped images, returns (image, is_vertical, is_reassembled) of each image
+        if len(images) == 0:
+            return []
+        st = time.time()
+        res = self.model(images, verbose=False)
+        print(f"Char det on a batch of {len(images)} images. Took {time.time() - st:.3f} seconds.")
+        return [self.process(image, r.boxes.numpy().data) for image, r in zip(images, res)]
+
+    def process(self, image, boxes):
+        height, width, _ = image.shape
+        is_vertical = height > width
         # boxes: [[x1, y1, x2, y2, conf, cls],[...box2....],[...box3...],..., [...boxN...]]]
         num_boxes = len(boxes)
-        print(f"{num_boxes} char boxes detected. Took {time.time() - st:.3f} seconds.")
         #print('All chars det confidence:', [box[4] for box in boxes])
 
-        new_boxes = [box for box in boxes if box[4] >= confidence_threshold]
+        new_boxes = Boxes(boxes).filter(confidence_threshold)
 
         if num_boxes - len(new_boxes) > 0:
             print(f"{num_boxes - len(new_boxes)} char boxes removed, confidence below {confidence_threshold}.")
         else:
             print(f"All char boxes kept, confidence above {confidence_threshold}.")
         
+        """
         debug_image = image.copy()
-        for box in new_boxes:
-            x1, y1, x2, y2, conf, cls = box
-            cv2.rectangle(debug_image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 1)
-        # cv2.imwrite("temp_images/chars_debug.jpg", debug_image)
+        for x1, y1, x2, y2 in new_boxes.int_xyxy().tolist():
+            cv2.rectangle(debug_image, (x1, y1), (x2, y2), (0, 255, 0), 1)
+        cv2.imwrite("temp_images/chars_debug.jpg", debug_image)
+        """
         
         is_reassembled = False
 
@@ -82,22 +100,11 @@ class CharDetector:
         else:
             expand_x, expand_y = 2, 5
 
-        # store the cropped and adjusted character regions
-        cropped_images = []
-
-        # iterate over each bounding box, crop and expand the character region   
-        for box in boxes:
-            x1, y1, x2, y2 = box[:4]
+        # expand the character regions, make sure not to exceed the image boundary (all boxes at once)
+        expanded = boxes.expanded(expand_x, expand_y, image.shape[1], image.shape[0])
 
-            # calculate the expanded coordinates, make sure not to exceed the image boundary
-            x1_expanded = max(x1 - expand_x, 0)
-            y1_expanded = max(y1 - expand_y, 0)
-            x2_expanded = min(x2 + expand_x, image.shape[1])
-            y2_expanded = min(y2 + expand_y, image.shape[0])
-
-            # crop the expanded region
-            cropped = image[int(y1_expanded):int(y2_expanded), int(x1_expanded):int(x2_expanded)]
-            cropped_images.append(cropped)
+        # crop the expanded character regions
+        cropped_images = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in expanded.tolist()]
 
         # calculate the max height of all cropped regions
         max_height = max([img.shape[0] for img in cropped_images])
@@ -125,12 +132,10 @@ class CharDetector:
     def reorder_boxes(self, is_vertical ,boxes):
         if is_vertical:
             # sort by y1 from top to bottom
-            boxes = sorted(boxes, key=lambda box: box[1])
+            return boxes.sorted('y')
         else:
             # sort by x1 from left to right
-            boxes = sorted(boxes, key=lambda box: box[0])
-
-        return boxes
+            return boxes.sorted('x')
 
 """
 detector = CharDetector()
@@ -4,46 +4,222 @@ from ultralytics import YOLO
 import numpy as np
 import cv2
 
+from boxes import Boxes
+
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 model_relative_path = 'models/yolov8_cn_det/best_small.pt'
 model_path = os.path.normpath(os.path.join(__dir__, model_relative_path))
 
 confidence_threshold = 0.6
 
+# ROI-first detection of high-resolution frames (roi_mode=True)
+roi_min_size = 1600 # images with a smaller long side are detected directly
+coarse_size = 640 # min long side of the coarse (reduced) image, YOLO input size
+coarse_confidence_threshold = 0.25 # candidates of the coarse pass, the ROI pass applies confidence_threshold
+roi_size = 640 # min ROI size in full resolution pixels, small ROIs are grown around the candidate for context
+tile_size = 1280
+tile_overlap = 0.2
+nms_iou_threshold = 0.5
+
+# cv2 reduced decode flags (JPEG DCT scaling, cheaper than resizing the full resolution image)
+reduced_flags = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def reduced_factor(width, height, min_size=coarse_size):
+    # largest reduction keeping the long side >= min_size
+    for factor, flag in reduced_flags:
+        if max(width, height) / factor >= min_size:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def with_coarse(image, decode_reduced, roi_mode=True):
+    # (image, coarse) for CNDetector: coarse = (reduced image, factor) if image goes through detect_roi, else None
+    if not roi_mode or image is None or max(image.shape[:2]) <= roi_min_size:
+        return image, None
+    _, flag = reduced_factor(image.shape[1], image.shape[0])
+    coarse = decode_reduced(flag) if flag != cv2.IMREAD_COLOR else None
+    if coarse is None:
+        return image, None
+    return image, (coarse, image.shape[1] / coarse.shape[1])
+
+
+def imread_for_detection(path, roi_mode=True):
+    """
+    Read an image file for CNDetector, returns (image, coarse), pass coarse to detect / detect_batch.
+    The coarse image of a large JPEG comes from a second, reduced decode (a few ms at 4K), cheaper than resizing
+    the full resolution image (same EXIF orientation handling as the full decode).
+    """
+    image = cv2.imread(path)
+    if not path.lower().endswith(('.jpg', '.jpeg')):
+        return image, None
+    return with_coarse(image, lambda flag: cv2.imread(path, flag), roi_mode)
+
+
+def imdecode_for_detection(data, roi_mode=True):
+    # imread_for_detection of encoded image bytes (e.g. a request body)
+    buffer = np.frombuffer(data, np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if bytes(buffer[:2]) != b'\xff\xd8':
+        return image, None
+    return with_coarse(image, lambda flag: cv2.imdecode(buffer, flag), roi_mode)
+
+
+def reduce_image(image, min_size=coarse_size):
+    # coarse image when no reduced decode is available, returns (image, factor)
+    factor = max(image.shape[:2]) / min_size
+    if factor <= 1:
+        return image, 1
+    size = (round(image.shape[1] / factor), round(image.shape[0] / factor))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), image.shape[1] / size[0]
+
+
+def make_rois(boxes, width, height, pad=0.5, min_size=roi_size):
+    """
+    Full resolution ROIs around the coarse candidate boxes (Boxes): padded by pad x line thickness, grown to min_size,
+    clamped to the image, overlapping ROIs are merged. Returns [[x1, y1, x2, y2], ...] (int).
+    """
+    p = pad * boxes.thickness()
+    cx, cy = (boxes.data[:, 0] + boxes.data[:, 2]) / 2, (boxes.data[:, 1] + boxes.data[:, 3]) / 2
+    w = np.minimum(np.maximum(boxes.width + 2 * p, min_size), width)
+    h = np.minimum(np.maximum(boxes.height + 2 * p, min_size), height)
+    x1 = np.clip(cx - w / 2, 0, width - w)
+    y1 = np.clip(cy - h / 2, 0, height - h)
+    rois = np.stack([x1, y1, x1 + w, y1 + h], axis=1).astype(np.int32).tolist()
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rois)):
+            for j in range(i + 1, len(rois)):
+                a, b = rois[i], rois[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rois[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rois[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rois
+
+
+def make_tiles(width, height, size=tile_size, overlap=tile_overlap):
+    # overlapping tiles covering the whole image, [[x1, y1, x2, y2], ...]
+    def starts(length):
+        if length <= size:
+            return [0]
+        step = int(size * (1 - overlap))
+        positions = list(range(0, length - size, step))
+        return positions + [length - size]
+    return [[x, y, min(x + size, width), min(y + size, height)] for y in starts(height) for x in starts(width)]
+
+
 # Yolo8 Container-Number Detector (CN, CN_ABC, CN_NUM, TS)
 class CNDetector:
-    def __init__(self):
-        self.model = YOLO(model_path)
-        self.warmup()
-        print("CNDetector loaded and warmed up successfully.")
+    def __init__(self, model_path=model_path, roi_mode=False, tile=False, warmup=True):
+        """
+        Args:
+            model_path (str): Can also point to an exported/quantized model (e.g. *.onnx from quantize_models.py).
+            roi_mode (bool): Detect images larger than roi_min_size with detect_roi (coarse pass + full resolution ROIs).
+            tile (bool): In roi_mode, detect overlapping full resolution tiles when the coarse pass finds nothing.
+            warmup (bool): False: no model call here, e.g. in the parent of pre-fork workers (see prefork.py).
+        """
+        self.model = YOLO(model_path, task='detect')
+        self.roi_mode = roi_mode
+        self.tile = tile
+        if warmup:
+            self.warmup()
+        print(f"CNDetector loaded{' and warmed up' if warmup else ''} successfully.")
 
     def warmup(self):
         _dummy_image = np.zeros((640, 640, 3), dtype=np.uint8)
         self.model(_dummy_image, verbose=False)
     
-    def detect(self, image):
+    def detect(self, image, coarse=None):
         print("-----------------------------------------------")
+        if self.roi_mode and max(image.shape[:2]) > roi_min_size:
+            return self.detect_roi([image], [coarse])[0]
         st = time.time()
         res = self.model(image, verbose=False)
-        boxes = res[0].boxes.numpy().data
+        boxes = Boxes(res[0].boxes.numpy().data)
         # boxes: [[x1, y1, x2, y2, conf, class],[...box2....],[...box3...],..., [...boxN...]]]
         # class: 0 = CN, 1 = CN_ABC, 2 = CN_NUM, 3 = TS
 
         num_boxes = len(boxes)
         print(f"{num_boxes} CN/CN_ABC/CN_NUM/TS boxes detected. Took {time.time() - st:.3f} seconds.")
 
-        new_boxes = []
-        class_names ={0: "CN", 1: "CN_ABC", 2: "CN_NUM", 3: "TS"}
-
-        for i in range(num_boxes):
-            conf = boxes[i][4]
-            class_id = boxes[i][5]
-            if conf < confidence_threshold:
-                print(f"{class_names[int(class_id)]} box confidence {conf:.3f} below {confidence_threshold}. Ignoring.")
-            else:
-                new_boxes.append(boxes[i])
-                print(f"{class_names[int(class_id)]} box confidence {conf:.3f} above {confidence_threshold}. Keeping.")
-        
+        return self.filter_boxes(boxes)
+
+    def detect_batch(self, images, coarse_images=None):
+        """
+        One model call for a list of images, returns the kept boxes of each image.
+        In roi_mode, the images larger than roi_min_size go through detect_roi (coarse_images: optional
+        (reduced image, factor) or None per image, see imread_for_detection), the others are detected directly.
+        """
+        if len(images) == 0:
+            return []
+        large = [i for i, image in enumerate(images) if max(image.shape[:2]) > roi_min_size] if self.roi_mode else []
+        if len(large) == 0:
+            return self.detect_direct(images)
+        small = sorted(set(range(len(images))) - set(large))
+        results = [None] * len(images)
+        for i, boxes in zip(large, self.detect_roi([images[i] for i in large], [coarse_images[i] for i in large] if coarse_images is not None else None)):
+            results[i] = boxes
+        for i, boxes in zip(small, self.detect_direct([images[i] for i in small])):
+            results[i] = boxes
+        return results
+
+    def detect_direct(self, images):
+        if len(images) == 0:
+            return []
+        st = time.time()
+        res = self.model(images, verbose=False)
+        print(f"CN det on a batch of {len(images)} images. Took {time.time() - st:.3f} seconds.")
+        return [self.filter_boxes(Boxes(r.boxes.numpy().data)) for r in res]
+
+    def detect_roi(self, images, coarse_images=None):
+        """
+        ROI-first detection of high-resolution images, cost close to a VGA frame while small text keeps its detail:
+        1. one model call on the reduced images (coarse_images, e.g. from imread_for_detection, or resized here)
+        2. one model call on the full resolution ROIs around the coarse candidates (+ tiles if tile and no candidate)
+        3. boxes mapped back to full resolution, class-wise NMS across overlapping ROIs / tiles
+
+        Args:
+            images: Full resolution images, the ROIs are cropped views (no copy).
+            coarse_images: Optional list of (reduced image, factor) or None (resized here), factor = full size / reduced size.
+
+        Returns:
+            kept boxes of each image, like detect_batch
+        """
+        st = time.time()
+        if coarse_images is None:
+            coarse_images = [None] * len(images)
+        coarse_images = [coarse if coarse is not None else reduce_image(image) for image, coarse in zip(images, coarse_images)]
+        res = self.model([coarse for coarse, _ in coarse_images], verbose=False)
+
+        regions = [] # (image index, [x1, y1, x2, y2])
+        for i, (r, (_, factor)) in enumerate(zip(res, coarse_images)):
+            height, width = images[i].shape[:2]
+            candidates = Boxes(r.boxes.numpy().data).filter(coarse_confidence_threshold).scaled(factor)
+            image_regions = make_rois(candidates, width, height)
+            if len(image_regions) == 0 and self.tile:
+                image_regions = make_tiles(width, height)
+            regions += [(i, region) for region in image_regions]
+        coarse_time = time.time() - st
+
+        merged = [[] for _ in images]
+        if len(regions) != 0:
+            res = self.model([images[i][y1:y2, x1:x2] for i, (x1, y1, x2, y2) in regions], verbose=False)
+            for (i, (x1, y1, _, _)), r in zip(regions, res):
+                merged[i].append(Boxes(r.boxes.numpy().data).offset(x1, y1))
+        print(f"CN det (ROI) on {len(images)} images, {len(regions)} ROIs/tiles. Coarse {coarse_time:.3f}s, total {time.time() - st:.3f}s.")
+        return [self.filter_boxes(Boxes.concat(boxes).nms(nms_iou_threshold)) for boxes in merged]
+
+    def filter_boxes(self, boxes):
+        # boxes above the confidence threshold, most confident first (Boxes)
+        new_boxes = boxes.filter(confidence_threshold).sorted('conf')
+        class_names = {0: "CN", 1: "CN_ABC", 2: "CN_NUM", 3: "TS"}
+        kept = ", ".join(f"{class_names[cls]} {conf:.3f}" for cls, conf in zip(new_boxes.cls.tolist(), new_boxes.conf.tolist()))
+        print(f"{len(new_boxes)}/{len(boxes)} boxes kept, confidence above {confidence_threshold}: {kept}")
         return new_boxes
 
 """
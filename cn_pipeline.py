@@ -0,0 +1,471 @@
+# cn_pipeline.py
+# Container number recognition pipeline, without GUI:
+# CNDetector -> crop / stitch CN (or CN_ABC + CN_NUM) -> CharDetector (reassemble) -> 2 TextRecognizers -> correction
+# Used by workflow_main_demo.py (MainWindow) and by the headless tools (inference_service.py, ...).
+import os
+import time
+import cv2
+import numpy as np
+
+from text_corrector import correct_container_number
+from result_cache import dhash
+from boxes import Boxes
+
+WRONG_CN = "XXXX0000000" # returned by correct_container_number when the result can not be corrected
+
+# optional work CNPipeline.run_batch can skip under load (see deadline_scheduler.py):
+# no_debug: no box drawing / debug images, no_retry: no second recognition of reassembled crops,
+# no_rec_2: main recognizer only, light_rec: the light main recognizer instead of the main one
+degradations = ('no_debug', 'no_retry', 'no_rec_2', 'light_rec')
+# the degradations that may change the recognized container number, their results are not cached
+result_degradations = ('no_retry', 'no_rec_2', 'light_rec')
+
+# names used by quantize_models.py for the promoted INT8 recognizers
+rec_model_names = {"ABINet": "abinet_rec", "CPPD": "cppd_rec", "CPPDPadding": "cppd_rec"}
+
+
+def load_models(rec_algo_1="ABINet", rec_algo_2="CPPD", use_gpu=False, use_int8=False, log=None, roi_det=False, tile=False, cn_det=True, warmup=True):
+    """
+    Load CNDetector, CharDetector and the main & auxiliary TextRecognizers.
+    With use_int8, the INT8 models promoted by quantize_models.py are used where available.
+    roi_det / tile: ROI-first CN detection of high-resolution frames, see CNDetector.detect_roi.
+    cn_det: False for processes that only recognize crops, the returned CNDetector is then None.
+    warmup: False to load the models without any model call (pre-fork parent, see prefork.py).
+    """
+    from cn_detector import CNDetector, model_path as cn_det_model_path
+    from char_detector import CharDetector, model_path as char_det_model_path
+    from text_recognizer import TextRecognizer
+    from quantize_models import promoted_model_path
+
+    if log is None:
+        log = lambda text, type: None
+
+    cn_detector = None
+    if use_int8:
+        if cn_det:
+            cn_detector = CNDetector(model_path=promoted_model_path('cn_det', cn_det_model_path), roi_mode=roi_det, tile=tile, warmup=warmup)
+            log("CNDetector is ready.", "success")
+        char_detector = CharDetector(model_path=promoted_model_path('char_det', char_det_model_path), warmup=warmup)
+        log("CharDetector is ready.", "success")
+        rec_model_dir = promoted_model_path(rec_model_names[rec_algo_1], None)
+        text_recognizer = TextRecognizer(algo=rec_algo_1, use_gpu=use_gpu, model_dir=rec_model_dir, use_int8=rec_model_dir is not None)
+        rec_model_dir_2 = promoted_model_path(rec_model_names[rec_algo_2], None)
+        text_recognizer_2 = TextRecognizer(algo=rec_algo_2, use_gpu=use_gpu, model_dir=rec_model_dir_2, use_int8=rec_model_dir_2 is not None)
+    else:
+        if cn_det:
+            cn_detector = CNDetector(roi_mode=roi_det, tile=tile, warmup=warmup)
+            log("CNDetector is ready.", "success")
+        char_detector = CharDetector(warmup=warmup)
+        log("CharDetector is ready.", "success")
+        text_recognizer = TextRecognizer(algo=rec_algo_1, use_gpu=use_gpu)
+        text_recognizer_2 = TextRecognizer(algo=rec_algo_2, use_gpu=use_gpu)
+    log("TextRecognizers are ready.", "success")
+    return cn_detector, char_detector, text_recognizer, text_recognizer_2
+
+
+def add_padding(img, target_height, target_width, direction):
+    """
+    Add black padding to an image to reach the target size.
+    """
+    if direction == 'horizontal':
+        padding = (target_width - img.shape[1], 0)
+    else:  # 'vertical'
+        padding = (0, target_height - img.shape[0])
+
+    padded_img = cv2.copyMakeBorder(img, 0, padding[1], 0, padding[0], cv2.BORDER_CONSTANT, value=[0, 0, 0])
+    return padded_img
+
+
+def crop_group(image, group, log=None, debug_dir=None):
+    """
+    Crop a CN group (Boxes): the CN box, or the CN_ABC & CN_NUM boxes stitched together. Returns None if it can not be stitched.
+    """
+    if log is None:
+        log = lambda text, type: None
+    # crop the image based on the box coordinates with some extra padding (not at the edge of the image)
+    crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in group.padded(image.shape[1], image.shape[0]).tolist()]
+    if len(crops) == 1:
+        return crops[0]
+
+    img_abc, img_num = crops
+    if img_abc.size == 0 or img_num.size == 0:
+        return None
+    # put the two boxes together
+    # first, we need to check if the two boxes are horizontal or vertical
+    is_box_cn_abc_horizontal, is_box_cn_num_horizontal = group.horizontal().tolist()
+    if is_box_cn_abc_horizontal == True and is_box_cn_num_horizontal == True:
+        print("Stitching two boxes horizontally.")
+        # put cn_abc on left, cn_num on right
+        h = max(img_abc.shape[0], img_num.shape[0])
+        img_abc = add_padding(img_abc, h, img_abc.shape[1], 'vertical')
+        img_num = add_padding(img_num, h, img_num.shape[1], 'vertical')
+        stitched_cn_image = cv2.hconcat([img_abc, img_num])
+        log("Two horizontal CN lines detected.", "default")
+    elif is_box_cn_abc_horizontal == False and is_box_cn_num_horizontal == False:
+        print("Stitching two boxes vertically.")
+        # put cn_abc on top, cn_num on bottom
+        w = max(img_abc.shape[1], img_num.shape[1])
+        img_abc = add_padding(img_abc, img_abc.shape[0], w, 'horizontal')
+        img_num = add_padding(img_num, img_num.shape[0], w, 'horizontal')
+        stitched_cn_image = cv2.vconcat([img_abc, img_num])
+        log("Two vertical CN lines detected.", "default")
+    else:
+        print("CN_ABC and CN_NUM are not in same direction, return None.")
+        return None
+    if debug_dir is not None:
+        cv2.imwrite(os.path.join(debug_dir, "stitched_cn_image.jpg"), stitched_cn_image)
+    return stitched_cn_image
+
+
+def group_cn_boxes(boxes, max_gap_ratio=3.0):
+    """
+    Group the CNDetector boxes into container numbers, one group per container:
+    every CN box is a group, every CN_ABC box is paired with the nearest CN_NUM box of the same direction.
+
+    Args:
+        boxes: CNDetector boxes (Boxes or [[x1, y1, x2, y2, conf, class], ...]).
+        max_gap_ratio (float): Max gap between CN_ABC and CN_NUM, relative to the line thickness (short side of the boxes).
+
+    Returns:
+        list of groups (Boxes), [cn_box] or [cn_abc_box, cn_num_box], CN groups first, then by confidence
+    """
+    boxes = Boxes(boxes).sorted('conf')
+    cn_boxes = boxes.of_class(0)
+    abc_boxes = boxes.of_class(1)
+    num_boxes = boxes.of_class(2)
+    # CN_ABC / CN_NUM inside a detected CN belong to that CN
+    if len(cn_boxes) != 0:
+        abc_boxes = abc_boxes[~(abc_boxes.inside_ratio(cn_boxes) >= 0.5).any(axis=1)]
+        num_boxes = num_boxes[~(num_boxes.inside_ratio(cn_boxes) >= 0.5).any(axis=1)]
+
+    gaps = abc_boxes.gap(num_boxes)
+    thickness = np.maximum(abc_boxes.thickness()[:, None], num_boxes.thickness()[None, :])
+    same_direction = abc_boxes.horizontal()[:, None] == num_boxes.horizontal()[None, :]
+    abc_indices, num_indices = np.nonzero(same_direction & (gaps <= max_gap_ratio * thickness))
+    # greedy matching, nearest pairs first
+    pairs = []
+    paired_abc = set()
+    paired_num = set()
+    for gap, a, n in sorted(zip(gaps[abc_indices, num_indices].tolist(), abc_indices.tolist(), num_indices.tolist())):
+        if a in paired_abc or n in paired_num:
+            continue
+        paired_abc.add(a)
+        paired_num.add(n)
+        pairs.append(Boxes.concat([abc_boxes[a:a + 1], num_boxes[n:n + 1]]))
+    pairs.sort(key=lambda pair: float(pair.conf.min()), reverse=True)
+    return [cn_boxes[i:i + 1] for i in range(len(cn_boxes))] + pairs
+
+
+def get_cropped_cns(image, boxes, log=None, draw=True, debug_dir=None):
+    """
+    Crop every container number of the image: each CN box, and each CN_ABC & CN_NUM pair stitched together.
+
+    Args:
+        image: Original BGR image.
+        boxes: CNDetector boxes (Boxes or [[x1, y1, x2, y2, conf, class], ...]).
+        log: Optional callback log(text, type), e.g. MainWindow.updateLog.
+        draw (bool): Draw the boxes on a copy of the image, otherwise the returned image is None.
+        debug_dir (str): If given, the stitched CN images are saved there.
+
+    Returns:
+        ([(group, cropped_cn_image), ...], image with boxes or None), see group_cn_boxes() for the groups
+    """
+    # boxes: [[x1, y1, x2, y2, conf1, class],[...box2....],[...box3...],..., [...boxN...]]]
+    # conf1 > conf2 > conf3 > ... > confN
+    # class: 0 = CN, 1 = CN_ABC, 2 = CN_NUM, 3 = TS
+    if log is None:
+        log = lambda text, type: None
+    image_copy = image.copy() if draw else None
+
+    groups = group_cn_boxes(boxes)
+    crops = []
+    for group in groups:
+        cropped_cn_image = crop_group(image, group, log=log, debug_dir=debug_dir)
+        if cropped_cn_image is None or cropped_cn_image.size == 0:
+            continue
+        crops.append((group, cropped_cn_image))
+
+    ###################draw the bounding box on the image###################
+    if draw:
+        for group, _ in crops:
+            for x1, y1, x2, y2 in group.int_xyxy().tolist():
+                cv2.rectangle(image_copy, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        ts_boxes = Boxes(boxes).of_class(3)
+        if len(ts_boxes) != 0:
+            print("TS detected, ignore temporarily.")
+        for x1, y1, x2, y2 in ts_boxes.int_xyxy().tolist():
+            cv2.rectangle(image_copy, (x1, y1), (x2, y2), (0, 215, 255), 2) # orange
+    #######################################################################
+    if len(crops) == 0:
+        print("No CN and no CN_ABC & CN_NUM pair detected, return None.")
+    else:
+        log(f"{len(crops)} CN detected.", "default")
+    return crops, image_copy
+
+
+class CNPipeline:
+    def __init__(self, cn_detector, char_detector, text_recognizer, text_recognizer_2, log=None, debug_dir=None,
+                 frame_cache=None, crop_cache=None, result_store=None, speculative_retry=False, light_text_recognizer=None):
+        """
+        Args:
+            cn_detector, char_detector, text_recognizer, text_recognizer_2: loaded models, see load_models().
+            log: Optional callback log(text, type), e.g. MainWindow.updateLog.
+            debug_dir (str): If given, intermediate images are saved there.
+            frame_cache (ResultCache): Optional, results of duplicate (or verified near-duplicate) input frames are returned without any model call.
+            crop_cache (ResultCache): Optional, results of duplicate CN crops skip char det & recognition, keep it exact (max_distance 0).
+            result_store (ResultStore): Optional, every result is queued there (written in the background).
+            speculative_retry (bool): Recognize the original crop of a horizontal reassembled crop in the same batch
+                as the reassembled one, instead of a second round of rec calls when the first result is wrong
+                (more rec work per batch, no retry latency on the hard images).
+            light_text_recognizer (TextRecognizer): Optional lighter main recognizer (e.g. INT8), used with the light_rec degradation.
+        """
+        self.cn_detector = cn_detector
+        self.char_detector = char_detector
+        self.text_recognizer = text_recognizer # main rec algorithm
+        self.text_recognizer_2 = text_recognizer_2 # auxiliary rec algorithm
+        self.log = log if log is not None else (lambda text, type: None)
+        self.debug_dir = debug_dir
+        self.frame_cache = frame_cache
+        self.crop_cache = crop_cache
+        self.result_store = result_store
+        self.speculative_retry = speculative_retry
+        self.light_text_recognizer = light_text_recognizer
+
+    def imread(self, path):
+        # (image, coarse) of an image file, coarse: reduced decode for the ROI-first CN detection, None if not used
+        if not getattr(self.cn_detector, 'roi_mode', False):
+            return cv2.imread(path), None
+        from cn_detector import imread_for_detection
+        return imread_for_detection(path)
+
+    def imdecode(self, data):
+        # imread of encoded image bytes
+        if not getattr(self.cn_detector, 'roi_mode', False):
+            return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), None
+        from cn_detector import imdecode_for_detection
+        return imdecode_for_detection(data)
+
+    def run(self, image, draw=True, source=None, degrade=(), coarse=None):
+        return self.run_batch([image], draw=draw, sources=[source], degrade=degrade, coarse_images=[coarse])[0]
+
+    def run_batch(self, images, draw=False, sources=None, degrade=(), coarse_images=None):
+        """
+        Recognize every container number of each image, every stage runs as one batched call
+        (all CN crops of all images go through CharDetector and the TextRecognizers together).
+        sources: Optional image paths / names, recorded in the result store.
+        coarse_images: Optional reduced images for ROI-first CN detection, see cn_detector.imread_for_detection.
+        degrade: Optional work to skip, see degradations. Results degraded by result_degradations are not cached.
+
+        Returns a list of result dicts, one per image:
+            cns: one dict {cn, cn_1, cn_2, status, cached, boxes} per container number found in the image,
+                boxes are the CN box or the CN_ABC & CN_NUM boxes of that container number
+            cn, cn_1, cn_2, status, cached: the first recognized entry of cns (or the first entry), for single CN callers
+                cn: corrected container number, None if not recognized
+                cn_1, cn_2: (text, conf) of the main / auxiliary recognizer, None if nothing good
+                status: 'ok', 'no_detection', 'no_cn', 'no_rec' or 'wrong_cn'
+                cached: None, 'frame' or 'crop' if the result comes from the frame / crop cache
+            boxes: CNDetector boxes [[x1, y1, x2, y2, conf, class], ...]
+            image: image with the boxes drawn (draw=True), else None
+            timings: seconds spent in each stage (for the whole batch)
+            degraded: the degradations applied
+        """
+        degrade = sorted(set(degrade))
+        results = [{'cn': None, 'cn_1': None, 'cn_2': None, 'cns': [], 'boxes': [], 'image': None, 'status': None, 'cached': None, 'timings': {},
+                    'degraded': degrade} for _ in images]
+        timings = {}
+        if 'no_debug' in degrade:
+            draw = False
+        debug_dir = self.debug_dir if 'no_debug' not in degrade else None
+        cacheable = not any(d in result_degradations for d in degrade)
+
+        # duplicate frames: previous result, no model call
+        frame_keys = [None] * len(images) # (key, thumbnail), see ResultCache.fingerprint
+        to_detect = list(range(len(images)))
+        if self.frame_cache is not None:
+            st = time.time()
+            to_detect = []
+            for i, image in enumerate(images):
+                frame_keys[i] = self.frame_cache.fingerprint(image)
+                cached = self.frame_cache.get(*frame_keys[i])
+                if cached is None:
+                    to_detect.append(i)
+                    continue
+                results[i].update(cached, cached='frame')
+                if draw:
+                    _, results[i]['image'] = get_cropped_cns(image, cached['boxes'], draw=True)
+                for entry in cached['cns']:
+                    if entry['cn'] is not None:
+                        self.log(f"Final CN: {entry['cn']} (cached)", "success")
+            timings['frame_cache'] = time.time() - st
+
+        st = time.time()
+        res_cndets = self.cn_detector.detect_batch([images[i] for i in to_detect],
+                                                   [coarse_images[i] for i in to_detect] if coarse_images is not None else None)
+        # boxes: [[x1, y1, x2, y2, conf, class],[...box2....],[...box3...],..., [...boxN...]]]
+        # class: 0 = CN, 1 = CN_ABC, 2 = CN_NUM, 3 = TS
+        timings['cn_det'] = time.time() - st
+
+        st = time.time()
+        crops = [] # (result index, cropped & stitched cn image), every container number of every image
+        for i, res_cndet in zip(to_detect, res_cndets):
+            image = images[i]
+            results[i]['boxes'] = Boxes(res_cndet).tolist()
+            results[i]['image'] = image if draw else None
+            if len(res_cndet) == 0:
+                self.log("No CN/CN_ABC/CN_NUM/TS detected.", "default")
+                results[i]['status'] = 'no_detection'
+                continue
+            # cropped_cns: [(group boxes, cropped & stiched cn image)], image: original image with bounding boxes
+            cropped_cns, image_with_boxes = get_cropped_cns(image, res_cndet, log=self.log, draw=draw, debug_dir=debug_dir)
+            if draw:
+                results[i]['image'] = image_with_boxes
+            if len(cropped_cns) == 0:
+                self.log("No good container number detected.", "default")
+                results[i]['status'] = 'no_cn'
+                continue
+            for group, cropped_cn_image in cropped_cns:
+                entry = {'cn': None, 'cn_1': None, 'cn_2': None, 'status': None, 'cached': None,
+                         'boxes': group.tolist()}
+                results[i]['cns'].append(entry)
+                crops.append((entry, cropped_cn_image))
+        timings['crop'] = time.time() - st
+
+        # duplicate crops: previous recognition result, no char det / rec
+        crop_keys = {}
+        if self.crop_cache is not None:
+            st = time.time()
+            to_recognize = []
+            for entry, cropped_cn_image in crops:
+                crop_keys[id(entry)] = self.crop_cache.fingerprint(cropped_cn_image)
+                cached = self.crop_cache.get(*crop_keys[id(entry)])
+                if cached is None:
+                    to_recognize.append((entry, cropped_cn_image))
+                    continue
+                entry.update(cached, cached='crop')
+                if cached['cn'] is not None:
+                    self.log(f"Final CN: {cached['cn']} (cached)", "success")
+            crops = to_recognize
+            timings['crop_cache'] = time.time() - st
+
+        crop_results = self.recognize_crops([cropped_cn_image for _, cropped_cn_image in crops], timings, degrade)
+        for (entry, _), crop_result in zip(crops, crop_results):
+            entry.update(crop_result)
+            if self.crop_cache is not None and cacheable:
+                key, thumb = crop_keys[id(entry)]
+                self.crop_cache.put(key, crop_result, thumb)
+
+        for i in to_detect:
+            entries = results[i]['cns']
+            if len(entries) != 0:
+                # single CN callers get the first recognized container number
+                primary = next((entry for entry in entries if entry['status'] == 'ok'), entries[0])
+                results[i].update({k: primary[k] for k in ('cn', 'cn_1', 'cn_2', 'status', 'cached')})
+            if self.frame_cache is not None and cacheable:
+                key, thumb = frame_keys[i]
+                self.frame_cache.put(key, {k: results[i][k] for k in ('cn', 'cn_1', 'cn_2', 'cns', 'boxes', 'status')}, thumb)
+
+        for result in results:
+            result['timings'] = timings
+        if self.result_store is not None:
+            for i, result in enumerate(results):
+                # dHash, so that the stored results of near-duplicate images can be found; the frame cache key is one in near-duplicate mode
+                near_key = frame_keys[i] is not None and self.frame_cache.max_distance > 0
+                image_hash = f"{frame_keys[i][0] if near_key else dhash(images[i]):016x}"
+                self.result_store.add(result, source=sources[i] if sources is not None else None, image_hash=image_hash)
+        return results
+
+    def recognize_crops(self, crop_images, timings=None, degrade=()):
+        """
+        Char det + recognition + correction of cropped (or stitched) CN images, every stage as one batched call.
+        degrade: Optional work to skip (no_retry, no_rec_2, light_rec), see degradations.
+        Returns a list of dicts {cn, cn_1, cn_2, status}, one per crop.
+        """
+        if timings is None:
+            timings = {}
+        crops = list(enumerate(crop_images))
+        results = [{'cn': None, 'cn_1': None, 'cn_2': None, 'status': None} for _ in crops]
+
+        # detect the characters in the cropped images
+        st = time.time()
+        res_chardets = self.char_detector.detect_batch(crop_images)
+        timings['char_det'] = time.time() - st
+
+        # recognize the characters in the cropped images
+        rec_inputs = [image_after_chardet for image_after_chardet, _, _ in res_chardets]
+        # horizontal and reassembled cropped text images: the original cropped image is the retry input
+        retry_crops = [(i, cropped_cn_image) for (i, cropped_cn_image), (_, is_vertical, is_reassembled) in zip(crops, res_chardets)
+                       if is_reassembled and is_vertical == False and 'no_retry' not in degrade]
+
+        if not self.speculative_retry:
+            retries = self.recognize(crops, rec_inputs, results, timings, 'rec', degrade)
+            # if horizontal and reassembled cropped text image, try to recognize original cropped image again
+            retry_crops = [(i, cropped_cn_image) for i, cropped_cn_image in retry_crops if i in retries]
+            if len(retry_crops) != 0:
+                self.log("Try to recognize again...", "info")
+                print("Try to recognize again (horizontal and reassemble) ...")
+                self.recognize(retry_crops, [cropped_cn_image for _, cropped_cn_image in retry_crops], results, timings, 'retry', degrade)
+            return results
+
+        # speculative: the original cropped images are recognized in the same batch as the reassembled ones,
+        # the retry result is only used if the reassembled one is wrong (same results, no second round of rec calls)
+        res_recs, res_recs_2 = self.run_recognizers(rec_inputs + [cropped_cn_image for _, cropped_cn_image in retry_crops], timings, 'rec', degrade)
+        retries = self.correct_results(crops, res_recs[:len(crops)], res_recs_2[:len(crops)], results, 'rec')
+        used = [k for k, (i, _) in enumerate(retry_crops) if i in retries]
+        if len(used) != 0:
+            print(f"Speculative retry result used for {len(used)} crops (horizontal and reassemble).")
+            self.correct_results([retry_crops[k] for k in used], [res_recs[len(crops) + k] for k in used],
+                                 [res_recs_2[len(crops) + k] for k in used], results, 'retry')
+        return results
+
+    def run_recognizers(self, rec_inputs, timings, stage, degrade=()):
+        # both recognizers on rec_inputs, one batch each
+        text_recognizer = self.text_recognizer
+        if 'light_rec' in degrade and self.light_text_recognizer is not None:
+            text_recognizer = self.light_text_recognizer
+        st = time.time()
+        res_recs = text_recognizer.rec_batch(rec_inputs)
+        timings[stage] = time.time() - st
+        if 'no_rec_2' in degrade:
+            # corrected without auxiliary result, like a low confidence auxiliary result
+            return res_recs, [[] for _ in rec_inputs]
+        st = time.time()
+        res_recs_2 = self.text_recognizer_2.rec_batch(rec_inputs)
+        timings[stage + '_2'] = time.time() - st
+        return res_recs, res_recs_2
+
+    def recognize(self, crops, rec_inputs, results, timings, stage, degrade=()):
+        # run both recognizers on rec_inputs in one batch each, correct the texts, returns the indices with a wrong CN
+        res_recs, res_recs_2 = self.run_recognizers(rec_inputs, timings, stage, degrade)
+        return self.correct_results(crops, res_recs, res_recs_2, results, stage)
+
+    def correct_results(self, crops, res_recs, res_recs_2, results, stage):
+        # correct the recognized texts of crops into results, returns the indices with a wrong CN
+        wrong = set()
+        for (i, _), res_rec, res_rec_2 in zip(crops, res_recs, res_recs_2):
+            if len(res_rec) == 0:
+                self.log("No good container number recognized.", "default")
+                results[i]['status'] = 'no_rec'
+                continue
+            # temporarily only use the first (1st conf) recognized container number
+            cn_text, cn_conf = res_rec[0]
+            # the auxiliary result may be missing (low confidence)
+            cn_text_2, cn_conf_2 = res_rec_2[0] if len(res_rec_2) != 0 else ("", 0.0)
+            results[i]['cn_1'] = (cn_text, cn_conf)
+            results[i]['cn_2'] = (cn_text_2, cn_conf_2) if len(res_rec_2) != 0 else None
+            self.log(f"CN_1: {cn_text} ({cn_conf:.3f})", "default")
+            self.log(f"CN_2: {cn_text_2} ({cn_conf_2:.3f})", "default")
+            # correct the recognized text
+            corrected_cn_text = correct_container_number(cn_text, cn_text_2)
+
+            if corrected_cn_text == WRONG_CN:
+                message = "Wrong CN recognition." if stage == 'rec' else "Wrong CN recognition again."
+                self.log(message, "warning")
+                print(message)
+                results[i]['status'] = 'wrong_cn'
+                wrong.add(i)
+            else:
+                self.log(f"Final CN: {corrected_cn_text}", "success")
+                print(f"Final CN: {corrected_cn_text}")
+                results[i]['cn'] = corrected_cn_text
+                results[i]['status'] = 'ok'
+        return wrong
@@ -1,41 +1,117 @@
 # step 1: cvat_to_pdlocrrec_label.py
-# How to use: python3 cvat_to_pdlocrrec_label.py
+# How to use: python3 cvat_to_pdlocrrec_label.py [--full_rebuild] [--prune]
+#             python3 cvat_to_pdlocrrec_label.py --shards_folder rec_shards (packed crops & labels, see rec_shards.py)
+# Incremental by default: a crop is only re-cut if its source image bytes, its box or TOOL_VERSION changed
+# (see build_cache.py), the label file is always rewritten. The shards are always written from scratch.
 import xml.etree.ElementTree as ET
 import cv2 # for cropping images
 import os
+import argparse
 from tqdm import tqdm # for progress bar
+from build_cache import BuildCache, make_key
+from rec_shards import ShardWriter
 
 raw_images_folder = '/home/osman/Downloads/export-data/images'
 raw_cvat_annotation_file = '/home/osman/Downloads/export-data/annotations.xml'
 cropped_images_folder = '/home/osman/Downloads/export-data/cropped_container_number_images'
 cropped_labels_file = '/home/osman/Downloads/export-data/cropped_container_number_labels.txt'
 
-tree = ET.parse(raw_cvat_annotation_file)
-root = tree.getroot()
+# change it whenever the cropping logic changes, all crops will be rebuilt
+TOOL_VERSION = 'cvat_to_pdlocrrec_label/1'
 
-if not os.path.exists(cropped_images_folder):
-    os.makedirs(cropped_images_folder)
 
-# calculate total CN labels count
-total_cn_count = sum(1 for image in root.findall('.//image') for box in image.findall('.//box') if box.get('label') == 'CN')
+def export_rec_crops(raw_images_folder, raw_cvat_annotation_file, cropped_images_folder, cropped_labels_file, incremental=True, prune=False):
+    tree = ET.parse(raw_cvat_annotation_file)
+    root = tree.getroot()
 
-with open(cropped_labels_file, 'w') as file, tqdm(total=total_cn_count, desc="Processing CN labels for PaddleOCR Rec") as pbar:
-    for image in root.findall('.//image'):
-        image_name = image.get('name')
-        base_name = os.path.splitext(image_name)[0]
-        cn_count = 1
+    if not os.path.exists(cropped_images_folder):
+        os.makedirs(cropped_images_folder)
 
-        for box in image.findall('.//box'):  # one image may have multiple CN
-            if box.get('label') == 'CN':
-                cn_text = box.find(".//attribute[@name='cn_text']").text
-                new_image_name = f"{base_name}_{cn_count:02}.jpg"
-                file.write(f"{new_image_name}\t{cn_text}\n")
-                xtl, ytl, xbr, ybr = map(lambda x: round(float(box.get(x))), ['xtl', 'ytl', 'xbr', 'ybr'])
-                img = cv2.imread(os.path.join(raw_images_folder, image_name))
-                cropped_img = img[ytl:ybr, xtl:xbr]
-                cv2.imwrite(os.path.join(cropped_images_folder, new_image_name), cropped_img)
+    # calculate total CN labels count
+    total_cn_count = sum(1 for image in root.findall('.//image') for box in image.findall('.//box') if box.get('label') == 'CN')
+    cropped_count = 0
 
-                cn_count += 1
-                pbar.update(1)
+    cache = BuildCache(os.path.join(cropped_images_folder, '.build_cache.sqlite'), 'cvat_to_pdlocrrec_label')
+    with cache, open(cropped_labels_file, 'w') as file, tqdm(total=total_cn_count, desc="Processing CN labels for PaddleOCR Rec") as pbar:
+        for image in root.findall('.//image'):
+            image_name = image.get('name')
+            base_name = os.path.splitext(image_name)[0]
+            cn_count = 1
+            image_path = os.path.join(raw_images_folder, image_name)
+            source_digest = None
+            img = None # decoded once per source image, only if one of its crops has to be rebuilt
 
-print(f"Total CN labels processed: {total_cn_count}")
+            for box in image.findall('.//box'):  # one image may have multiple CN
+                if box.get('label') == 'CN':
+                    cn_text = box.find(".//attribute[@name='cn_text']").text
+                    new_image_name = f"{base_name}_{cn_count:02}.jpg"
+                    file.write(f"{new_image_name}\t{cn_text}\n")
+                    xtl, ytl, xbr, ybr = map(lambda x: round(float(box.get(x))), ['xtl', 'ytl', 'xbr', 'ybr'])
+
+                    output_path = os.path.join(cropped_images_folder, new_image_name)
+                    if source_digest is None:
+                        source_digest = cache.file_digest(image_path)
+                    key = make_key(TOOL_VERSION, source_digest, (xtl, ytl, xbr, ybr))
+                    if not incremental or not cache.is_fresh(output_path, key):
+                        if img is None:
+                            img = cv2.imread(image_path)
+                        cropped_img = img[ytl:ybr, xtl:xbr]
+                        if cv2.imwrite(output_path, cropped_img):
+                            cache.update(output_path, key)
+                        else:
+                            print(f"Can not write {output_path}")
+                        cropped_count += 1
+
+                    cn_count += 1
+                    pbar.update(1)
+
+        if prune:
+            print(f"Stale crops removed: {cache.prune()}")
+
+    print(f"Total CN labels processed: {total_cn_count}, crops (re)built: {cropped_count}")
+
+
+def export_rec_shards(raw_images_folder, raw_cvat_annotation_file, shards_folder):
+    # same crops & names as export_rec_crops, JPEG-encoded in memory and packed into shards (no crop files, no label file)
+    root = ET.parse(raw_cvat_annotation_file).getroot()
+    total_cn_count = sum(1 for image in root.findall('.//image') for box in image.findall('.//box') if box.get('label') == 'CN')
+
+    with ShardWriter(shards_folder) as writer, tqdm(total=total_cn_count, desc="Packing CN crops for PaddleOCR Rec") as pbar:
+        for image in root.findall('.//image'):
+            image_name = image.get('name')
+            base_name = os.path.splitext(image_name)[0]
+            cn_count = 1
+            img = None
+
+            for box in image.findall('.//box'):
+                if box.get('label') == 'CN':
+                    cn_text = box.find(".//attribute[@name='cn_text']").text
+                    xtl, ytl, xbr, ybr = map(lambda x: round(float(box.get(x))), ['xtl', 'ytl', 'xbr', 'ybr'])
+                    if img is None:
+                        img = cv2.imread(os.path.join(raw_images_folder, image_name))
+                    ok, data = cv2.imencode('.jpg', img[ytl:ybr, xtl:xbr])
+                    if ok:
+                        writer.add(f"{base_name}_{cn_count:02}.jpg", data.tobytes(), cn_text)
+                    cn_count += 1
+                    pbar.update(1)
+
+    print(f"Total CN labels processed: {total_cn_count}, packed: {writer.count} in {writer.shard + 1} shards")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="crop CN boxes from a CVAT export for PaddleOCR rec")
+    parser.add_argument("--raw_images_folder", default=raw_images_folder)
+    parser.add_argument("--annotation_file", default=raw_cvat_annotation_file)
+    parser.add_argument("--cropped_images_folder", default=cropped_images_folder)
+    parser.add_argument("--cropped_labels_file", default=cropped_labels_file)
+    parser.add_argument("--full_rebuild", action="store_true", help="ignore the build cache, re-crop everything")
+    parser.add_argument("--prune", action="store_true", help="remove crops whose annotation no longer exists")
+    parser.add_argument("--shards_folder", default=None, help="write packed shards there instead of crop files + label file")
+
+    args = parser.parse_args()
+    if args.shards_folder is not None:
+        export_rec_shards(args.raw_images_folder, args.annotation_file, args.shards_folder)
+    else:
+        export_rec_crops(args.raw_images_folder, args.annotation_file, args.cropped_images_folder, args.cropped_labels_file,
+                         incremental=not args.full_rebuild, prune=args.prune)
@@ -0,0 +1,101 @@
+# deadline_scheduler.py
+# Latency-budgeted, load-aware degradation of CNPipeline.run_batch, used by inference_service.py --deadline_ms.
+# Every request has a deadline (arrival + X-Deadline-Ms header or --deadline_ms). Before each batch the scheduler picks
+# the lightest degradation level whose estimated batch time fits in the smallest remaining budget of the batch,
+# and at least the level of the queue depth (a truck surge drops optional work before the budgets run out):
+#   0: everything, 1: no_debug, 2: + no_retry, 3: + no_rec_2, 4: + light_rec (only with a light recognizer)
+# The stage times are learned from the timings of the previous batches (EWMA per image).
+# Requests already past their deadline when the batch starts are not run (status 'expired').
+# Every result records its degradations ('degraded'), the counts are in the service /stats.
+import time
+from collections import Counter
+
+# cumulative degradation levels, see cn_pipeline.degradations
+levels = [
+    (),
+    ('no_debug',),
+    ('no_debug', 'no_retry'),
+    ('no_debug', 'no_retry', 'no_rec_2'),
+    ('no_debug', 'no_retry', 'no_rec_2', 'light_rec'),
+]
+# optional stages (CNPipeline timings keys), the other stages always run
+optional_stages = {'rec_2': 'no_rec_2', 'retry': 'no_retry', 'retry_2': 'no_retry'}
+
+
+class DeadlineScheduler:
+    def __init__(self, queue_levels=(16, 32, 64), safety=0.8, alpha=0.2, light_rec=False, shed_expired=True):
+        """
+        Args:
+            queue_levels: Queue depths from which at least level 2, 3 and 4 are used.
+            safety (float): Fraction of the remaining budget the estimated batch time may use.
+            alpha (float): EWMA weight of the last batch in the stage time estimates.
+            light_rec (bool): The pipeline has a light_text_recognizer, level 4 is available.
+            shed_expired (bool): Do not run the requests already past their deadline.
+        """
+        self.queue_levels = queue_levels
+        self.safety = safety
+        self.alpha = alpha
+        self.max_level = len(levels) - 1 if light_rec else len(levels) - 2
+        self.shed_expired = shed_expired
+        self.costs = {} # stage -> seconds per image
+        self.level_counts = Counter() # level -> batches
+        self.degradation_counts = Counter() # degradation -> requests
+        self.expired = 0
+
+    def estimate(self, level, batch_size):
+        # estimated seconds of a batch at a degradation level
+        degrade = levels[level]
+        per_image = 0.0
+        for stage, cost in self.costs.items():
+            if stage == 'rec' and 'light_rec' in degrade and 'rec_light' in self.costs:
+                continue
+            if stage == 'rec_light' and 'light_rec' not in degrade:
+                continue
+            if optional_stages.get(stage) in degrade:
+                continue
+            per_image += cost
+        return per_image * batch_size
+
+    def plan(self, deadlines, queue_depth, now=None):
+        """
+        Args:
+            deadlines: Deadline (time.perf_counter() time) of each request of the batch.
+            queue_depth (int): Requests waiting behind this batch.
+
+        Returns:
+            (indices of the requests to run, degradations), the other requests are expired
+        """
+        now = time.perf_counter() if now is None else now
+        run = [i for i, deadline in enumerate(deadlines) if not self.shed_expired or deadline > now]
+        self.expired += len(deadlines) - len(run)
+        if not run:
+            return run, ()
+        remaining = min(deadlines[i] for i in run) - now
+        level = next((level for level in range(self.max_level + 1) if self.estimate(level, len(run)) <= remaining * self.safety), self.max_level)
+        queue_level = sum(queue_depth >= depth for depth in self.queue_levels)
+        level = min(max(level, (0, 2, 3, 4)[queue_level]), self.max_level)
+        self.level_counts[level] += 1
+        for degradation in levels[level]:
+            self.degradation_counts[degradation] += len(run)
+        return run, levels[level]
+
+    def update(self, timings, batch_size, degrade):
+        # learn the stage times from the timings of a batch run with degrade
+        if batch_size == 0:
+            return
+        observed = {('rec_light' if stage == 'rec' and 'light_rec' in degrade else stage): seconds for stage, seconds in timings.items()}
+        # an optional stage that was allowed but not needed (no retry) costs 0 for this batch
+        for stage, degradation in optional_stages.items():
+            if degradation not in degrade and stage not in observed and not (stage == 'retry_2' and 'no_rec_2' in degrade):
+                observed[stage] = 0.0
+        for stage, seconds in observed.items():
+            per_image = seconds / batch_size
+            self.costs[stage] = per_image if stage not in self.costs else (1 - self.alpha) * self.costs[stage] + self.alpha * per_image
+
+    def stats(self):
+        return {
+            'expired': self.expired,
+            'batches_per_level': {str(level): count for level, count in sorted(self.level_counts.items())},
+            'degraded_requests': dict(self.degradation_counts),
+            'stage_ms_per_image': {stage: round(cost * 1000, 3) for stage, cost in self.costs.items()},
+        }
@@ -0,0 +1,244 @@
+# evaluate_rec.py
+# How to use: python3 evaluate_rec.py --eval_label_file rec_eval_label.txt --eval_images_folder RecEvalData \
+#                 --configs ABINet CPPD CPPDPadding ensemble --report_file rec_eval_report.json
+#             python3 evaluate_rec.py --shards_folder rec_shards/val (packed eval split, see rec_shards.py)
+# Accuracy + throughput of the recognizers over the eval split of split_dataset_for_paddleocr_rec.py, in large batches:
+# - ABINet / CPPD / CPPDPadding: CharDetector (reassemble) -> TextRecognizer, top-1 text
+# - ensemble: the production chain CNPipeline.recognize_crops (char det, main + auxiliary rec, correction, retry)
+# For each configuration: full-string accuracy, per-character accuracy (1 - edit distance / label length),
+# check-digit pass rate (ISO 6346 format and check digit), no-result rate and crops/sec, saved as one JSON report
+# so that every speed optimization can be compared against the accuracy it costs.
+import os
+import re
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from tqdm import tqdm
+
+from check_digit_calculation import calculate_check_digit
+
+cn_pattern = re.compile(r'^[A-Z]{4}[0-9]{7}$')
+
+
+def read_label_split(label_file, images_folder, limit=None):
+    # [(image path, label)] of a folder + label file split
+    samples = []
+    with open(label_file, 'r') as file:
+        for line in file:
+            if limit is not None and len(samples) >= limit:
+                break
+            if not line.strip():
+                continue
+            image_name, label = line.rstrip('\n').split('\t', 1)
+            samples.append((os.path.join(images_folder, image_name), label))
+    return samples
+
+
+def read_shard_split(shards_folder, limit=None):
+    # [((reader, index), label)] of a packed split
+    from rec_shards import ShardReader
+    reader = ShardReader(shards_folder)
+    count = len(reader) if limit is None else min(limit, len(reader))
+    return [((reader, i), reader.labels[i]) for i in range(count)]
+
+
+def load_image(source):
+    if isinstance(source, str):
+        return cv2.imread(source)
+    reader, i = source
+    return reader[i][0]
+
+
+def iter_batches(samples, batch_size, workers=8):
+    # (images, labels) batches, the next batch is decoded while the current one is evaluated
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def decode(batch):
+            return list(executor.map(load_image, [source for source, _ in batch])), [label for _, label in batch]
+        batches = [samples[beg:beg + batch_size] for beg in range(0, len(samples), batch_size)]
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            future = prefetch.submit(decode, batches[0]) if batches else None
+            for i in range(len(batches)):
+                images, labels = future.result()
+                if i + 1 < len(batches):
+                    future = prefetch.submit(decode, batches[i + 1])
+                yield images, labels
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def check_digit_ok(text):
+    return bool(cn_pattern.match(text)) and calculate_check_digit(text[:10]) == int(text[10])
+
+
+class Metrics:
+    def __init__(self):
+        self.samples = 0
+        self.correct = 0
+        self.char_errors = 0
+        self.label_chars = 0
+        self.check_digit_ok = 0
+        self.no_result = 0
+        self.seconds = 0.0
+
+    def add(self, prediction, label):
+        # prediction: recognized text, None if nothing was returned
+        self.samples += 1
+        if prediction is None:
+            self.no_result += 1
+            prediction = ''
+        self.correct += prediction == label
+        self.char_errors += edit_distance(prediction, label)
+        self.label_chars += len(label)
+        self.check_digit_ok += check_digit_ok(prediction)
+
+    def report(self):
+        n = max(1, self.samples)
+        return {
+            'samples': self.samples,
+            'full_string_accuracy': round(self.correct / n, 5),
+            'char_accuracy': round(max(0.0, 1 - self.char_errors / max(1, self.label_chars)), 5),
+            'check_digit_pass_rate': round(self.check_digit_ok / n, 5),
+            'no_result_rate': round(self.no_result / n, 5),
+            'seconds': round(self.seconds, 3),
+            'crops_per_sec': round(self.samples / self.seconds, 2) if self.seconds > 0 else None,
+        }
+
+
+def evaluate(samples, char_det, recognizers, pipeline=None, batch_size=256, workers=8, desc="Evaluating rec"):
+    """
+    Evaluate several configurations on the same batches.
+
+    Args:
+        samples: [(image path or (ShardReader, index), label)], see read_label_split / read_shard_split.
+        char_det (CharDetector): Shared by the single recognizer configurations (its time is added to each of them),
+            None to recognize the crops directly.
+        recognizers: {config name: TextRecognizer}.
+        pipeline (CNPipeline): Optional, evaluated as the 'ensemble' configuration with recognize_crops.
+
+    Returns:
+        {config name: metrics}, see Metrics.report
+    """
+    metrics = {name: Metrics() for name in recognizers}
+    if pipeline is not None:
+        metrics['ensemble'] = Metrics()
+    char_det_seconds = 0.0
+    for images, labels in tqdm(iter_batches(samples, batch_size, workers), total=(len(samples) + batch_size - 1) // batch_size, desc=desc):
+        valid = [(image, label) for image, label in zip(images, labels) if image is not None]
+        for name in metrics:
+            # unreadable images count as no result
+            for image, label in zip(images, labels):
+                if image is None:
+                    metrics[name].add(None, label)
+        if not valid:
+            continue
+        images = [image for image, _ in valid]
+        labels = [label for _, label in valid]
+
+        rec_inputs = images
+        if char_det is not None and recognizers:
+            st = time.perf_counter()
+            rec_inputs = [image for image, _, _ in char_det.detect_batch(images)]
+            char_det_seconds += time.perf_counter() - st
+        for name, recognizer in recognizers.items():
+            st = time.perf_counter()
+            res_recs = recognizer.rec_batch(rec_inputs)
+            metrics[name].seconds += time.perf_counter() - st
+            for res_rec, label in zip(res_recs, labels):
+                metrics[name].add(res_rec[0][0] if len(res_rec) != 0 else None, label)
+
+        if pipeline is not None:
+            st = time.perf_counter()
+            results = pipeline.recognize_crops(images)
+            metrics['ensemble'].seconds += time.perf_counter() - st
+            for result, label in zip(results, labels):
+                metrics['ensemble'].add(result['cn'], label)
+
+    report = {}
+    for name, metric in metrics.items():
+        if name != 'ensemble':
+            metric.seconds += char_det_seconds
+        report[name] = metric.report()
+    return report
+
+
+def evaluate_recognizer(samples, char_det, recognizer, batch_size=256, desc="Evaluating rec"):
+    # metrics of one CharDetector + TextRecognizer chain
+    return evaluate(samples, char_det, {'rec': recognizer}, batch_size=batch_size, desc=desc)['rec']
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="accuracy + throughput evaluation of the text recognizers on the rec eval split")
+    parser.add_argument("--eval_label_file", default="/home/user/project/data/paddleocr_rec_data/rec_eval_label.txt")
+    parser.add_argument("--eval_images_folder", default="/home/user/project/data/paddleocr_rec_data/RecEvalData")
+    parser.add_argument("--shards_folder", default=None, help="packed eval split instead of the label file + folder")
+    parser.add_argument("--configs", nargs='+', choices=['ABINet', 'CPPD', 'CPPDPadding', 'ensemble'], default=['ABINet', 'CPPD', 'CPPDPadding', 'ensemble'])
+    parser.add_argument("--rec_algo_1", default="ABINet", help="main recognizer of the ensemble")
+    parser.add_argument("--rec_algo_2", default="CPPD", help="auxiliary recognizer of the ensemble")
+    parser.add_argument("--batch_size", type=int, default=256, help="crops decoded & char-detected together")
+    parser.add_argument("--rec_batch_num", type=int, default=32, help="recognizer batch size")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--no_char_det", action="store_true", help="recognize the crops without CharDetector")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true", help="promoted INT8 models, see quantize_models.py")
+    parser.add_argument("--speculative_retry", action="store_true", help="recognize the original crop of a reassembled crop in the same batch")
+    parser.add_argument("--report_file", default="./rec_eval_report.json")
+
+    args = parser.parse_args()
+    from cn_pipeline import CNPipeline, load_models, rec_model_names
+    from char_detector import CharDetector, model_path as char_det_model_path
+    from text_recognizer import TextRecognizer
+    from quantize_models import promoted_model_path
+
+    if args.shards_folder is not None:
+        samples = read_shard_split(args.shards_folder, args.limit)
+        dataset = args.shards_folder
+    else:
+        samples = read_label_split(args.eval_label_file, args.eval_images_folder, args.limit)
+        dataset = args.eval_label_file
+    print(f"{len(samples)} eval samples.")
+
+    def make_recognizer(algo):
+        model_dir = promoted_model_path(rec_model_names[algo], None) if args.use_int8 else None
+        recognizer = TextRecognizer(algo=algo, use_gpu=args.use_gpu, model_dir=model_dir, use_int8=model_dir is not None)
+        recognizer.rec_batch_num = args.rec_batch_num
+        return recognizer
+
+    char_det = None
+    if not args.no_char_det:
+        char_det = CharDetector(model_path=promoted_model_path('char_det', char_det_model_path) if args.use_int8 else char_det_model_path)
+    recognizers = {algo: make_recognizer(algo) for algo in args.configs if algo != 'ensemble'}
+    pipeline = None
+    if 'ensemble' in args.configs:
+        _, pipeline_char_det, text_recognizer, text_recognizer_2 = load_models(args.rec_algo_1, args.rec_algo_2, use_gpu=args.use_gpu, use_int8=args.use_int8, cn_det=False)
+        text_recognizer.rec_batch_num = text_recognizer_2.rec_batch_num = args.rec_batch_num
+        pipeline = CNPipeline(None, pipeline_char_det, text_recognizer, text_recognizer_2, speculative_retry=args.speculative_retry)
+
+    results = evaluate(samples, char_det, recognizers, pipeline=pipeline, batch_size=args.batch_size)
+    report = {
+        'dataset': dataset,
+        'samples': len(samples),
+        'char_det': char_det is not None,
+        'int8': args.use_int8,
+        'batch_size': args.batch_size,
+        'rec_batch_num': args.rec_batch_num,
+        'speculative_retry': args.speculative_retry,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'configs': results,
+    }
+    for name, metric in results.items():
+        print(f"{name:12s} full-string {metric['full_string_accuracy']:.4f}, char {metric['char_accuracy']:.4f}, "
+              f"check digit {metric['check_digit_pass_rate']:.4f}, {metric['crops_per_sec']} crops/s")
+    with open(args.report_file, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Evaluation report saved: {args.report_file}")
@@ -0,0 +1,174 @@
+# file_staging.py
+# Shared file staging layer for the data preparation scripts (rename-files.py, split_dataset_for_paddleocr_rec.py, ...)
+# Files are materialized with one of the strategies below, in parallel, and optionally recorded in a manifest
+# (tab-separated "source<TAB>target" lines, written as planned before a file is staged and as finished after),
+# so an interrupted run can be resumed with the same targets and a re-run does nothing.
+# Strategies:
+# 1. hardlink: same inode, no extra disk space (falls back to copy across devices)
+# 2. symlink: absolute symbolic link to the source
+# 3. reflink: clone the file extents (btrfs, xfs), falls back to copy_file_range, then copy
+# 4. copy: plain byte copy
+import os
+import fcntl
+from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tqdm import tqdm
+
+strategies = ['hardlink', 'symlink', 'reflink', 'copy']
+
+FICLONE = 0x40049409 # linux ioctl, clone the file extents
+
+
+def reflink_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        # no clone support, let the kernel copy (server-side copy / reflink on some filesystems)
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def stage_file(src, dst, strategy='copy', replace=True):
+    """
+    Make `src` available at `dst` without copying bytes when possible.
+
+    Args:
+        src (str): Path of the existing file.
+        dst (str): Path to create.
+        strategy (str): One of 'hardlink', 'symlink', 'reflink', 'copy'.
+        replace (bool): Replace an existing `dst`, else raise FileExistsError and leave it untouched.
+    """
+    if os.path.lexists(dst):
+        if not replace:
+            raise FileExistsError(f"{dst} already exists and is not a target planned for {src}, not replaced")
+        os.remove(dst)
+    if strategy == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass # cross-device, fall back to copy
+    elif strategy == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return
+    elif strategy == 'reflink':
+        try:
+            reflink_file(src, dst)
+            return
+        except OSError:
+            pass
+    copyfile(src, dst)
+
+
+def read_manifest(manifest_file):
+    """
+    Read a manifest, return ({source: target} of every planned pair, {source: target} of the finished pairs).
+    A missing manifest is an empty one. Lines are "source<TAB>target<TAB>planned" (written before the file is staged)
+    and "source<TAB>target" (written once it is staged), the last line of a source wins.
+    """
+    planned = {}
+    done = {}
+    if manifest_file is None or not os.path.exists(manifest_file):
+        return planned, done
+    with open(manifest_file, 'r') as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2:
+                continue # empty line, or the last line of a crashed run cut in the middle
+            src, dst = fields[0], fields[1]
+            planned[src] = dst
+            if len(fields) == 2:
+                done[src] = dst
+            else:
+                done.pop(src, None)
+    return planned, done
+
+
+def load_manifest(manifest_file):
+    """
+    Read a manifest, return {source: target} of every pair planned by a previous run, finished or not:
+    a file keeps its target across interrupted runs.
+    """
+    return read_manifest(manifest_file)[0]
+
+
+def stage_files(pairs, strategy='copy', workers=8, manifest_file=None, desc="Staging files"):
+    """
+    Stage (source, target) pairs in parallel.
+
+    Args:
+        pairs (iterable): (source path, target path) tuples, consumed lazily, can be a generator.
+        strategy (str): See stage_file.
+        workers (int): Number of worker threads, file system calls release the GIL.
+        manifest_file (str): If given, each pair is appended to it (flushed) as planned before it is staged,
+            then as finished. Finished pairs with an existing target are skipped, planned but unfinished
+            pairs of an interrupted run are staged again (the target may be incomplete). An existing target
+            the manifest does not list for its source is never replaced (FileExistsError).
+            Without a manifest, existing targets are replaced.
+
+    Returns:
+        (staged, skipped) counts.
+    """
+    planned, done = read_manifest(manifest_file)
+    manifest = open(manifest_file, 'a') if manifest_file is not None else None
+    staged = 0
+    skipped = 0
+    pending = set()
+    errors = []
+
+    def record(finished):
+        # every finished pair is recorded, even if another one failed, the first error is raised at the end
+        for future in finished:
+            try:
+                src, dst = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if manifest is not None:
+                manifest.write(f"{src}\t{dst}\n")
+        if manifest is not None:
+            manifest.flush()
+
+    def run(src, dst, replace):
+        stage_file(src, dst, strategy, replace)
+        return src, dst
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for src, dst in tqdm(pairs, desc=desc, unit="file"):
+                    if done.get(src) == dst and os.path.lexists(dst):
+                        skipped += 1
+                        continue
+                    # bounded number of in-flight files, so a generator input is never fully materialized
+                    if len(pending) >= workers * 4:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        record(finished)
+                        if errors:
+                            break
+                    if manifest is not None:
+                        # the assignment is on disk before the target exists, a crash never leaves an unknown target
+                        manifest.write(f"{src}\t{dst}\tplanned\n")
+                        manifest.flush()
+                    # with a manifest, only a target planned for this source by a previous run may be replaced
+                    replace = manifest is None or planned.get(src) == dst
+                    pending.add(executor.submit(run, src, dst, replace))
+                    staged += 1
+            finally:
+                # also on errors / Ctrl+C: the pairs already staged are recorded
+                finished, pending = wait(pending)
+                record(finished)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    if errors:
+        raise errors[0]
+    return staged, skipped
@@ -0,0 +1,236 @@
+# frame_ring.py
+# How to use: python3 frame_ring.py --images_folder /data/gate_images --num_slots 8 --batch_size 4 --max_frame_size 3840x2160
+# Shared-memory frame transport between pipeline processes:
+# - FrameRing: num_slots preallocated frame slots in one multiprocessing.shared_memory block, seen as NumPy arrays
+#   by every process. A frame is copied once into a free slot, then only its descriptor FrameRef(slot, seq, shape)
+#   (a few bytes) goes through the queues. Crops are slices of the shared frame (views, no copy).
+# - slot ownership: the free slot ids are on a multiprocessing queue, put() takes one (blocks when all slots are in use:
+#   backpressure on the producer), the last stage release()s it. seq is incremented on every reuse of a slot, a stale
+#   FrameRef raises instead of silently reading another frame.
+# - staged pipeline (CLI): main process decodes into the ring -> CN detection process -> recognition process
+#   (crop / stitch, char det, 2 recognizers, correction), the stages exchange FrameRefs + boxes, never pixels.
+import os
+import time
+import queue
+import argparse
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+FrameRef = namedtuple('FrameRef', ['slot', 'seq', 'shape'])
+
+
+class FrameRing:
+    def __init__(self, num_slots=8, max_shape=(2160, 3840, 3), ctx=None):
+        """
+        Create the ring (owner process). Pass it to child processes as a Process argument, they attach to the same memory.
+
+        Args:
+            num_slots (int): Frames in flight at most.
+            max_shape: (h, w, c) of the largest frame, every slot has this size (uint8).
+            ctx: multiprocessing context of the queue, default multiprocessing.
+        """
+        ctx = ctx if ctx is not None else multiprocessing
+        self.num_slots = num_slots
+        self.max_shape = tuple(max_shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * 8 + num_slots * int(np.prod(self.max_shape)))
+        self.owner = True
+        self.free = ctx.Queue()
+        for slot in range(num_slots):
+            self.free.put(slot)
+        self.map_arrays()
+        self.seqs[:] = 0
+
+    def map_arrays(self):
+        slot_size = int(np.prod(self.max_shape))
+        self.seqs = np.ndarray((self.num_slots,), dtype=np.int64, buffer=self.shm.buf) # header: sequence number of each slot
+        self.slots = np.ndarray((self.num_slots, slot_size), dtype=np.uint8, buffer=self.shm.buf, offset=self.num_slots * 8)
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'num_slots': self.num_slots, 'max_shape': self.max_shape, 'free': self.free}
+
+    def __setstate__(self, state):
+        # child process: attach to the shared memory of the owner
+        self.num_slots = state['num_slots']
+        self.max_shape = state['max_shape']
+        self.free = state['free']
+        # the child processes share the resource tracker of the owner, only the owner unlinks the block
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.map_arrays()
+
+    def fits(self, shape):
+        return int(np.prod(shape)) <= self.slots.shape[1]
+
+    def acquire(self, shape, timeout=None):
+        """
+        Take a free slot for a frame of the given shape, blocks until one is released (queue.Empty after timeout).
+        Returns (FrameRef, writable view of the slot), e.g. to decode / resize directly into it.
+        """
+        shape = tuple(shape)
+        if not self.fits(shape):
+            raise ValueError(f"frame {shape} larger than the ring slots {self.max_shape}")
+        slot = self.free.get(timeout=timeout)
+        self.seqs[slot] += 1
+        ref = FrameRef(slot, int(self.seqs[slot]), shape)
+        return ref, self.slots[slot, :int(np.prod(shape))].reshape(shape)
+
+    def put(self, image, timeout=None):
+        # copy a frame into a free slot, returns its FrameRef
+        ref, view = self.acquire(image.shape, timeout)
+        np.copyto(view, image)
+        return ref
+
+    def get(self, ref):
+        # shared view of a frame (no copy), valid until the slot is released
+        if self.seqs[ref.slot] != ref.seq:
+            raise ValueError(f"stale FrameRef: slot {ref.slot} was reused (seq {int(self.seqs[ref.slot])} != {ref.seq})")
+        return self.slots[ref.slot, :int(np.prod(ref.shape))].reshape(ref.shape)
+
+    def crop(self, ref, box):
+        # shared view of a box [x1, y1, x2, y2] of a frame
+        x1, y1, x2, y2 = [int(v) for v in box[:4]]
+        return self.get(ref)[max(0, y1):y2, max(0, x1):x2]
+
+    def release(self, ref):
+        self.free.put(ref.slot)
+
+    def close(self):
+        self.seqs = None
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def detection_stage(ring, in_queue, out_queue, use_int8=False, roi_det=False):
+    # [(key, FrameRef)] batches -> [(key, FrameRef, boxes)] batches, None stops the stage
+    from cn_detector import CNDetector, model_path
+    from quantize_models import promoted_model_path
+    from boxes import Boxes
+    cn_detector = CNDetector(model_path=promoted_model_path('cn_det', model_path) if use_int8 else model_path, roi_mode=roi_det)
+    while True:
+        batch = in_queue.get()
+        if batch is None:
+            out_queue.put(None)
+            break
+        res_cndets = cn_detector.detect_batch([ring.get(ref) for _, ref in batch])
+        out_queue.put([(key, ref, Boxes(res_cndet).data) for (key, ref), res_cndet in zip(batch, res_cndets)])
+
+
+def recognition_stage(ring, in_queue, out_queue, rec_algo_1="ABINet", rec_algo_2="CPPD", use_gpu=False, use_int8=False):
+    # [(key, FrameRef, boxes)] batches -> (key, result) items, the frame slots are released here; None stops the stage
+    from cn_pipeline import CNPipeline, load_models, group_cn_boxes, crop_group
+    pipeline = CNPipeline(*load_models(rec_algo_1, rec_algo_2, use_gpu=use_gpu, use_int8=use_int8, cn_det=False))
+    while True:
+        batch = in_queue.get()
+        if batch is None:
+            out_queue.put(None)
+            break
+        crops = [] # (entry, crop), CN crops are views into the ring, stitched CN_ABC + CN_NUM are new images
+        results = []
+        for key, ref, boxes in batch:
+            image = ring.get(ref)
+            result = {'cn': None, 'cns': [], 'boxes': boxes.tolist(), 'status': 'no_detection' if len(boxes) == 0 else 'no_cn'}
+            for group in group_cn_boxes(boxes):
+                crop = crop_group(image, group)
+                if crop is None or crop.size == 0:
+                    continue
+                entry = {'cn': None, 'status': None, 'boxes': group.tolist()}
+                result['cns'].append(entry)
+                crops.append((entry, crop))
+            results.append((key, result))
+        for (entry, _), crop_result in zip(crops, pipeline.recognize_crops([crop for _, crop in crops])):
+            entry.update(crop_result)
+        # the crops are not used anymore, the slots can be reused
+        for _, ref, _ in batch:
+            ring.release(ref)
+        for key, result in results:
+            if result['cns']:
+                primary = next((entry for entry in result['cns'] if entry['status'] == 'ok'), result['cns'][0])
+                result.update(cn=primary['cn'], status=primary['status'])
+            out_queue.put((key, result))
+
+
+def run_staged(image_paths, num_slots=8, max_shape=(2160, 3840, 3), batch_size=4, use_gpu=False, use_int8=False, roi_det=False):
+    """
+    Recognize image files with the detection and recognition stages in separate processes, frames in a FrameRing.
+    Yields (image path, result) in completion order.
+    """
+    ctx = multiprocessing.get_context('spawn') # each stage loads and runs its own models, a forked child must not inherit runtimes that ran (see prefork.py)
+    ring = FrameRing(num_slots, max_shape, ctx=ctx)
+    det_queue, rec_queue, result_queue = ctx.Queue(), ctx.Queue(), ctx.Queue()
+    stages = [ctx.Process(target=detection_stage, args=(ring, det_queue, rec_queue, use_int8, roi_det), daemon=True),
+              ctx.Process(target=recognition_stage, args=(ring, rec_queue, result_queue, "ABINet", "CPPD", use_gpu, use_int8), daemon=True)]
+    for stage in stages:
+        stage.start()
+
+    def next_result():
+        while True:
+            try:
+                return result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if any(stage.exitcode not in (None, 0) for stage in stages):
+                    raise RuntimeError("a pipeline stage process failed, see its error above")
+
+    pending = 0
+    try:
+        batch = []
+        for path in image_paths:
+            image = cv2.imread(path)
+            if image is None or not ring.fits(image.shape):
+                print(f"Can not read image or larger than the ring slots (--max_frame_size): {path}")
+                continue
+            # all num_slots frames in flight: send the partial batch, collect finished results until a slot is free
+            if ring.free.empty() and batch:
+                det_queue.put(batch)
+                batch = []
+            while ring.free.empty() and pending > 0:
+                key, result = next_result()
+                pending -= 1
+                yield key, result
+            batch.append((path, ring.put(image)))
+            pending += 1
+            if len(batch) == batch_size:
+                det_queue.put(batch)
+                batch = []
+        if batch:
+            det_queue.put(batch)
+        det_queue.put(None)
+        while True:
+            item = next_result()
+            if item is None:
+                break
+            yield item
+    finally:
+        for stage in stages:
+            stage.join(timeout=10)
+            if stage.is_alive():
+                stage.terminate()
+        ring.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="multi-process recognition with the frames in a shared-memory ring")
+    parser.add_argument("--images_folder", required=True)
+    parser.add_argument("--num_slots", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--max_frame_size", default="3840x2160", help="WxH of the ring slots")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+    parser.add_argument("--roi_det", action="store_true")
+
+    args = parser.parse_args()
+    w, h = [int(v) for v in args.max_frame_size.lower().split('x')]
+    image_paths = sorted(os.path.join(args.images_folder, f) for f in os.listdir(args.images_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    st = time.time()
+    count = 0
+    for path, result in run_staged(image_paths, args.num_slots, (h, w, 3), args.batch_size, args.use_gpu, args.use_int8, args.roi_det):
+        count += 1
+        cns = [entry['cn'] for entry in result['cns'] if entry['cn'] is not None]
+        print(f"{os.path.basename(path)}: {', '.join(cns) or result['status']}")
+    elapsed = time.time() - st
+    print(f"{count} images in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.2f} images/s)")
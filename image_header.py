@@ -0,0 +1,48 @@
+# image_header.py
+# Read the image width & height from the file header (JPEG / PNG) without decoding the pixels.
+# Used by the data preparation scripts that only need the image shape (e.g. vertical or horizontal).
+import struct
+
+# JPEG start-of-frame markers, they carry the image size (0xC4, 0xC8, 0xCC are not frames)
+sof_markers = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_jpeg_size(file):
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD8:
+            continue # markers without payload
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        payload_start = file.tell()
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker[1] == 0xE1 and file.read(4) == b'Exif':
+            # EXIF orientation may rotate the decoded image (cv2.imread applies it), let the caller decode
+            return None
+        if marker[1] in sof_markers:
+            file.seek(payload_start)
+            data = file.read(5) # precision (1 byte), height (2 bytes), width (2 bytes)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        file.seek(payload_start + length - 2)
+
+
+def read_image_size(image_path):
+    """
+    Return (width, height) read from the image header, or None if the format is not supported
+    (the caller should decode the image instead).
+    """
+    with open(image_path, 'rb') as file:
+        head = file.read(24)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return width, height
+        if head[:2] == b'\xff\xd8':
+            return read_jpeg_size(file)
+    return None
@@ -0,0 +1,49 @@
+# inference_client.py
+# How to use: python3 inference_client.py --port 8080 --concurrency 4 image1.jpg image2.jpg ...
+# Local client for inference_service.py, sends the images concurrently and prints the results and the service stats.
+import json
+import argparse
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+
+def recognize_file(image_path, host="127.0.0.1", port=8080, deadline_ms=None):
+    with open(image_path, 'rb') as file:
+        body = file.read()
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        headers = {'Content-Type': 'application/octet-stream', 'X-Source': image_path}
+        if deadline_ms is not None:
+            headers['X-Deadline-Ms'] = str(deadline_ms)
+        connection.request('POST', '/recognize', body=body, headers=headers)
+        response = connection.getresponse()
+        return json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def get_stats(host="127.0.0.1", port=8080):
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        connection.request('GET', '/stats')
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="client for inference_service.py")
+    parser.add_argument("images", nargs='+')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--deadline_ms", type=float, default=None, help="latency budget of each request (X-Deadline-Ms)")
+
+    args = parser.parse_args()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for image_path, result in zip(args.images, executor.map(lambda p: recognize_file(p, args.host, args.port, args.deadline_ms), args.images)):
+            cns = [entry['cn'] for entry in result.get('cns', []) if entry['cn'] is not None]
+            degraded = f", degraded: {', '.join(result['degraded'])}" if result.get('degraded') else ""
+            print(f"{image_path}: {', '.join(cns) or None} ({result.get('status')}), latency {result.get('latency_ms')} ms, batch {result.get('batch_size')}{degraded}")
+    print(json.dumps(get_stats(args.host, args.port), indent=2))
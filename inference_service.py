@@ -0,0 +1,326 @@
+# inference_service.py
+# How to use: python3 inference_service.py --port 8080 --max_batch_size 8 --max_wait_ms 5
+# Local HTTP service for container number recognition, the models are loaded once and stay resident.
+# API:
+#   POST /recognize   body: encoded image bytes (jpg/png), response: JSON result (see CNPipeline.run_batch)
+#                     plus latency_ms / queue_ms / batch_size of this request
+#                     optional header X-Source: image path / name, recorded in the result store (--result_db)
+#                     optional header X-Deadline-Ms: latency budget of this request (default --deadline_ms), with a
+#                     budget optional work is skipped under load (see deadline_scheduler.py), 503 if it expired in the queue
+#   GET  /stats       request count, latency percentiles, average batch size, result cache hit rates
+# Requests arriving within max_wait_ms of each other are coalesced (micro-batching) into one CNPipeline.run_batch call,
+# so every detector / recognizer stage runs once per batch instead of once per image.
+# With --workers N (pre-fork mode, see prefork.py), the models are loaded once (not run) in a parent process
+# which forks N workers accepting on the same socket: the workers share the model memory copy-on-write and warm up
+# after the fork, /stats of a worker includes its unique / shared memory. The workers share the --cache_db file
+# (writes are queued off the request path, see result_cache.py), the memory tier of the cache is per worker.
+# Test it with inference_client.py.
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from cn_pipeline import CNPipeline, load_models, rec_model_names
+from result_cache import ResultCache
+from result_store import ResultStore
+from prefork import PreforkServer, process_memory
+from deadline_scheduler import DeadlineScheduler
+import profiling
+
+
+def warm_up(pipeline, sizes=((480, 640), (1080, 1920))):
+    # the first model calls allocate the runtime buffers and thread pools: in pre-fork mode once per worker, after the fork
+    st = time.time()
+    for h, w in sizes:
+        pipeline.run_batch([np.zeros((h, w, 3), np.uint8)] * 2)
+    print(f"Models warmed up in {time.time() - st:.3f}s.")
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5):
+        """
+        Args:
+            batch_fn: Blocking function, list of items -> list of results, runs in a single worker thread
+                (the models are not thread-safe).
+            max_batch_size (int): Max number of items per batch_fn call.
+            max_wait_ms (float): Max time the first item of a batch waits for more items.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, item):
+        # returns (result, queue time in s, batch size)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, enqueued), result in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, start - enqueued, len(batch)))
+
+
+class LatencyStats:
+    def __init__(self, window=10000):
+        self.window = window
+        self.latencies = []
+        self.batch_sizes = []
+        self.count = 0
+        self.errors = 0
+
+    def add(self, latency, batch_size):
+        self.count += 1
+        self.latencies.append(latency)
+        self.batch_sizes.append(batch_size)
+        if len(self.latencies) > self.window:
+            del self.latencies[:len(self.latencies) - self.window]
+            del self.batch_sizes[:len(self.batch_sizes) - self.window]
+
+    def summary(self):
+        summary = {'count': self.count, 'errors': self.errors}
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            for p in (50, 90, 95, 99):
+                summary[f'p{p}_ms'] = round(float(np.percentile(latencies, p)), 3)
+            summary['max_ms'] = round(float(latencies.max()), 3)
+            summary['avg_batch_size'] = round(float(np.mean(self.batch_sizes)), 3)
+        return summary
+
+
+class InferenceService:
+    def __init__(self, pipeline, max_batch_size=8, max_wait_ms=5, decode_workers=4, scheduler=None, deadline_ms=None):
+        """
+        scheduler (DeadlineScheduler): Optional, degrades the batches of requests with a deadline (deadline_ms by default).
+        """
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.deadline_ms = deadline_ms
+        self.batcher = MicroBatcher(self.run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        # decoding runs outside of the model thread
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.stats = LatencyStats()
+
+    def run_batch(self, items):
+        # items: (image, source, deadline or None, coarse image or None)
+        deadlines = [deadline for _, _, deadline, _ in items]
+        if self.scheduler is None or all(deadline is None for deadline in deadlines):
+            return self.pipeline.run_batch([image for image, _, _, _ in items], draw=False, sources=[source for _, source, _, _ in items],
+                                           coarse_images=[coarse for _, _, _, coarse in items])
+
+        run, degrade = self.scheduler.plan([deadline if deadline is not None else float('inf') for deadline in deadlines], self.batcher.depth())
+        results = [{'cn': None, 'cns': [], 'boxes': [], 'status': 'expired', 'degraded': []} for _ in items]
+        if run:
+            run_results = self.pipeline.run_batch([items[i][0] for i in run], draw=False, sources=[items[i][1] for i in run], degrade=degrade,
+                                                  coarse_images=[items[i][3] for i in run])
+            for i, result in zip(run, run_results):
+                results[i] = result
+            self.scheduler.update(run_results[0]['timings'], len(run), degrade)
+        return results
+
+    async def recognize(self, body, source=None, deadline_ms=None):
+        st = time.perf_counter()
+        deadline_ms = deadline_ms if deadline_ms is not None else self.deadline_ms
+        deadline = st + deadline_ms / 1000.0 if deadline_ms is not None else None
+        loop = asyncio.get_running_loop()
+        image, coarse = await loop.run_in_executor(self.decode_executor, self.pipeline.imdecode, body)
+        if image is None:
+            self.stats.errors += 1
+            return 400, {'error': 'can not decode image'}
+        result, queue_time, batch_size = await self.batcher.submit((image, source, deadline, coarse))
+        latency = time.perf_counter() - st
+        self.stats.add(latency, batch_size)
+        response = {k: v for k, v in result.items() if k != 'image'}
+        response.update({'latency_ms': round(latency * 1000, 3), 'queue_ms': round(queue_time * 1000, 3), 'batch_size': batch_size})
+        return (503 if result['status'] == 'expired' else 200), response
+
+    def summary(self):
+        summary = dict(self.stats.summary(), queue_depth=self.batcher.depth(), pid=os.getpid())
+        memory = process_memory()
+        if memory is not None:
+            summary['memory_mb'] = {k: round(memory[k] / 1024, 1) for k in ('rss', 'pss', 'unique', 'shared')}
+        if self.pipeline.frame_cache is not None:
+            summary['frame_cache'] = self.pipeline.frame_cache.stats()
+        if self.pipeline.crop_cache is not None:
+            summary['crop_cache'] = self.pipeline.crop_cache.stats()
+        if self.pipeline.result_store is not None:
+            summary['result_store'] = self.pipeline.result_store.stats()
+        if self.scheduler is not None:
+            summary['scheduler'] = self.scheduler.stats()
+        return summary
+
+    async def handle_connection(self, reader, writer):
+        # minimal HTTP/1.1 with keep-alive: request line, headers, Content-Length body
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'POST' and path == '/recognize':
+                    deadline_ms = float(headers['x-deadline-ms']) if 'x-deadline-ms' in headers else None
+                    try:
+                        status, response = await self.recognize(body, headers.get('x-source'), deadline_ms)
+                    except Exception as e:
+                        # a pipeline error fails the requests of its batch (see MicroBatcher.run), they still get a response
+                        self.stats.errors += 1
+                        print(f"Recognition error: {e!r}")
+                        status, response = 500, {'error': str(e)}
+                elif method == 'GET' and path == '/stats':
+                    status, response = 200, self.summary()
+                else:
+                    status, response = 404, {'error': f'unknown endpoint {method} {path}'}
+
+                payload = json.dumps(response).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError) as e:
+            print(f"Connection error: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, sock=None):
+        self.batcher.start()
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Inference service listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="local container number recognition service with micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_wait_ms", type=float, default=5)
+    parser.add_argument("--rec_algo_1", default="ABINet")
+    parser.add_argument("--rec_algo_2", default="CPPD")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+    parser.add_argument("--roi_det", action="store_true", help="ROI-first CN detection of high-resolution frames")
+    parser.add_argument("--tile", action="store_true", help="with --roi_det, detect tiles when the coarse pass finds nothing")
+    parser.add_argument("--cache_size", type=int, default=0, help="result cache entries, 0 (default) disables the cache")
+    parser.add_argument("--cache_ttl", type=float, default=3600, help="result cache TTL in seconds")
+    parser.add_argument("--cache_distance", type=int, default=0, help="max dHash distance of a near-duplicate frame (verified by thumbnail), 0 = exact duplicates only")
+    parser.add_argument("--cache_db", default=None, help="SQLite file for the persistent result cache tier")
+    parser.add_argument("--result_db", default=None, help="SQLite result store, every recognized container number is recorded")
+    parser.add_argument("--speculative_retry", action="store_true", help="recognize the original crop of a reassembled crop in the same batch")
+    parser.add_argument("--deadline_ms", type=float, default=None, help="default latency budget of a request, enables the deadline scheduler")
+    parser.add_argument("--queue_levels", default="16,32,64", help="queue depths from which retries, rec_2 and the main recognizer are degraded")
+    parser.add_argument("--light_rec_algo", default=None, help="lighter main recognizer (INT8 with --use_int8) used under the heaviest load")
+    parser.add_argument("--no_shed", action="store_true", help="run the requests past their deadline anyway (fully degraded)")
+    parser.add_argument("--workers", type=int, default=1, help="pre-fork worker processes sharing the models (CPU only)")
+    parser.add_argument("--no_warmup", action="store_true", help="pre-fork mode: workers serve without running the models first")
+    parser.add_argument("--memory_report_interval", type=float, default=60, help="pre-fork mode: seconds between memory reports, 0 disables")
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.workers > 1 and args.use_gpu:
+        parser.error("--workers > 1 (pre-fork) is CPU only, a CUDA context can not be shared by forked processes")
+
+    def make_caches(pipeline):
+        # caches & result store are per process: created after the fork in pre-fork mode
+        if args.cache_size > 0:
+            pipeline.frame_cache = ResultCache(args.cache_size, args.cache_ttl, args.cache_distance, args.cache_db)
+            # CN crops differing by one character are near-duplicates, crops are only reused on an exact match
+            pipeline.crop_cache = ResultCache(args.cache_size, args.cache_ttl, max_distance=0)
+        if args.result_db is not None:
+            pipeline.result_store = ResultStore(args.result_db)
+
+    # pre-fork: no model call in the parent, see prefork.py
+    pipeline = CNPipeline(*load_models(args.rec_algo_1, args.rec_algo_2, use_gpu=args.use_gpu, use_int8=args.use_int8,
+                                       roi_det=args.roi_det, tile=args.tile, warmup=args.workers <= 1),
+                          speculative_retry=args.speculative_retry)
+    if args.light_rec_algo is not None:
+        from text_recognizer import TextRecognizer
+        from quantize_models import promoted_model_path
+        light_model_dir = promoted_model_path(rec_model_names[args.light_rec_algo], None) if args.use_int8 else None
+        pipeline.light_text_recognizer = TextRecognizer(algo=args.light_rec_algo, use_gpu=args.use_gpu,
+                                                        model_dir=light_model_dir, use_int8=light_model_dir is not None)
+
+    def make_scheduler():
+        if args.deadline_ms is None:
+            return None
+        return DeadlineScheduler(queue_levels=[int(v) for v in args.queue_levels.split(',')],
+                                 light_rec=args.light_rec_algo is not None, shed_expired=not args.no_shed)
+
+    if args.workers <= 1:
+        make_caches(pipeline)
+        profiling.setup(pipeline, args.profile_dir, args.profile_mode, args.profile_window)
+        service = InferenceService(pipeline, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                   scheduler=make_scheduler(), deadline_ms=args.deadline_ms)
+        asyncio.run(service.serve(args.host, args.port))
+    else:
+        sock = socket.create_server((args.host, args.port), backlog=1024)
+
+        def serve_worker(index):
+            if not args.no_warmup:
+                warm_up(pipeline) # before the caches & result store, the blank warm-up images are not recorded
+            make_caches(pipeline)
+            # per worker, the window of each worker is written to its own <pid>_<date time> folder
+            profiling.setup(pipeline, args.profile_dir, args.profile_mode, args.profile_window)
+            service = InferenceService(pipeline, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                       scheduler=make_scheduler(), deadline_ms=args.deadline_ms)
+            try:
+                asyncio.run(service.serve(args.host, args.port, sock=sock))
+            finally:
+                if pipeline.result_store is not None:
+                    pipeline.result_store.close()
+                if pipeline.frame_cache is not None:
+                    pipeline.frame_cache.close()
+
+        print(f"Pre-fork mode: {args.workers} workers on {args.host}:{args.port}")
+        PreforkServer(serve_worker, args.workers, report_interval=args.memory_report_interval).run()
+        sock.close()
@@ -0,0 +1,340 @@
+# load_test.py
+# How to use: python3 load_test.py --images_folder /data/gate_images --rates 1,2,4,8 --duration 60 --report_file load_report.json
+#             python3 load_test.py --images_folder /data/gate_images --url 127.0.0.1:8080 --rates 5,10,20 --burst 30:5:4
+# Open-loop load generator for capacity planning: the images of a folder are replayed at a fixed or Poisson arrival rate
+# (optional bursts), a request is sent at its arrival time whether or not the previous ones are done, so the queueing
+# that a closed loop ("Total process time" of one image at a time) hides shows up in the latencies.
+# Targets: the pipeline in this process (InferenceService micro-batching, CNDetector -> CharDetector -> TextRecognizers)
+# or a running inference_service.py (--url).
+# For each rate: latency percentiles (from the scheduled arrival time), throughput, queue depth, drop rate
+# (client limit --max_in_flight / --max_queue, 503 expired deadlines, errors and timeouts), and over the sweep the
+# saturation throughput and the highest rate meeting --slo_ms. Saved as one JSON report (+ optional per-request CSV).
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+
+def read_images(images_folder, limit=None):
+    # [(name, encoded bytes)], read once: the disk is not part of the measurement
+    names = sorted(f for f in os.listdir(images_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    images = []
+    for name in names[:limit]:
+        with open(os.path.join(images_folder, name), 'rb') as file:
+            images.append((name, file.read()))
+    return images
+
+
+def parse_bursts(specs):
+    # "period:length:multiplier" -> (period s, length s, multiplier), e.g. 30:5:4 = 5s at 4x the rate every 30s
+    bursts = []
+    for spec in specs or []:
+        period, length, multiplier = [float(v) for v in spec.split(':')]
+        bursts.append((period, length, multiplier))
+    return bursts
+
+
+def rate_at(t, rate, bursts):
+    for period, length, multiplier in bursts:
+        if t % period < length:
+            rate *= multiplier
+    return rate
+
+
+def arrival_times(rate, duration, process='poisson', bursts=(), seed=0):
+    """
+    Scheduled arrival times in s from the start of a run.
+
+    Args:
+        rate (float): Mean requests / s outside of the bursts.
+        duration (float): Length of the run in s.
+        process (str): 'poisson' (exponential inter-arrival times) or 'fixed' (constant inter-arrival time).
+        bursts: [(period, length, multiplier)], see parse_bursts.
+    """
+    rng = np.random.default_rng(seed)
+    times = []
+    t = 0.0
+    while True:
+        current = rate_at(t, rate, bursts)
+        t += rng.exponential(1.0 / current) if process == 'poisson' else 1.0 / current
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+class PipelineTarget:
+    def __init__(self, service):
+        # service: InferenceService of this process, started in the running event loop by start()
+        self.service = service
+
+    async def start(self):
+        self.service.batcher.start()
+
+    async def send(self, name, body, deadline_ms=None):
+        return await self.service.recognize(body, name, deadline_ms)
+
+    async def queue_depth(self):
+        return self.service.batcher.depth()
+
+    async def stats(self):
+        return self.service.summary()
+
+
+class HttpTarget:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def start(self):
+        pass
+
+    async def request(self, method, path, body=b'', headers=None):
+        # one connection per request: a request never waits for the connection of another one
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}", "Connection: close"]
+            lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+            status_line = (await reader.readline()).decode('latin-1')
+            parts = status_line.split(' ', 2)
+            if len(parts) < 2 or not parts[1].isdigit():
+                # empty (connection closed without an answer) or not HTTP
+                raise ConnectionError(f"Malformed status line: {status_line!r}")
+            status = int(parts[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            return status, json.loads(await reader.readexactly(length))
+        finally:
+            writer.close()
+
+    async def send(self, name, body, deadline_ms=None):
+        headers = {'Content-Type': 'application/octet-stream', 'X-Source': name}
+        if deadline_ms is not None:
+            headers['X-Deadline-Ms'] = str(deadline_ms)
+        return await self.request('POST', '/recognize', body, headers)
+
+    async def queue_depth(self):
+        # queue of the service (of the worker that answers in pre-fork mode)
+        _, stats = await self.request('GET', '/stats')
+        return stats.get('queue_depth', 0)
+
+    async def stats(self):
+        return (await self.request('GET', '/stats'))[1]
+
+
+async def run_load(target, images, arrivals, max_in_flight=256, max_queue=None, timeout_s=30, deadline_ms=None, sample_interval=0.1):
+    """
+    Send images[k % len(images)] at arrivals[k] (s from the start), open loop.
+    Returns (requests, samples): one record per request, (t, in flight, queue depth) every sample_interval s.
+    """
+    requests = []
+    samples = []
+    in_flight = 0
+    queue_depth = 0
+    done = asyncio.Event()
+
+    async def sample_loop():
+        nonlocal queue_depth
+        while not done.is_set():
+            try:
+                queue_depth = await target.queue_depth()
+            except Exception:
+                # a failed sample keeps the last queue depth, it must not stop the sampling
+                pass
+            samples.append((time.perf_counter() - start, in_flight, queue_depth))
+            try:
+                await asyncio.wait_for(done.wait(), sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(record, name, body):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            status, response = await asyncio.wait_for(target.send(name, body, deadline_ms), timeout_s)
+            record['status'] = 'ok' if status == 200 else 'expired' if status == 503 else 'error'
+            record['queue_ms'] = response.get('queue_ms')
+            record['batch_size'] = response.get('batch_size')
+            record['degraded'] = ','.join(response.get('degraded') or [])
+        except asyncio.TimeoutError:
+            record['status'] = 'timeout'
+        except Exception as e:
+            # any failure of one request (connection, malformed answer, pipeline exception) is an error of that request
+            record['status'] = 'error'
+            print(f"Request error: {e!r}")
+        finally:
+            in_flight -= 1
+        # from the scheduled arrival: a late send (overloaded client or event loop) is counted as latency
+        record['latency_ms'] = (time.perf_counter() - start - record['scheduled_s']) * 1000
+
+    start = time.perf_counter()
+    sampler = asyncio.get_running_loop().create_task(sample_loop())
+    tasks = []
+    for k, t in enumerate(arrivals):
+        delay = start + t - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name, body = images[k % len(images)]
+        record = {'scheduled_s': t, 'lag_ms': (time.perf_counter() - start - t) * 1000, 'status': None, 'latency_ms': None,
+                  'queue_ms': None, 'batch_size': None, 'degraded': ''}
+        requests.append(record)
+        if in_flight >= max_in_flight or (max_queue is not None and queue_depth >= max_queue):
+            record['status'] = 'dropped'
+            continue
+        tasks.append(asyncio.get_running_loop().create_task(send(record, name, body)))
+    if tasks:
+        await asyncio.wait(tasks)
+    done.set()
+    await sampler
+    for record in requests:
+        record['completed_s'] = record['scheduled_s'] + record['latency_ms'] / 1000 if record['latency_ms'] is not None else None
+    return requests, samples
+
+
+def summarize(requests, samples, rate, duration):
+    statuses = [record['status'] for record in requests]
+    ok = [record for record in requests if record['status'] == 'ok']
+    end = max([record['completed_s'] for record in ok] + [duration])
+    summary = {
+        'offered_rps': rate,
+        'requests': len(requests),
+        'ok': len(ok),
+        'dropped': statuses.count('dropped'),
+        'expired': statuses.count('expired'),
+        'timeouts': statuses.count('timeout'),
+        'errors': statuses.count('error'),
+        'drop_rate': round(1 - len(ok) / max(len(requests), 1), 4),
+        # completed requests over the run, including the time to drain the queue after the last arrival
+        'throughput_rps': round(len(ok) / end, 3),
+        'degraded': sum(1 for record in ok if record['degraded']),
+    }
+    if ok:
+        latencies = np.array([record['latency_ms'] for record in ok])
+        for p in (50, 90, 95, 99):
+            summary[f'p{p}_ms'] = round(float(np.percentile(latencies, p)), 3)
+        summary['max_ms'] = round(float(latencies.max()), 3)
+        queue_ms = [record['queue_ms'] for record in ok if record['queue_ms'] is not None]
+        if queue_ms:
+            summary['queue_p95_ms'] = round(float(np.percentile(queue_ms, 95)), 3)
+        batch_sizes = [record['batch_size'] for record in ok if record['batch_size'] is not None]
+        if batch_sizes:
+            summary['avg_batch_size'] = round(float(np.mean(batch_sizes)), 3)
+    if samples:
+        in_flight = np.array([s[1] for s in samples])
+        depths = np.array([s[2] for s in samples])
+        summary.update({'queue_depth_mean': round(float(depths.mean()), 3), 'queue_depth_p95': round(float(np.percentile(depths, 95)), 3),
+                        'queue_depth_max': int(depths.max()), 'in_flight_max': int(in_flight.max())})
+    summary['lag_p99_ms'] = round(float(np.percentile([record['lag_ms'] for record in requests], 99)), 3) if requests else 0.0
+    return summary
+
+
+def capacity(runs, slo_ms, max_drop_rate):
+    # saturation throughput: the most completed requests / s of the sweep,
+    # max_rate_within_slo: the highest offered rate with p95 <= slo_ms and drop rate <= max_drop_rate
+    within = [run['offered_rps'] for run in runs if run.get('p95_ms', float('inf')) <= slo_ms and run['drop_rate'] <= max_drop_rate]
+    return {
+        'saturation_rps': max((run['throughput_rps'] for run in runs), default=0.0),
+        'max_rate_within_slo': max(within, default=None),
+        'slo_ms': slo_ms,
+        'max_drop_rate': max_drop_rate,
+    }
+
+
+def print_runs(runs):
+    print(f"{'rate/s':>8s} {'done/s':>8s} {'ok':>6s} {'drop %':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'queue p95':>9s} {'queue max':>9s}")
+    for run in runs:
+        print(f"{run['offered_rps']:8.2f} {run['throughput_rps']:8.2f} {run['ok']:6d} {run['drop_rate'] * 100:7.2f} "
+              f"{run.get('p50_ms', float('nan')):9.1f} {run.get('p95_ms', float('nan')):9.1f} {run.get('p99_ms', float('nan')):9.1f} "
+              f"{run.get('queue_depth_p95', float('nan')):9.1f} {run.get('queue_depth_max', 0):9d}")
+
+
+async def sweep(target, images, args):
+    await target.start()
+    bursts = parse_bursts(args.burst)
+    runs = []
+    csv_rows = []
+    for rate in [float(v) for v in args.rates.split(',')]:
+        arrivals = arrival_times(rate, args.duration, args.process, bursts, args.seed)
+        print(f"Rate {rate}/s: {len(arrivals)} requests over {args.duration}s ({args.process}{', bursts' if bursts else ''}) ...")
+        requests, samples = await run_load(target, images, arrivals, args.max_in_flight, args.max_queue, args.timeout_s, args.deadline_ms)
+        run = summarize(requests, samples, rate, args.duration)
+        runs.append(run)
+        csv_rows += [dict(record, rate=rate) for record in requests]
+        print_runs([run])
+        # the next rate starts with an empty queue
+        await asyncio.sleep(args.cooldown_s)
+    try:
+        target_stats = await target.stats()
+    except (OSError, ValueError):
+        target_stats = None
+    return runs, csv_rows, target_stats
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="open-loop load test of the recognition pipeline / inference_service.py")
+    parser.add_argument("--images_folder", required=True)
+    parser.add_argument("--limit", type=int, default=None, help="number of images replayed, default all")
+    parser.add_argument("--url", default=None, help="host:port of a running inference_service.py, default: the pipeline in this process")
+    parser.add_argument("--rates", default="1,2,4,8", help="comma separated arrival rates (requests/s), one run each")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of arrivals per rate")
+    parser.add_argument("--process", choices=['poisson', 'fixed'], default='poisson')
+    parser.add_argument("--burst", action='append', default=None, help="period:length:multiplier (s, s, x rate), repeatable")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max_in_flight", type=int, default=256, help="outstanding requests, more arrivals are dropped")
+    parser.add_argument("--max_queue", type=int, default=None, help="drop arrivals while the service queue is this deep")
+    parser.add_argument("--timeout_s", type=float, default=30)
+    parser.add_argument("--deadline_ms", type=float, default=None, help="latency budget of each request (deadline scheduler)")
+    parser.add_argument("--cooldown_s", type=float, default=2, help="pause between two rates")
+    parser.add_argument("--slo_ms", type=float, default=1000, help="p95 latency objective of the capacity report")
+    parser.add_argument("--max_drop_rate", type=float, default=0.01)
+    parser.add_argument("--report_file", default="load_report.json")
+    parser.add_argument("--requests_csv", default=None, help="optional per-request records")
+    # in-process target only
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_wait_ms", type=float, default=5)
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+
+    args = parser.parse_args()
+    images = read_images(args.images_folder, args.limit)
+    if not images:
+        parser.error(f"no images in {args.images_folder}")
+    print(f"{len(images)} images loaded.")
+
+    if args.url is not None:
+        host, port = args.url.rsplit(':', 1)
+        target = HttpTarget(host, int(port))
+    else:
+        from cn_pipeline import CNPipeline, load_models
+        from inference_service import InferenceService, warm_up
+        from deadline_scheduler import DeadlineScheduler
+        pipeline = CNPipeline(*load_models(use_gpu=args.use_gpu, use_int8=args.use_int8))
+        warm_up(pipeline)
+        target = PipelineTarget(InferenceService(pipeline, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                                 scheduler=DeadlineScheduler() if args.deadline_ms is not None else None))
+
+    runs, csv_rows, target_stats = asyncio.run(sweep(target, images, args))
+    report = {'config': vars(args), 'runs': runs, 'capacity': capacity(runs, args.slo_ms, args.max_drop_rate), 'target_stats': target_stats}
+    print_runs(runs)
+    print(f"Saturation throughput: {report['capacity']['saturation_rps']:.2f} requests/s, "
+          f"max rate within p95 <= {args.slo_ms:g} ms and drops <= {args.max_drop_rate:.1%}: {report['capacity']['max_rate_within_slo']}")
+    with open(args.report_file, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report saved to {args.report_file}")
+    if args.requests_csv is not None:
+        with open(args.requests_csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(csv_rows[0].keys()) if csv_rows else ['rate'])
+            writer.writeheader()
+            writer.writerows(csv_rows)
+        print(f"Per-request records saved to {args.requests_csv}")
@@ -0,0 +1,186 @@
+# pre_annotate.py
+# How to use: python3 pre_annotate.py --images_folder /data/new_gate_images --output annotations.xml --processes 4 --batch_size 16
+# Model-assisted pre-annotation: CNDetector + CharDetector + TextRecognizers over unlabeled images, written as a
+# CVAT for images 1.1 annotations.xml (import it into the CVAT task of the images) so labeling becomes a review pass:
+# - boxes CN, CN_ABC, CN_NUM, TS with source="auto", in the schema of check_cvat_annotation.py
+# - cn_text / cn_abc_text / cn_num_text (= CN[:4] / CN[-7:]) pre-filled only if the recognized container number
+#   passes the ISO 6346 format and check digit, else left empty for the annotator (and the image is listed in --review_file)
+# - ts_text is always empty and C_DIGIT boxes are not created (the detector has no C_DIGIT class)
+# Images are processed in batches (one run_batch call each) by --processes worker processes with their own models.
+import os
+import time
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from evaluate_rec import check_digit_ok
+from boxes import Boxes
+
+# label -> text attribute, see check_cvat_annotation.py
+label_attributes = {'CN': 'cn_text', 'CN_ABC': 'cn_abc_text', 'CN_NUM': 'cn_num_text', 'TS': 'ts_text', 'C_DIGIT': 'c_digit_num'}
+class_labels = {0: 'CN', 1: 'CN_ABC', 2: 'CN_NUM', 3: 'TS'}
+
+pipeline = None # of the worker process
+
+
+def init_worker(use_gpu=False, use_int8=False, roi_det=False):
+    global pipeline
+    from cn_pipeline import CNPipeline, load_models
+    pipeline = CNPipeline(*load_models(use_gpu=use_gpu, use_int8=use_int8, roi_det=roi_det))
+
+
+def box_texts(box, cn):
+    # text attribute of a box of the container number cn (None: not recognized / not verified)
+    label = class_labels[int(box[5])]
+    if cn is None or label == 'TS':
+        return label, ''
+    return label, {'CN': cn, 'CN_ABC': cn[:4], 'CN_NUM': cn[-7:]}[label]
+
+
+def annotate_result(result):
+    """
+    [(label, [x1, y1, x2, y2], text)] of the CNPipeline result of one image.
+    CN_ABC / CN_NUM boxes inside a CN box (not part of a group) get the text of that CN.
+    """
+    verified = {} # box -> verified container number
+    for entry in result['cns']:
+        cn = entry['cn'] if entry['cn'] is not None and check_digit_ok(entry['cn']) else None
+        for box in entry['boxes']:
+            verified[tuple(box[:4])] = cn
+    boxes = Boxes(result['boxes'])
+    cn_boxes = boxes.of_class(0)
+    cn_box_list = cn_boxes.tolist()
+    inside = boxes.inside_ratio(cn_boxes) if len(cn_boxes) != 0 else None
+    annotations = []
+    for k, box in enumerate(boxes.tolist()):
+        cn = verified.get(tuple(box[:4]))
+        if cn is None and inside is not None and int(box[5]) in (1, 2) and inside[k].max() >= 0.5:
+            cn = verified.get(tuple(cn_box_list[int(inside[k].argmax())][:4]))
+        label, text = box_texts(box, cn)
+        annotations.append((label, box[:4], text))
+    return annotations
+
+
+def annotate_batch(image_paths):
+    # [(image path, (width, height) or None, annotations)], runs in a worker process
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        images, coarse_images = zip(*executor.map(pipeline.imread, image_paths))
+    readable = [i for i, image in enumerate(images) if image is not None]
+    results = pipeline.run_batch([images[i] for i in readable], draw=False, coarse_images=[coarse_images[i] for i in readable]) if readable else []
+    annotated = [(path, None, []) for path in image_paths]
+    for i, result in zip(readable, results):
+        height, width = images[i].shape[:2]
+        annotated[i] = (image_paths[i], (width, height), annotate_result(result))
+    return annotated
+
+
+def make_meta(root, image_count):
+    # labels of the CVAT task, so that the file is self-describing
+    meta = ET.SubElement(root, 'meta')
+    task = ET.SubElement(meta, 'task')
+    ET.SubElement(task, 'name').text = 'pre-annotation'
+    ET.SubElement(task, 'size').text = str(image_count)
+    labels = ET.SubElement(task, 'labels')
+    for name, attribute_name in label_attributes.items():
+        label = ET.SubElement(labels, 'label')
+        ET.SubElement(label, 'name').text = name
+        attributes = ET.SubElement(label, 'attributes')
+        attribute = ET.SubElement(attributes, 'attribute')
+        ET.SubElement(attribute, 'name').text = attribute_name
+        ET.SubElement(attribute, 'mutable').text = 'False'
+        ET.SubElement(attribute, 'input_type').text = 'text'
+        ET.SubElement(attribute, 'default_value')
+        ET.SubElement(attribute, 'values')
+
+
+def pre_annotate(images_folder, output_file, batch_size=16, processes=1, use_gpu=False, use_int8=False, roi_det=False, review_file=None):
+    """
+    Pre-annotate every image of images_folder into a CVAT XML file.
+
+    Args:
+        batch_size (int): Images per CNPipeline.run_batch call.
+        processes (int): Worker processes, each loads its own models (CPU: one per few cores, GPU: 1).
+        review_file (str): Optional list of the images needing a closer look (unreadable, nothing detected,
+            or a container number without verified text).
+    """
+    names = sorted(f for f in os.listdir(images_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    batches = [[os.path.join(images_folder, name) for name in names[beg:beg + batch_size]] for beg in range(0, len(names), batch_size)]
+
+    root = ET.Element('annotations')
+    ET.SubElement(root, 'version').text = '1.1'
+    make_meta(root, len(names))
+    counts = {'images': 0, 'unreadable': 0, 'no_detection': 0, 'boxes': 0, 'texts_verified': 0, 'texts_to_type': 0}
+    review = []
+    image_id = 0
+
+    st = time.time()
+    if processes > 1:
+        # each worker loads its own models; spawn, not fork: the model runtimes are not fork-safe once they have run (see prefork.py)
+        pool = multiprocessing.get_context('spawn').Pool(processes, initializer=init_worker, initargs=(use_gpu, use_int8, roi_det))
+        batch_results = pool.imap(annotate_batch, batches)
+    else:
+        pool = None
+        init_worker(use_gpu, use_int8, roi_det)
+        batch_results = map(annotate_batch, batches)
+    try:
+        with tqdm(total=len(names), desc="Pre-annotating") as pbar:
+            for annotated in batch_results:
+                for path, size, annotations in annotated:
+                    pbar.update(1)
+                    counts['images'] += 1
+                    name = os.path.relpath(path, images_folder)
+                    if size is None:
+                        counts['unreadable'] += 1
+                        review.append(f"{name}\tunreadable")
+                        continue
+                    image = ET.SubElement(root, 'image', id=str(image_id), name=name, width=str(size[0]), height=str(size[1]))
+                    image_id += 1
+                    if not annotations:
+                        counts['no_detection'] += 1
+                        review.append(f"{name}\tno_detection")
+                    unverified = 0
+                    for label, (x1, y1, x2, y2), text in annotations:
+                        box = ET.SubElement(image, 'box', label=label, source='auto', occluded='0',
+                                            xtl=f"{x1:.2f}", ytl=f"{y1:.2f}", xbr=f"{x2:.2f}", ybr=f"{y2:.2f}", z_order='0')
+                        ET.SubElement(box, 'attribute', name=label_attributes[label]).text = text
+                        counts['boxes'] += 1
+                        if label in ('CN', 'CN_ABC', 'CN_NUM'):
+                            counts['texts_verified' if text else 'texts_to_type'] += 1
+                            unverified += not text
+                    if unverified:
+                        review.append(f"{name}\tunverified_cn")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    root.find('meta/task/size').text = str(image_id)
+    ET.indent(root)
+    ET.ElementTree(root).write(output_file, encoding='utf-8', xml_declaration=True)
+    elapsed = time.time() - st
+    print(f"{counts['images']} images in {elapsed:.2f}s ({counts['images'] / max(elapsed, 1e-9):.2f} images/s), written to {output_file}")
+    print(f"Boxes: {counts['boxes']}, CN texts verified: {counts['texts_verified']}, to type: {counts['texts_to_type']}, "
+          f"no detection: {counts['no_detection']}, unreadable: {counts['unreadable']}")
+    if review_file is not None:
+        with open(review_file, 'w') as file:
+            file.write("\n".join(review) + ("\n" if review else ""))
+        print(f"{len(review)} images to review listed in {review_file}")
+    return counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="pre-annotate unlabeled images into a CVAT annotations.xml")
+    parser.add_argument("--images_folder", required=True)
+    parser.add_argument("--output", default="annotations.xml")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, each with its own models")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+    parser.add_argument("--roi_det", action="store_true", help="ROI-first CN detection of high-resolution images")
+    parser.add_argument("--review_file", default=None, help="list of the images needing a closer look")
+
+    args = parser.parse_args()
+    pre_annotate(args.images_folder, args.output, args.batch_size, args.processes, args.use_gpu, args.use_int8, args.roi_det, args.review_file)
@@ -0,0 +1,163 @@
+# prefork.py
+# Pre-fork worker processes sharing the loaded models copy-on-write, used by inference_service.py --workers.
+# - the parent loads the models once without running them, then forks the workers: the weight pages (and the framework
+#   runtime) stay shared by all the workers as long as nobody writes to them, inference only reads the weights
+# - the model runtimes are not fork-safe once they have run (the intra-op thread pools started by the first model call
+#   do not exist in a forked child and can deadlock it), so each worker runs its warm-up after the fork; the buffers
+#   allocated by the first calls are written by every inference anyway and would not stay shared
+# - gc.freeze() before the fork: the garbage collector of a worker does not write into (and copy) the pages
+#   of the objects created by the parent
+# - a worker that dies is forked again from the parent, the models are not reloaded
+# - memory report from /proc/<pid>/smaps_rollup: unique (private) vs shared memory of the parent and each worker
+# CPU only: a CUDA context does not survive a fork.
+import os
+import gc
+import sys
+import time
+import signal
+import traceback
+
+# smaps field -> report key, kB
+smaps_fields = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared_clean',
+    'Shared_Dirty': 'shared_dirty',
+    'Private_Clean': 'private_clean',
+    'Private_Dirty': 'private_dirty',
+    'Swap': 'swap',
+}
+
+
+def process_memory(pid=None):
+    """
+    Memory of a process in kB from /proc/<pid>/smaps_rollup (all the mappings of /proc/<pid>/smaps summed up on older kernels).
+    unique: pages only this process uses (freed if it exits), shared: pages also mapped by other processes
+    (the COW model weights), pss: own pages + shared pages divided by the number of processes sharing them.
+    Returns None if /proc is not available.
+    """
+    pid = os.getpid() if pid is None else pid
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            with open(f"/proc/{pid}/{name}", 'r') as file:
+                lines = file.readlines()
+        except OSError:
+            continue
+        memory = dict.fromkeys(smaps_fields.values(), 0)
+        for line in lines:
+            key, _, value = line.partition(':')
+            if key in smaps_fields:
+                memory[smaps_fields[key]] += int(value.split()[0])
+        memory['unique'] = memory['private_clean'] + memory['private_dirty']
+        memory['shared'] = memory['shared_clean'] + memory['shared_dirty']
+        return memory
+    return None
+
+
+def memory_report(parent_pid, worker_pids):
+    """
+    Memory of the parent and the workers, in MB. total_pss is what the server really uses,
+    total_rss what it would use if every process had its own copy of the models.
+    """
+    processes = {'parent': process_memory(parent_pid)}
+    for index, pid in worker_pids.items():
+        processes[f'worker_{index}'] = process_memory(pid)
+    processes = {name: memory for name, memory in processes.items() if memory is not None}
+    report = {name: {k: round(memory[k] / 1024, 1) for k in ('rss', 'pss', 'unique', 'shared')} for name, memory in processes.items()}
+    return {
+        'processes': report,
+        'total_pss': round(sum(memory['pss'] for memory in report.values()), 1),
+        'total_rss': round(sum(memory['rss'] for memory in report.values()), 1),
+    }
+
+
+def print_memory_report(report):
+    print(f"{'process':12s} {'rss MB':>9s} {'pss MB':>9s} {'unique MB':>10s} {'shared MB':>10s}")
+    for name, memory in report['processes'].items():
+        print(f"{name:12s} {memory['rss']:9.1f} {memory['pss']:9.1f} {memory['unique']:10.1f} {memory['shared']:10.1f}")
+    print(f"Total: {report['total_pss']:.1f} MB (pss), {report['total_rss']:.1f} MB without sharing (rss).")
+
+
+class PreforkServer:
+    def __init__(self, worker_fn, num_workers, report_interval=60, restart_delay=1.0):
+        """
+        Args:
+            worker_fn: worker_fn(index), runs in each forked worker (e.g. serves requests until it is terminated).
+                Everything loaded before run() (the models) is shared, threads / files / sockets a worker writes to
+                (result store, caches) must be created in worker_fn.
+            num_workers (int): Number of worker processes.
+            report_interval (float): Seconds between two memory reports, 0 disables them.
+            restart_delay (float): Min seconds before a dead worker is forked again.
+        """
+        self.worker_fn = worker_fn
+        self.num_workers = num_workers
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+        self.workers = {} # worker index -> pid
+        self.running = True
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            # SIGTERM unwinds worker_fn (its finally blocks run, e.g. the result store is flushed)
+            signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C goes to the whole group, the parent stops the workers
+            code = 0
+            try:
+                self.worker_fn(index)
+            except SystemExit:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[index] = pid
+        print(f"Worker {index} started (pid {pid}).")
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        # everything allocated so far is shared with the workers, keep the gc from touching it
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.num_workers):
+            self.spawn(index)
+
+        next_report = time.time() + self.report_interval
+        restarts = {} # worker index -> time it may be forked again
+        while self.running:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid != 0:
+                index = next((i for i, p in self.workers.items() if p == pid), None)
+                if index is not None:
+                    del self.workers[index]
+                    print(f"Worker {index} (pid {pid}) exited with status {status}, restarting.")
+                    restarts[index] = time.time() + self.restart_delay
+            for index, at in list(restarts.items()):
+                if time.time() >= at:
+                    del restarts[index]
+                    self.spawn(index)
+            if self.report_interval > 0 and time.time() >= next_report:
+                next_report = time.time() + self.report_interval
+                print_memory_report(memory_report(os.getpid(), self.workers))
+            time.sleep(0.1 if pid == 0 else 0)
+
+        print("Stopping the workers ...")
+        for pid in self.workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.workers.values():
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.workers = {}
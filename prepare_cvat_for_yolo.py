@@ -4,6 +4,7 @@ from tqdm import tqdm
 import argparse
 import zipfile
 import tempfile
+from build_cache import BuildCache, make_key
 
 # define the paths for training set
 raw_cvat_annotation_file = '/home/osman/Downloads/export-data/annotations.xml'
@@ -16,13 +17,17 @@ output_labels_folder = '/home/osman/Downloads/export-data/1k_labels'
 # Define the interested labels, what we want to detect
 interested_labels = {'CN': 0, 'CN_ABC': 1, 'CN_NUM': 2, 'TS': 3, 'C_DIGIT': 4}
 
-def convert_cvat_to_yolo_format(raw_cvat_annotation_file, output_labels_folder):
+# change it whenever the conversion logic changes, all label files will be rebuilt
+TOOL_VERSION = 'prepare_cvat_for_yolo/1'
+
+def convert_cvat_to_yolo_format(raw_cvat_annotation_file, output_labels_folder, incremental=True):
     """
     Convert CVAT XML annotations to YOLO format.
     
     Args:
         raw_cvat_annotation_file (str): Path to the CVAT XML annotation file.
         output_labels_folder (str): Path to the folder where YOLO labels will be saved.
+        incremental (bool): Only rewrite the label files whose image size or boxes changed.
     """
     # Create the output labels folder if it doesn't exist
         
@@ -34,22 +39,30 @@ def convert_cvat_to_yolo_format(raw_cvat_annotation_file, output_labels_folder):
     root = tree.getroot()
 
     images = root.findall('image')
+    written_count = 0
 
-    for image in tqdm(images, desc="Converting to YOLO labels"):
-        image_file = image.get('name')
-        image_width = int(image.get('width'))
-        image_height = int(image.get('height'))
-        
-        label_file = os.path.join(output_labels_folder, os.path.splitext(image_file)[0] + '.txt')
-        with open(label_file, 'w') as file:
-            for box in image.findall('box'):
-                label = box.get('label')
-                if label in interested_labels:
+    cache = BuildCache(os.path.join(output_labels_folder, '.build_cache.sqlite'), 'prepare_cvat_for_yolo')
+    with cache:
+        for image in tqdm(images, desc="Converting to YOLO labels"):
+            image_file = image.get('name')
+            image_width = int(image.get('width'))
+            image_height = int(image.get('height'))
+            boxes = [(box.get('label'), box.get('xtl'), box.get('ytl'), box.get('xbr'), box.get('ybr'))
+                     for box in image.findall('box') if box.get('label') in interested_labels]
+
+            label_file = os.path.join(output_labels_folder, os.path.splitext(image_file)[0] + '.txt')
+            # a YOLO label file only depends on the image size and the boxes, not on the image bytes
+            key = make_key(TOOL_VERSION, image_width, image_height, boxes)
+            if incremental and cache.is_fresh(label_file, key):
+                continue
+
+            with open(label_file, 'w') as file:
+                for label, xtl, ytl, xbr, ybr in boxes:
                     # normalize the coordinates
-                    xtl = float(box.get('xtl')) / image_width
-                    ytl = float(box.get('ytl')) / image_height
-                    xbr = float(box.get('xbr')) / image_width
-                    ybr = float(box.get('ybr')) / image_height
+                    xtl = float(xtl) / image_width
+                    ytl = float(ytl) / image_height
+                    xbr = float(xbr) / image_width
+                    ybr = float(ybr) / image_height
                     # convert to yolo format
                     x_center = (xtl + xbr) / 2
                     y_center = (ytl + ybr) / 2
@@ -57,6 +70,10 @@ def convert_cvat_to_yolo_format(raw_cvat_annotation_file, output_labels_folder):
                     height = ybr - ytl
 
                     file.write(f"{interested_labels[label]} {x_center} {y_center} {width} {height}\n")
+            cache.update(label_file, key)
+            written_count += 1
+
+    print(f"{written_count} label files written, {len(images) - written_count} up to date.")
 
 
 
@@ -65,6 +82,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert CVAT annotations to YOLO format")
     parser.add_argument("--zip_file_path", default="/home/osman/Downloads/export-data")
     parser.add_argument("--output_labels_folder", default="/home/osman/Downloads/export-data/1k_labels")
+    parser.add_argument("--full_rebuild", action="store_true", help="ignore the build cache, rewrite every label file")
 
     args = parser.parse_args()
     
@@ -74,5 +92,5 @@ if __name__ == "__main__":
                 zip_ref.extract("annotations.xml", temp_dir)
                 xml_file_path = os.path.join(temp_dir, "annotations.xml")
                 print("converting started.")
-                convert_cvat_to_yolo_format(xml_file_path, args.output_labels_folder)
+                convert_cvat_to_yolo_format(xml_file_path, args.output_labels_folder, incremental=not args.full_rebuild)
                 print("converting done.")
\ No newline at end of file
@@ -0,0 +1,214 @@
+# profiling.py
+# How to use: python3 inference_service.py --profile_dir ./profiles [--profile_mode sample|cprofile] [--profile_window 60]
+#             CN_PROFILE=./profiles python3 workflow_main_demo.py      (any tool creating a CNPipeline through setup())
+#             kill -USR1 <pid>                                          starts another window while profiling is set up
+# On-demand profiling of the pipeline stages (cn_det, char_det, rec_1, rec_2, and pipeline for the rest of run_batch),
+# for a bounded window of --profile_window seconds, starting with the first stage call:
+# - sample: a thread samples the Python stack of the threads running a stage every 5 ms,
+#   written as collapsed stacks (one "frame;frame;frame count" line per stack), one file per stage + all.collapsed,
+#   for flamegraph.pl / speedscope / inferno
+# - cprofile: one cProfile per model stage, <stage>.prof (snakeviz, pstats) + <stage>.txt (top functions)
+# - summary.json: calls, items, total / mean / p50 / p95 time per stage (+ samples per stage in sample mode)
+# Off by default: the stage methods are only wrapped while a window is open (instance attributes, removed at the end
+# of the window), the hot path has no profiling code at all otherwise.
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import pstats
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+
+env_var = 'CN_PROFILE' # output directory, CN_PROFILE_MODE / CN_PROFILE_WINDOW optional
+
+# stage -> (CNPipeline attribute, methods), the outermost call of a stage is timed / profiled
+stage_methods = {
+    'pipeline': (None, ['run_batch']),
+    'cn_det': ('cn_detector', ['detect', 'detect_batch']),
+    'char_det': ('char_detector', ['detect', 'detect_batch']),
+    'rec_1': ('text_recognizer', ['rec', 'rec_batch']),
+    'rec_2': ('text_recognizer_2', ['rec', 'rec_batch']),
+}
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StageProfiler:
+    def __init__(self, output_dir, mode='sample', window_s=60, interval_ms=5):
+        """
+        Args:
+            output_dir (str): A sub folder <pid>_<date time> is written there at the end of each window.
+            mode (str): 'sample' (statistical, low overhead) or 'cprofile' (deterministic, every function call).
+            window_s (float): Length of a window, from the first stage call.
+            interval_ms (float): Sampling interval of the sample mode.
+        """
+        self.output_dir = output_dir
+        self.mode = mode
+        self.window_s = window_s
+        self.interval = interval_ms / 1000.0
+        self.pipeline = None
+        self.installed = []
+        self.lock = threading.RLock() # also taken by the SIGUSR1 handler
+
+    def install(self, pipeline):
+        # wrap the stage methods of the pipeline models, the window starts with the first call
+        with self.lock:
+            if self.installed:
+                return
+            self.pipeline = pipeline
+            self.window_start = None
+            self.stacks = {} # thread id -> stage stack
+            self.durations = defaultdict(list)
+            self.items = Counter()
+            self.samples = defaultdict(Counter) # stage -> collapsed stack -> samples
+            self.profiles = {}
+            for stage, (attribute, methods) in stage_methods.items():
+                owner = pipeline if attribute is None else getattr(pipeline, attribute, None)
+                if owner is None:
+                    continue
+                for method in methods:
+                    if hasattr(owner, method):
+                        setattr(owner, method, self.wrap(stage, getattr(owner, method)))
+                        self.installed.append((owner, method))
+        print(f"Profiling ({self.mode}) armed, window of {self.window_s}s from the next stage call.")
+
+    def uninstall(self):
+        for owner, method in self.installed:
+            # the instance attribute hides the class method, removing it restores the original
+            owner.__dict__.pop(method, None)
+        self.installed = []
+
+    def wrap(self, stage, fn):
+        def wrapped(*args, **kwargs):
+            if self.window_start is None:
+                self.start()
+            stack = self.stacks.setdefault(threading.get_ident(), [])
+            if stack and stack[-1] == stage:
+                # detect -> detect_batch, rec -> rec_batch: counted once
+                return fn(*args, **kwargs)
+            profile = self.profiles.get(stage) if self.mode == 'cprofile' and stage != 'pipeline' else None
+            stack.append(stage)
+            st = time.perf_counter()
+            if profile is not None:
+                profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                self.durations[stage].append(time.perf_counter() - st)
+                self.items[stage] += len(args[0]) if args and isinstance(args[0], (list, tuple)) else 1
+                stack.pop()
+        return wrapped
+
+    def start(self):
+        with self.lock:
+            if self.window_start is not None:
+                return
+            self.window_start = time.time()
+            self.stop_sampling = threading.Event()
+            if self.mode == 'cprofile':
+                self.profiles = {stage: cProfile.Profile() for stage in stage_methods if stage != 'pipeline'}
+            else:
+                self.sampler = threading.Thread(target=self.sample_loop, args=(self.stop_sampling, self.stacks, self.samples),
+                                                name="StageProfilerSampler", daemon=True)
+                self.sampler.start()
+            # the window also ends without any further call
+            timer = threading.Timer(self.window_s, self.finish)
+            timer.daemon = True
+            timer.start()
+        print(f"Profiling window started ({self.window_s}s).")
+
+    def sample_loop(self, stop, stacks, samples):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, stack in list(stacks.items()):
+                if not stack or thread_id == own or thread_id not in frames:
+                    continue
+                labels = []
+                frame = frames[thread_id]
+                while frame is not None:
+                    if frame.f_code.co_filename != __file__: # not the stage wrappers
+                        labels.append(frame_label(frame))
+                    frame = frame.f_back
+                samples[stack[-1]][";".join(stack + labels[::-1])] += 1
+
+    def finish(self):
+        with self.lock:
+            if not self.installed or self.window_start is None:
+                return
+            self.uninstall()
+            self.stop_sampling.set()
+            # a new window may be armed while this one is written
+            window_start, durations_by_stage, items, samples, profiles = self.window_start, self.durations, self.items, self.samples, self.profiles
+            sampler = self.sampler if self.mode == 'sample' else None
+        if sampler is not None:
+            sampler.join()
+        output_dir = os.path.join(self.output_dir, f"{os.getpid()}_{time.strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(output_dir, exist_ok=True)
+
+        summary = {'mode': self.mode, 'window_s': round(time.time() - window_start, 3), 'stages': {}}
+        for stage, durations in list(durations_by_stage.items()):
+            durations = np.array(durations) * 1000
+            summary['stages'][stage] = {
+                'calls': len(durations),
+                'items': items[stage],
+                'total_s': round(float(durations.sum()) / 1000, 3),
+                'mean_ms': round(float(durations.mean()), 3),
+                'p50_ms': round(float(np.percentile(durations, 50)), 3),
+                'p95_ms': round(float(np.percentile(durations, 95)), 3),
+            }
+        if self.mode == 'sample':
+            with open(os.path.join(output_dir, 'all.collapsed'), 'w') as all_file:
+                for stage, counts in samples.items():
+                    with open(os.path.join(output_dir, f'{stage}.collapsed'), 'w') as file:
+                        for stack, count in counts.most_common():
+                            file.write(f"{stack} {count}\n")
+                            all_file.write(f"{stack} {count}\n")
+                    if stage in summary['stages']:
+                        summary['stages'][stage]['samples'] = sum(counts.values())
+        else:
+            for stage, profile in profiles.items():
+                if stage not in durations_by_stage:
+                    continue
+                profile.dump_stats(os.path.join(output_dir, f'{stage}.prof'))
+                with open(os.path.join(output_dir, f'{stage}.txt'), 'w') as file:
+                    pstats.Stats(profile, stream=file).sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(output_dir, 'summary.json'), 'w') as file:
+            json.dump(summary, file, indent=2)
+
+        print(f"Profiling window finished, written to {output_dir}")
+        for stage, stats in summary['stages'].items():
+            print(f"  {stage:9s} {stats['calls']:6d} calls {stats['items']:7d} items {stats['total_s']:9.3f}s "
+                  f"mean {stats['mean_ms']:.1f} ms p95 {stats['p95_ms']:.1f} ms")
+
+
+def setup(pipeline, output_dir=None, mode=None, window_s=None, interval_ms=5):
+    """
+    Arm a profiling window on the pipeline if output_dir (CLI flag) or the CN_PROFILE environment variable is set,
+    SIGUSR1 then arms another window. Returns the StageProfiler, or None (nothing is installed).
+    """
+    output_dir = output_dir or os.environ.get(env_var)
+    if not output_dir:
+        return None
+    mode = mode or os.environ.get(env_var + '_MODE', 'sample')
+    window_s = window_s or float(os.environ.get(env_var + '_WINDOW', 60))
+    profiler = StageProfiler(output_dir, mode, window_s, interval_ms)
+    profiler.install(pipeline)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda *args: profiler.install(pipeline))
+    return profiler
+
+
+def add_arguments(parser):
+    # --profile_* flags of the tools using setup()
+    parser.add_argument("--profile_dir", default=None, help=f"profile the pipeline stages, output folder (or env {env_var})")
+    parser.add_argument("--profile_mode", choices=['sample', 'cprofile'], default=None)
+    parser.add_argument("--profile_window", type=float, default=None, help="seconds, default 60")
@@ -0,0 +1,254 @@
+# quantize_models.py
+# How to use: python3 quantize_models.py --crops_folder <cropped cn images> --frames_folder <gate images> --eval_label_file <rec_eval_label.txt> --eval_images_folder <RecEvalData>
+# Produce INT8 variants of the 4 models and promote them only if the accuracy drop is within budget:
+# 1. YOLO detectors (CN det, char det): export to ONNX, then static INT8 (calibrated) or dynamic INT8 with onnxruntime
+# 2. Paddle recognizers (ABINet, CPPD): post-training static INT8 (calibrated) or dynamic INT8 with paddleslim
+# 3. calibration data: the CN crops generated by cvat_to_pdlocrrec_label.py (char det, recognizers),
+#    full gate images for CN det (--frames_folder), each model is calibrated on the inputs it sees in production
+# 4. gate: full-string accuracy on the eval split of split_dataset_for_paddleocr_rec.py
+#    (CN det works on full images, not crops, so it is gated with ultralytics val mAP50 on --cn_det_data)
+# 5. promoted models are copied into models/int8/ (next to this file, whatever the working directory) and listed in
+#    models/int8/promoted.json, with paths relative to this folder
+import os
+import json
+import random
+import shutil
+import argparse
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+import cn_detector
+import char_detector
+from evaluate_rec import read_label_split, evaluate_recognizer
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+promoted_models_folder = os.path.join(__dir__, 'models', 'int8')
+promoted_list_file = os.path.join(promoted_models_folder, 'promoted.json')
+
+# model name: (model type, fp32 location)
+models = {
+    'cn_det': ('yolo', cn_detector.model_path),
+    'char_det': ('yolo', char_detector.model_path),
+    'abinet_rec': ('paddle', os.path.join(__dir__, 'models', 'pdlocr_abinet_rec')),
+    'cppd_rec': ('paddle', os.path.join(__dir__, 'models', 'pdlocr_cppd_rec')),
+}
+rec_algos = {'abinet_rec': 'ABINet', 'cppd_rec': 'CPPD'}
+
+
+def promoted_model_path(name, default):
+    """
+    Return the promoted INT8 model path for `name`, or `default` if none was promoted.
+    """
+    if not os.path.exists(promoted_list_file):
+        return default
+    with open(promoted_list_file, 'r') as file:
+        promoted = json.load(file)
+    if name in promoted:
+        # relative to this folder (older lists: ./models/int8/..., relative to the repository folder as well)
+        return os.path.normpath(os.path.join(__dir__, promoted[name]['path']))
+    return default
+
+
+def list_images(folder, limit):
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    random.Random(0).shuffle(files) # fixed seed, calibration set is the same on every run
+    return [os.path.join(folder, f) for f in files[:limit]]
+
+
+def letterbox(image, imgsz=640):
+    # same preprocessing as ultralytics: keep ratio, pad with 114, RGB, CHW, 0~1
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    padded[top:top + new_h, left:left + new_w] = resized
+    padded = padded[:, :, ::-1].transpose((2, 0, 1))
+    return np.ascontiguousarray(padded, dtype=np.float32)[np.newaxis, :] / 255.0
+
+
+def quantize_yolo(name, fp32_path, calib_images, output_folder, mode, imgsz=640):
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from ultralytics import YOLO
+
+    # export to onnx next to the .pt file, fixed input shape so it can be calibrated
+    onnx_path = YOLO(fp32_path).export(format='onnx', imgsz=imgsz, dynamic=False, simplify=True)
+    int8_path = os.path.join(output_folder, name, os.path.splitext(os.path.basename(fp32_path))[0] + f'_int8_{mode}.onnx')
+    os.makedirs(os.path.dirname(int8_path), exist_ok=True)
+
+    if mode == 'dynamic':
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+        return int8_path
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        def __init__(self, image_paths, input_name):
+            self.image_paths = iter(image_paths)
+            self.input_name = input_name
+
+        def get_next(self):
+            for image_path in self.image_paths:
+                image = cv2.imread(image_path)
+                if image is not None:
+                    return {self.input_name: letterbox(image, imgsz)}
+            return None
+
+    import onnxruntime
+    input_name = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(onnx_path, int8_path, ImageCalibrationReader(tqdm(calib_images, desc=f"Calibrating {name}"), input_name),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def quantize_paddle(name, fp32_dir, calib_images, output_folder, mode, recognizer, batch_size=16):
+    import paddle
+    from paddleslim.quant import quant_post_dynamic, quant_post_static
+
+    int8_dir = os.path.join(output_folder, name, f'int8_{mode}')
+    os.makedirs(int8_dir, exist_ok=True)
+
+    if mode == 'dynamic':
+        quant_post_dynamic(model_dir=fp32_dir, save_model_dir=int8_dir,
+                           model_filename='inference.pdmodel', params_filename='inference.pdiparams',
+                           save_model_filename='inference.pdmodel', save_params_filename='inference.pdiparams',
+                           weight_bits=8)
+        return int8_dir
+
+    # calibration samples are normalized exactly like TextRecognizer.rec does
+    def sample_generator():
+        for image_path in calib_images:
+            image = cv2.imread(image_path)
+            if image is not None:
+                yield (recognizer.norm_img(image),)
+
+    paddle.enable_static()
+    exe = paddle.static.Executor(paddle.CPUPlace())
+    quant_post_static(executor=exe, model_dir=fp32_dir, quantize_model_path=int8_dir,
+                      sample_generator=sample_generator,
+                      model_filename='inference.pdmodel', params_filename='inference.pdiparams',
+                      save_model_filename='inference.pdmodel', save_params_filename='inference.pdiparams',
+                      batch_size=batch_size, batch_nums=max(1, len(calib_images) // batch_size), algo='KL')
+    paddle.disable_static()
+    return int8_dir
+
+
+def full_string_accuracy(samples, char_det, recognizer, desc):
+    # same chain as workflow_main_demo.py: char det (reassemble) -> rec, top-1 text only, batched by evaluate_rec.py
+    return evaluate_recognizer(samples, char_det, recognizer, desc=desc)['full_string_accuracy']
+
+
+def cn_det_map50(model_path, data_yaml):
+    from ultralytics import YOLO
+    metrics = YOLO(model_path, task='detect').val(data=data_yaml, verbose=False)
+    return float(metrics.box.map50)
+
+
+def promote(name, int8_path, report):
+    os.makedirs(promoted_models_folder, exist_ok=True)
+    target = os.path.join(promoted_models_folder, name, os.path.basename(os.path.normpath(int8_path)))
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.isdir(int8_path):
+        shutil.copytree(int8_path, target)
+    else:
+        shutil.copy(int8_path, target)
+
+    promoted = {}
+    if os.path.exists(promoted_list_file):
+        with open(promoted_list_file, 'r') as file:
+            promoted = json.load(file)
+    promoted[name] = dict(report, path=os.path.relpath(target, __dir__))
+    with open(promoted_list_file, 'w') as file:
+        json.dump(promoted, file, indent=2)
+    print(f"{name} promoted: {target}")
+
+
+def main(args):
+    from text_recognizer import TextRecognizer
+
+    calib_images = list_images(args.crops_folder, args.calib_count)
+    # CN det runs on full gate images, its activation ranges must come from them (not from crops)
+    calib_frames = list_images(args.frames_folder, args.calib_count) if args.frames_folder is not None else []
+    samples = read_label_split(args.eval_label_file, args.eval_images_folder, args.eval_limit)
+    print(f"{len(calib_images)} calibration crops, {len(calib_frames)} calibration frames, {len(samples)} eval samples.")
+
+    # fp32 baseline chain
+    base_char_det = char_detector.CharDetector()
+    base_rec = TextRecognizer(algo="ABINet")
+    base_accuracy = full_string_accuracy(samples, base_char_det, base_rec, "Evaluating fp32")
+    print(f"fp32 full-string accuracy: {base_accuracy:.4f}")
+
+    report = {'mode': args.mode, 'max_accuracy_drop': args.max_accuracy_drop, 'fp32_accuracy': base_accuracy, 'models': {}}
+
+    for name in args.models:
+        model_type, fp32_path = models[name]
+        if name == 'cn_det' and args.mode == 'static' and len(calib_frames) == 0:
+            print("cn_det: static INT8 needs full gate images to calibrate on (--frames_folder), skipped.")
+            report['models'][name] = {'candidate': None, 'promoted': False}
+            continue
+        print(f"Quantizing {name} ({args.mode}) ...")
+        if model_type == 'yolo':
+            int8_path = quantize_yolo(name, fp32_path, calib_frames if name == 'cn_det' else calib_images, args.output_folder, args.mode)
+        else:
+            fp32_rec = base_rec if rec_algos[name] == "ABINet" else TextRecognizer(algo=rec_algos[name])
+            int8_path = quantize_paddle(name, fp32_path, calib_images, args.output_folder, args.mode, fp32_rec)
+
+        if name == 'cn_det':
+            if args.cn_det_data is None:
+                print("cn_det: no --cn_det_data given, INT8 candidate kept but not promoted.")
+                report['models'][name] = {'candidate': int8_path, 'promoted': False}
+                continue
+            base_score = cn_det_map50(fp32_path, args.cn_det_data)
+            int8_score = cn_det_map50(int8_path, args.cn_det_data)
+            metric = 'map50'
+        elif name == 'char_det':
+            base_score = base_accuracy
+            int8_score = full_string_accuracy(samples, char_detector.CharDetector(model_path=int8_path), base_rec, f"Evaluating {name}")
+            metric = 'full_string_accuracy'
+        else:
+            if rec_algos[name] == "ABINet":
+                base_score = base_accuracy
+            else:
+                base_score = full_string_accuracy(samples, base_char_det, fp32_rec, f"Evaluating {name} fp32")
+            int8_rec = TextRecognizer(algo=rec_algos[name], model_dir=int8_path, use_int8=True)
+            int8_score = full_string_accuracy(samples, base_char_det, int8_rec, f"Evaluating {name}")
+            metric = 'full_string_accuracy'
+
+        drop = base_score - int8_score
+        model_report = {'candidate': int8_path, 'metric': metric, 'fp32': base_score, 'int8': int8_score,
+                        'drop': drop, 'promoted': drop <= args.max_accuracy_drop}
+        report['models'][name] = model_report
+        print(f"{name}: {metric} fp32 {base_score:.4f}, int8 {int8_score:.4f}, drop {drop:.4f} (budget {args.max_accuracy_drop}).")
+        if model_report['promoted']:
+            promote(name, int8_path, model_report)
+        else:
+            print(f"{name}: accuracy drop over budget, not promoted.")
+
+    with open(args.report_file, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Quantization report saved: {args.report_file}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="INT8 quantization of the detectors & recognizers with an accuracy gate")
+    parser.add_argument("--crops_folder", default="/home/user/project/data/cropped_container_number_images")
+    parser.add_argument("--eval_label_file", default="/home/user/project/data/paddleocr_rec_data/rec_eval_label.txt")
+    parser.add_argument("--eval_images_folder", default="/home/user/project/data/paddleocr_rec_data/RecEvalData")
+    parser.add_argument("--frames_folder", default=None, help="full gate images, calibration data of the CN detector (static mode)")
+    parser.add_argument("--cn_det_data", default=None, help="ultralytics data yaml to gate the CN detector with mAP50")
+    parser.add_argument("--models", nargs='+', choices=list(models.keys()), default=list(models.keys()))
+    parser.add_argument("--mode", choices=['static', 'dynamic'], default='static')
+    parser.add_argument("--calib_count", type=int, default=500)
+    parser.add_argument("--eval_limit", type=int, default=99999)
+    parser.add_argument("--max_accuracy_drop", type=float, default=0.005, help="absolute drop allowed, 0.005 = 0.5%%")
+    parser.add_argument("--output_folder", default="./models/int8_candidates")
+    parser.add_argument("--report_file", default="./quantization_report.json")
+
+    args = parser.parse_args()
+    main(args)
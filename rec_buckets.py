@@ -0,0 +1,126 @@
+# rec_buckets.py
+# How to use: python3 rec_buckets.py --annotation_file annotations.xml --output ./config/rec_buckets.json
+#             python3 rec_buckets.py --labels_file cropped_container_number_labels.txt --images_folder cropped_container_number_images
+# Aspect-ratio buckets for batched text recognition, derived from the CN crops of our CVAT dataset:
+# the bucket boundaries are quantiles of the crop width / height ratio (same number of crops per bucket),
+# the input width of a bucket fits its widest crop at the model height. TextRecognizer batches the crops per bucket
+# and, when the model input width is dynamic (CPPDPadding), runs each bucket with its own width instead of padding
+# every crop to the full imgW.
+import os
+import json
+import math
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from image_header import read_image_size
+
+buckets_file = './config/rec_buckets.json'
+
+
+def crop_ratios_from_cvat(annotation_file, label='CN'):
+    # width / height of the CN boxes of a CVAT export, no image is read
+    ratios = []
+    for box in ET.parse(annotation_file).getroot().iter('box'):
+        if box.get('label') != label:
+            continue
+        w = float(box.get('xbr')) - float(box.get('xtl'))
+        h = float(box.get('ybr')) - float(box.get('ytl'))
+        if w > 0 and h > 0:
+            ratios.append(w / h)
+    return np.array(ratios)
+
+
+def crop_ratios_from_labels(labels_file, images_folder):
+    # width / height of the crops of a folder + label file dataset, from the image headers
+    ratios = []
+    with open(labels_file, 'r') as file:
+        for line in file:
+            image_name = line.split('\t', 1)[0]
+            size = read_image_size(os.path.join(images_folder, image_name))
+            if size is not None and size[1] > 0:
+                ratios.append(size[0] / size[1])
+    return np.array(ratios)
+
+
+def derive_buckets(ratios, num_buckets=4, img_h=32, min_width=32, max_width=100, align=8):
+    """
+    Equal-frequency aspect-ratio buckets.
+
+    Returns:
+        {'ratios': upper w/h bound of each bucket, 'widths': input width of each bucket (multiple of align)}
+    """
+    upper = np.quantile(ratios, np.linspace(0, 1, num_buckets + 1)[1:])
+    widths = []
+    for ratio in upper:
+        width = int(math.ceil(img_h * ratio / align) * align)
+        widths.append(min(max(width, min_width), max_width))
+    # merge the buckets ending up with the same width
+    buckets = {'ratios': [], 'widths': []}
+    for ratio, width in zip(upper.tolist(), widths):
+        if buckets['widths'] and buckets['widths'][-1] == width:
+            buckets['ratios'][-1] = round(ratio, 4)
+        else:
+            buckets['ratios'].append(round(ratio, 4))
+            buckets['widths'].append(width)
+    buckets['ratios'][-1] = float('inf') # the last bucket takes everything wider
+    return buckets
+
+
+def bucket_index(ratio, buckets):
+    return min(int(np.searchsorted(buckets['ratios'], ratio)), len(buckets['widths']) - 1)
+
+
+def padding_waste(ratios, buckets, img_h=32):
+    # fraction of the input columns that are padding (CPPDPadding resize: keep ratio, pad to the input width)
+    used = 0.0
+    total = 0.0
+    for ratio in ratios:
+        width = buckets['widths'][bucket_index(ratio, buckets)]
+        used += min(math.ceil(img_h * ratio), width)
+        total += width
+    return 1 - used / total if total else 0.0
+
+
+def save_buckets(buckets, output_file):
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'w') as file:
+        json.dump({'ratios': [r if math.isfinite(r) else None for r in buckets['ratios']], 'widths': buckets['widths']}, file, indent=2)
+
+
+def load_buckets(buckets_file=buckets_file):
+    # None if the file does not exist
+    if buckets_file is None or not os.path.exists(buckets_file):
+        return None
+    with open(buckets_file, 'r') as file:
+        data = json.load(file)
+    return {'ratios': [r if r is not None else float('inf') for r in data['ratios']], 'widths': data['widths']}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="derive aspect-ratio buckets for batched text recognition from the CN crops")
+    parser.add_argument("--annotation_file", default=None, help="CVAT XML export")
+    parser.add_argument("--labels_file", default=None, help="or a folder + label file crop dataset")
+    parser.add_argument("--images_folder", default=None)
+    parser.add_argument("--num_buckets", type=int, default=4)
+    parser.add_argument("--img_h", type=int, default=32)
+    parser.add_argument("--max_width", type=int, default=100, help="imgW of the recognizer (rec_image_shape)")
+    parser.add_argument("--output", default=buckets_file)
+
+    args = parser.parse_args()
+    if args.annotation_file is not None:
+        ratios = crop_ratios_from_cvat(args.annotation_file)
+    else:
+        ratios = crop_ratios_from_labels(args.labels_file, args.images_folder)
+    print(f"{len(ratios)} crops, w/h ratio min {ratios.min():.2f}, median {np.median(ratios):.2f}, max {ratios.max():.2f}")
+
+    buckets = derive_buckets(ratios, args.num_buckets, args.img_h, max_width=args.max_width)
+    fixed = {'ratios': [float('inf')], 'widths': [args.max_width]}
+    for ratio, width in zip(buckets['ratios'], buckets['widths']):
+        count = sum(1 for r in ratios if bucket_index(r, buckets) == buckets['widths'].index(width))
+        print(f"  w/h <= {ratio:.2f}: width {width}, {count} crops")
+    print(f"Padding waste: fixed width {args.max_width}: {padding_waste(ratios, fixed, args.img_h):.1%}, "
+          f"buckets: {padding_waste(ratios, buckets, args.img_h):.1%}")
+    save_buckets(buckets, args.output)
+    print(f"Buckets saved to {args.output}")
@@ -0,0 +1,191 @@
+# rec_shards.py
+# How to use: python3 rec_shards.py --images_folder cropped_container_number_images --labels_file cropped_container_number_labels.txt \
+#                 --output_folder rec_shards --train_ratio 0.9 --split_by source
+# Packed rec dataset: the crops & labels of a folder + label file dataset in a few large shard files,
+# so building, copying and loading the dataset no longer pays the file system cost of millions of small JPEG files.
+# Layout of a shard dataset folder:
+#   shard_00000.bin, shard_00001.bin, ...   encoded images (the original bytes, not re-encoded), written sequentially
+#   index.tsv                               one line per sample: shard \t offset \t length \t image name \t label
+# ShardReader memory-maps the shards for random access (training / evaluation), ShardWriter is used by
+# cvat_to_pdlocrrec_label.py --shards_folder to export the crops directly.
+# With --train_ratio, the samples are split into <output_folder>/train and <output_folder>/val like
+# split_dataset_for_paddleocr_rec.py (same deterministic hash split).
+import os
+import mmap
+import argparse
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+index_file_name = 'index.tsv'
+shard_size = 256 * 1024 * 1024 # bytes, a new shard is started above it
+
+
+def shard_file_name(shard):
+    return f"shard_{shard:05d}.bin"
+
+
+class ShardWriter:
+    def __init__(self, output_folder, max_shard_size=shard_size):
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        self.output_folder = output_folder
+        self.max_shard_size = max_shard_size
+        self.index = open(os.path.join(output_folder, index_file_name), 'w')
+        self.shard = -1
+        self.shard_file = None
+        self.offset = 0
+        self.count = 0
+        self.next_shard()
+
+    def next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard += 1
+        self.shard_file = open(os.path.join(self.output_folder, shard_file_name(self.shard)), 'wb')
+        self.offset = 0
+
+    def add(self, image_name, data, label):
+        """
+        Append one sample, data: encoded image bytes (e.g. the bytes of a JPEG file or of cv2.imencode).
+        """
+        if self.offset > 0 and self.offset + len(data) > self.max_shard_size:
+            self.next_shard()
+        self.shard_file.write(data)
+        self.index.write(f"{self.shard}\t{self.offset}\t{len(data)}\t{image_name}\t{label}\n")
+        self.offset += len(data)
+        self.count += 1
+
+    def close(self):
+        self.shard_file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardReader:
+    def __init__(self, shards_folder):
+        """
+        Random access to a shard dataset, reader[i] -> (BGR image, label). The shards are memory-mapped on first use,
+        separately in each process (safe with forked data loader workers).
+        """
+        self.shards_folder = shards_folder
+        shards, offsets, lengths = [], [], []
+        self.names = []
+        self.labels = []
+        with open(os.path.join(shards_folder, index_file_name), 'r') as file:
+            for line in file:
+                shard, offset, length, image_name, label = line.rstrip('\n').split('\t', 4)
+                shards.append(int(shard))
+                offsets.append(int(offset))
+                lengths.append(int(length))
+                self.names.append(image_name)
+                self.labels.append(label)
+        self.shards = np.array(shards, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.maps = {}
+        self.pid = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def shard_map(self, shard):
+        if self.pid != os.getpid():
+            # mmaps are not shared with forked processes
+            self.maps = {}
+            self.pid = os.getpid()
+        if shard not in self.maps:
+            with open(os.path.join(self.shards_folder, shard_file_name(shard)), 'rb') as file:
+                self.maps[shard] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.maps[shard]
+
+    def get_bytes(self, i):
+        # encoded image bytes of sample i, a zero copy view of the shard
+        offset = self.offsets[i]
+        return memoryview(self.shard_map(int(self.shards[i])))[offset:offset + self.lengths[i]]
+
+    def __getitem__(self, i):
+        image = cv2.imdecode(np.frombuffer(self.get_bytes(i), dtype=np.uint8), cv2.IMREAD_COLOR)
+        return image, self.labels[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        for shard_map in self.maps.values():
+            shard_map.close()
+        self.maps = {}
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def convert_to_shards(images_folder, labels_file, output_folder, train_ratio=None, split_by='source', seed='', max_shard_size=shard_size, workers=8):
+    """
+    Pack a folder + label file rec dataset (image_name \\t label lines) into shards.
+
+    Args:
+        train_ratio (float): If given, split into <output_folder>/train and <output_folder>/val
+            (same hash split as split_dataset_for_paddleocr_rec.py).
+        split_by (str): 'image' or 'source', see split_dataset_for_paddleocr_rec.py.
+        workers (int): Parallel file reads, the shards are still written sequentially in label file order.
+    """
+    from split_dataset_for_paddleocr_rec import hash_fraction, source_image_name
+
+    if train_ratio is None:
+        writers = {'all': ShardWriter(output_folder, max_shard_size)}
+    else:
+        writers = {split: ShardWriter(os.path.join(output_folder, split), max_shard_size) for split in ('train', 'val')}
+    missing = 0
+    with open(labels_file, 'r') as file, ThreadPoolExecutor(max_workers=workers) as executor, tqdm(desc="Packing rec shards") as pbar:
+        lines = (line.rstrip('\n').split('\t', 1) for line in file if line.strip())
+        while True:
+            chunk = list(islice(lines, 1024))
+            if not chunk:
+                break
+            # read the chunk in parallel, write it in order
+            futures = [executor.submit(read_bytes, os.path.join(images_folder, image_name)) for image_name, _ in chunk]
+            for (image_name, label), future in zip(chunk, futures):
+                try:
+                    data = future.result()
+                except FileNotFoundError:
+                    missing += 1
+                    continue
+                if train_ratio is None:
+                    split = 'all'
+                else:
+                    key = source_image_name(image_name) if split_by == 'source' else image_name
+                    split = 'train' if hash_fraction(key, seed) < train_ratio else 'val'
+                writers[split].add(image_name, data, label)
+                pbar.update(1)
+    for writer in writers.values():
+        writer.close()
+    counts = ", ".join(f"{split}: {writer.count} samples in {writer.shard + 1} shards" for split, writer in writers.items())
+    print(f"Rec shards written to {output_folder}. {counts}, missing images: {missing}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="pack a folder + label file rec dataset into shard files")
+    parser.add_argument("--images_folder", required=True)
+    parser.add_argument("--labels_file", required=True)
+    parser.add_argument("--output_folder", required=True)
+    parser.add_argument("--train_ratio", type=float, default=None, help="also split into train / val")
+    parser.add_argument("--split_by", choices=['image', 'source'], default='source')
+    parser.add_argument("--seed", default='')
+    parser.add_argument("--shard_size_mb", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=8)
+
+    args = parser.parse_args()
+    convert_to_shards(args.images_folder, args.labels_file, args.output_folder, train_ratio=args.train_ratio, split_by=args.split_by,
+                      seed=args.seed, max_shard_size=args.shard_size_mb * 1024 * 1024, workers=args.workers)
@@ -1,36 +1,69 @@
 import os
-import shutil
-from tqdm import tqdm
+import re
+import argparse
+from file_staging import strategies, stage_files, load_manifest
 
-def rename_images(input_folder, output_folder, prefix="image_"):
+def rename_images(input_folder, output_folder, prefix="image_", start_index=None, strategy="hardlink", workers=8):
     """
     Renames image files in the input folder and saves them in the output folder.
+    The old -> new names are kept in output_folder/rename_manifest.txt (written before a file is staged), so re-running
+    keeps the same names for already renamed files, also for the ones an interrupted run was still staging,
+    and only new files get the next free index.
 
     Args:
         input_folder (str): Path to the folder containing the original images.
         output_folder (str): Path to the folder where renamed images will be saved.
         prefix (str): Prefix for the renamed files (default is "image_").
+        start_index (int): First index for new files, default is right after the last index in the manifest
+            or of the prefix files already in output_folder (or 1). Existing files are never overwritten.
+        strategy (str): How files are staged: hardlink, symlink, reflink or copy.
+        workers (int): Number of parallel workers.
     """
     # Create the output folder if it doesn't exist
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    manifest_file = os.path.join(output_folder, "rename_manifest.txt")
+    manifest = load_manifest(manifest_file)
+
+    # continue numbering after the files renamed by previous runs, also the ones of runs without a manifest
+    name_pattern = re.compile(rf"^{re.escape(prefix)}(\d+)\.jpg$")
+    names = [os.path.basename(dst) for dst in manifest.values()] + os.listdir(output_folder)
+    used_indices = [int(m.group(1)) for m in (name_pattern.match(name) for name in names) if m]
+    next_index = max(used_indices) + 1 if used_indices else 1
+    if start_index is not None:
+        next_index = max(next_index, start_index)
+
     # Get a list of all files in the input folder
     files = sorted([f for f in os.listdir(input_folder) if f.endswith('.jpg')])
 
-    # Rename and copy each file
-    for i, filename in enumerate(tqdm(files, desc="Renaming files", unit="file"), start=1185):
-        # Generate the new filename
-        new_filename = f"{prefix}{i:04d}.jpg"  # e.g., image_0001.jpg, image_0002.jpg
-
+    pairs = []
+    for filename in files:
         # Full paths for the input and output files
         input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, new_filename)
+        if input_path in manifest:
+            output_path = manifest[input_path]
+        else:
+            # Generate the new filename
+            new_filename = f"{prefix}{next_index:04d}.jpg"  # e.g., image_0001.jpg, image_0002.jpg
+            output_path = os.path.join(output_folder, new_filename)
+            next_index += 1
+        pairs.append((input_path, output_path))
+
+    # Stage and rename each file
+    staged, skipped = stage_files(pairs, strategy=strategy, workers=workers, manifest_file=manifest_file, desc="Renaming files")
+    print(f"{staged} files renamed, {skipped} already done.")
+
+if __name__ == "__main__":
 
-        # Copy and rename the file
-        shutil.copy(input_path, output_path)
+    parser = argparse.ArgumentParser(description="rename images with a prefix and a running index")
+    parser.add_argument("--input_folder", default="/home/osman/Downloads/Dataset/ContainerNum_dataset/train/images")
+    parser.add_argument("--output_folder", default="/home/osman/Downloads/Dataset/CCMS/renamed_ContainerNum_dataset")
+    parser.add_argument("--prefix", default="container_")
+    parser.add_argument("--start_index", type=int, default=None)
+    parser.add_argument("--strategy", choices=strategies, default="hardlink")
+    parser.add_argument("--workers", type=int, default=8)
 
-# Example usage
-input_folder = "/home/osman/Downloads/Dataset/ContainerNum_dataset/train/images"  # Replace with the path to your input folder
-output_folder = "/home/osman/Downloads/Dataset/CCMS/renamed_ContainerNum_dataset"
-rename_images(input_folder, output_folder, prefix="container_")
+    args = parser.parse_args()
+    rename_images(args.input_folder, args.output_folder, prefix=args.prefix, start_index=args.start_index,
+                  strategy=args.strategy, workers=args.workers)
@@ -0,0 +1,279 @@
+# result_cache.py
+# Result cache for duplicate & near-duplicate gate images (burst captures, re-sent images).
+# - max_distance 0 (default): exact duplicates only, the key is a digest of the pixel content
+# - max_distance > 0: near-duplicates, the key is a 64-bit difference hash (dHash) of the input frame or of the cropped
+#   CN image, found by Hamming distance <= max_distance (4 x 16-bit band index, so a lookup never scans the whole cache).
+#   A 9x8 dHash can not tell apart two container numbers differing by one digit, so every dHash hit is verified
+#   against a grayscale thumbnail of the cached image before its result is reused.
+# Tier 1: in-memory LRU with bounded size and TTL. Tier 2 (optional): SQLite file in WAL mode, survives restarts and
+# can be shared by several processes: put() only queues the disk write, a writer thread inserts the queued entries in
+# one transaction per batch (like result_store.py), so a lookup never waits for the lock of another process.
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+num_bands = 4
+band_bits = 16
+band_mask = (1 << band_bits) - 1
+
+
+def dhash(image):
+    # 64-bit difference hash: 9x8 grayscale thumbnail, one bit per horizontal neighbour comparison
+    if image.shape[0] > 64 and image.shape[1] > 72:
+        # cheap subsampling first, resizing a full-resolution frame with INTER_AREA is the expensive part
+        step = max(1, min(image.shape[0] // 64, image.shape[1] // 72))
+        image = image[::step, ::step]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def digest(image):
+    # 64-bit digest of the exact pixel content (and shape)
+    data = np.ascontiguousarray(image)
+    h = hashlib.blake2b(data, digest_size=8)
+    h.update(str(data.shape).encode('ascii'))
+    return int.from_bytes(h.digest(), 'big')
+
+
+def thumbnail(image, size=128):
+    # grayscale, longest side size, aspect ratio kept: the characters of a CN crop stay a few pixels wide
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = size / max(gray.shape[:2])
+    return cv2.resize(gray, (max(8, round(gray.shape[1] * scale)), max(8, round(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+
+def thumbnails_match(a, b, max_diff=24):
+    # same image up to noise / JPEG / a global brightness change: the largest pixel difference stays small,
+    # one different character gives differences of 70+ (the mean difference would hide it)
+    if a is None or b is None or a.shape != b.shape:
+        return False
+    diff = a.astype(np.int16) - b.astype(np.int16)
+    diff -= int(round(float(diff.mean())))
+    return int(np.abs(diff).max()) <= max_diff
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def bands(h):
+    return [(h >> (i * band_bits)) & band_mask for i in range(num_bands)]
+
+
+def to_signed(h):
+    # SQLite integers are signed 64-bit
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def to_unsigned(h):
+    return h + (1 << 64) if h < 0 else h
+
+
+class ResultCache:
+    def __init__(self, max_size=10000, ttl_s=3600, max_distance=0, db_path=None, max_thumbnail_diff=24,
+                 batch_size=256, flush_interval_s=0.5, max_queue=10000):
+        """
+        Args:
+            max_size (int): Max entries in memory, least recently used are evicted.
+            ttl_s (float): Entries older than this are expired (memory and disk).
+            max_distance (int): Max dHash Hamming distance of a near-duplicate, 0 = exact content match only.
+                Near-duplicate hits are only used if the thumbnails match. <= 3 is always found by the band index
+                (pigeonhole), 4 is found unless each band differs by exactly one bit.
+            db_path (str): Optional SQLite file for the disk tier.
+            max_thumbnail_diff (int): Max pixel difference of the thumbnails of a dHash hit, see thumbnails_match.
+            batch_size, flush_interval_s, max_queue: Disk writes, see ResultStore (entries beyond max_queue are only kept in memory).
+        """
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+        self.max_thumbnail_diff = max_thumbnail_diff
+        self.entries = OrderedDict() # hash -> (value, timestamp, thumbnail)
+        self.band_index = [dict() for _ in range(num_bands)] # band value -> set of hashes
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'near_hits': 0, 'disk_hits': 0, 'misses': 0, 'rejected': 0, 'evictions': 0, 'expirations': 0,
+                        'disk_written': 0, 'disk_dropped': 0}
+
+        self.db = None
+        if db_path is not None:
+            self.db_path = db_path
+            self.batch_size = batch_size
+            self.flush_interval_s = flush_interval_s
+            self.queue = queue.Queue(maxsize=max_queue)
+            self.db = self.connect() # lookups, under self.lock
+            self.db.execute("BEGIN IMMEDIATE") # other processes may open the same file at the same time
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (hash INTEGER PRIMARY KEY, b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, value TEXT, ts REAL, thumb BLOB)")
+            if 'thumb' not in [row[1] for row in self.db.execute("PRAGMA table_info(results)")]:
+                # file of an older version, its entries have no thumbnail and never match a dHash lookup
+                self.db.execute("ALTER TABLE results ADD COLUMN thumb BLOB")
+            for i in range(num_bands):
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS idx_b{i} ON results (b{i})")
+            self.db.execute("DELETE FROM results WHERE ts < ?", (time.time() - ttl_s,))
+            self.db.commit()
+            self.closed = False
+            self.writer = threading.Thread(target=self.write_loop, name="ResultCacheWriter", daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def fingerprint(self, image):
+        # (key, thumbnail) of an image for get / put: content digest for exact matching, dHash + thumbnail otherwise
+        if self.max_distance == 0:
+            return digest(image), None
+        return dhash(image), thumbnail(image)
+
+    def verified(self, thumb, cached_thumb):
+        # a digest hit is the same content, a dHash hit (even at distance 0) must also have a matching thumbnail
+        if self.max_distance == 0 or thumbnails_match(thumb, cached_thumb, self.max_thumbnail_diff):
+            return True
+        self.metrics['rejected'] += 1
+        return False
+
+    def get(self, h, thumb=None):
+        """
+        Return the cached value of key h (see fingerprint) or of a verified near-duplicate, None on a miss.
+        Every hit is a new copy decoded from JSON, the same types (lists, not tuples) from memory and from disk,
+        so a caller can modify it without changing the cached entry.
+        """
+        now = time.time()
+        with self.lock:
+            data = self.get_memory(h, thumb, now)
+            if data is not None:
+                return json.loads(data)
+            if self.db is not None:
+                data = self.get_disk(h, thumb, now)
+                if data is not None:
+                    self.metrics['disk_hits'] += 1
+                    self.put_memory(h, data, now, thumb)
+                    return json.loads(data)
+            self.metrics['misses'] += 1
+            return None
+
+    def put(self, h, value, thumb=None):
+        now = time.time()
+        # values are kept as JSON in both tiers
+        data = json.dumps(value)
+        with self.lock:
+            self.put_memory(h, data, now, thumb)
+        if self.db is not None:
+            thumb_png = cv2.imencode('.png', thumb)[1].tobytes() if thumb is not None else None
+            try:
+                self.queue.put_nowait([to_signed(h)] + bands(h) + [data, now, thumb_png])
+            except queue.Full:
+                self.metrics['disk_dropped'] += 1
+
+    def write_loop(self):
+        db = self.connect()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            rows = [item]
+            deadline = time.time() + self.flush_interval_s
+            stop = False
+            # collect more entries until batch_size rows or flush_interval_s
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                rows.append(item)
+            try:
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO results (hash, b0, b1, b2, b3, value, ts, thumb) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.metrics['disk_written'] += len(rows)
+            except sqlite3.Error as e:
+                print(f"Result cache write error ({len(rows)} entries not persisted): {e}")
+            if stop:
+                break
+        db.close()
+
+    def close(self):
+        # write the queued entries and stop the writer
+        if self.db is None or self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+
+    def get_memory(self, h, thumb, now):
+        if self.max_distance == 0:
+            candidates = [h] if h in self.entries else []
+        else:
+            candidates = set()
+            for i, band in enumerate(bands(h)):
+                candidates.update(self.band_index[i].get(band, ()))
+            # nearest first, the first verified candidate is used
+            candidates = sorted((c for c in candidates if hamming(h, c) <= self.max_distance), key=lambda c: hamming(h, c))
+        for candidate in candidates:
+            data, ts, cached_thumb = self.entries[candidate]
+            if now - ts > self.ttl_s:
+                self.remove(candidate)
+                self.metrics['expirations'] += 1
+                continue
+            if not self.verified(thumb, cached_thumb):
+                continue
+            self.entries.move_to_end(candidate)
+            self.metrics['hits' if candidate == h else 'near_hits'] += 1
+            return data
+        return None
+
+    def get_disk(self, h, thumb, now):
+        if self.max_distance == 0:
+            rows = self.db.execute("SELECT hash, value, thumb FROM results WHERE hash = ? AND ts >= ?", (to_signed(h), now - self.ttl_s)).fetchall()
+        else:
+            rows = self.db.execute("SELECT hash, value, thumb FROM results WHERE (b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?) AND ts >= ?",
+                                   bands(h) + [now - self.ttl_s]).fetchall()
+        rows = sorted((hamming(h, to_unsigned(candidate)), value, cached_thumb) for candidate, value, cached_thumb in rows)
+        for distance, value, cached_thumb in rows:
+            if distance > self.max_distance:
+                break
+            cached_thumb = cv2.imdecode(np.frombuffer(cached_thumb, np.uint8), cv2.IMREAD_GRAYSCALE) if cached_thumb is not None else None
+            if self.verified(thumb, cached_thumb):
+                return value
+        return None
+
+    def put_memory(self, h, data, now, thumb=None):
+        if h in self.entries:
+            self.remove(h)
+        self.entries[h] = (data, now, thumb)
+        for i, band in enumerate(bands(h)):
+            self.band_index[i].setdefault(band, set()).add(h)
+        while len(self.entries) > self.max_size:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.metrics['evictions'] += 1
+
+    def remove(self, h):
+        del self.entries[h]
+        for i, band in enumerate(bands(h)):
+            hashes = self.band_index[i].get(band)
+            if hashes is not None:
+                hashes.discard(h)
+                if not hashes:
+                    del self.band_index[i][band]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.metrics['hits'] + self.metrics['near_hits'] + self.metrics['disk_hits'] + self.metrics['misses']
+            hit_rate = (lookups - self.metrics['misses']) / lookups if lookups else 0.0
+            return dict(self.metrics, size=len(self.entries), hit_rate=round(hit_rate, 4))
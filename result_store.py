@@ -0,0 +1,209 @@
+# result_store.py
+# How to use: python3 result_store.py --db gate_results.sqlite --last_seen MSCU1234567
+#             python3 result_store.py --db gate_results.sqlite --cn MSCU1234567 --since 2024-01-01
+#             python3 result_store.py --db gate_results.sqlite --since "2024-05-01 08:00" --until "2024-05-01 09:00"
+# Persistent store of the recognition results (one row per recognized container number), SQLite in WAL mode:
+# - add() only puts the result on a queue, a writer thread inserts the queued results in one transaction per batch,
+#   so the inference path never waits for the disk (results are dropped and counted if the queue is full)
+# - indexed by (cn, ts) and ts: "when was MSCU1234567 last seen" is an index lookup, whatever the table size
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+schema = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    source TEXT,
+    image_hash TEXT,
+    cn TEXT,
+    cn_1 TEXT,
+    conf_1 REAL,
+    cn_2 TEXT,
+    conf_2 REAL,
+    status TEXT,
+    cached TEXT,
+    boxes TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_cn_ts ON results (cn, ts);
+CREATE INDEX IF NOT EXISTS idx_results_ts ON results (ts);
+"""
+
+columns = ['ts', 'source', 'image_hash', 'cn', 'cn_1', 'conf_1', 'cn_2', 'conf_2', 'status', 'cached', 'boxes', 'timings']
+
+
+def result_rows(result, source=None, image_hash=None, ts=None):
+    # one row per container number of a CNPipeline result, one row with the status if none was found
+    ts = time.time() if ts is None else ts
+    entries = result.get('cns') or [{k: result.get(k) for k in ('cn', 'cn_1', 'cn_2', 'status', 'cached', 'boxes')}]
+    timings = json.dumps({k: round(v, 6) for k, v in result.get('timings', {}).items()})
+    rows = []
+    for entry in entries:
+        cn_1 = entry.get('cn_1') or (None, None)
+        cn_2 = entry.get('cn_2') or (None, None)
+        rows.append((ts, source, image_hash, entry.get('cn'), cn_1[0], cn_1[1], cn_2[0], cn_2[1],
+                     entry.get('status'), entry.get('cached'), json.dumps(entry.get('boxes') or []), timings))
+    return rows
+
+
+class ResultStore:
+    def __init__(self, db_path, batch_size=256, flush_interval_s=0.5, max_queue=10000):
+        """
+        Args:
+            db_path (str): SQLite file, created if missing.
+            batch_size (int): Max rows per write transaction.
+            flush_interval_s (float): Max time a result waits in the queue before it is written.
+            max_queue (int): Max queued results, add() drops results beyond it instead of blocking.
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.metrics = {'written': 0, 'dropped': 0, 'batches': 0}
+
+        db = self.connect()
+        db.executescript(schema)
+        db.commit()
+        db.close()
+        # readers get their own connection per thread, WAL lets them read while the writer writes
+        self.local = threading.local()
+
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_loop, name="ResultStoreWriter", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL: a crash may lose the last transactions, never corrupts
+        return db
+
+    def reader(self):
+        if getattr(self.local, 'db', None) is None:
+            self.local.db = self.connect()
+        return self.local.db
+
+    def add(self, result, source=None, image_hash=None, ts=None):
+        """
+        Queue a CNPipeline result, never blocks. Returns False if the queue is full and the result is dropped.
+        """
+        try:
+            self.queue.put_nowait(result_rows(result, source, image_hash, ts))
+            return True
+        except queue.Full:
+            self.metrics['dropped'] += 1
+            return False
+
+    def write_loop(self):
+        db = self.connect()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            rows = list(item)
+            deadline = time.time() + self.flush_interval_s
+            stop = False
+            # collect more results until batch_size rows or flush_interval_s
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                rows += item
+            try:
+                with db:
+                    db.executemany(f"INSERT INTO results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+                self.metrics['written'] += len(rows)
+                self.metrics['batches'] += 1
+            except sqlite3.Error as e:
+                print(f"Result store write error ({len(rows)} rows lost): {e}")
+            if stop:
+                break
+        db.close()
+
+    def close(self):
+        # write the queued results and stop the writer
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+
+    def query(self, sql, params=()):
+        cursor = self.reader().execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        records = []
+        for row in cursor.fetchall():
+            record = dict(zip(names, row))
+            record['boxes'] = json.loads(record['boxes']) if record.get('boxes') else []
+            record['timings'] = json.loads(record['timings']) if record.get('timings') else {}
+            records.append(record)
+        return records
+
+    def last_seen(self, cn):
+        # latest record of a container number, None if never seen
+        records = self.query("SELECT * FROM results WHERE cn = ? ORDER BY ts DESC LIMIT 1", (cn,))
+        return records[0] if records else None
+
+    def history(self, cn, since=None, until=None, limit=100):
+        # records of a container number, newest first
+        records = self.query("SELECT * FROM results WHERE cn = ? AND ts >= ? AND ts < ? ORDER BY ts DESC LIMIT ?",
+                             (cn, since or 0, until or float('inf'), limit))
+        return records
+
+    def between(self, since, until=None, limit=1000):
+        # all records in a time range, newest first
+        return self.query("SELECT * FROM results WHERE ts >= ? AND ts < ? ORDER BY ts DESC LIMIT ?",
+                          (since, until or float('inf'), limit))
+
+    def stats(self):
+        return dict(self.metrics, queued=self.queue.qsize())
+
+
+def parse_time(text):
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="query the container number result store")
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--last_seen", default=None, help="container number")
+    parser.add_argument("--cn", default=None, help="history of a container number")
+    parser.add_argument("--since", default=None, help="unix time or ISO date/time")
+    parser.add_argument("--until", default=None, help="unix time or ISO date/time")
+    parser.add_argument("--limit", type=int, default=100)
+
+    args = parser.parse_args()
+    store = ResultStore(args.db)
+    st = time.time()
+    if args.last_seen is not None:
+        records = [record for record in [store.last_seen(args.last_seen)] if record is not None]
+    elif args.cn is not None:
+        records = store.history(args.cn, parse_time(args.since), parse_time(args.until), args.limit)
+    else:
+        records = store.between(parse_time(args.since) or 0, parse_time(args.until), args.limit)
+    elapsed = time.time() - st
+    for record in records:
+        seen = datetime.fromtimestamp(record['ts']).isoformat(sep=' ', timespec='seconds')
+        print(f"{seen}  {record['cn']}  {record['status']}  {record['source'] or ''}  ({record['cn_1']} {record['conf_1']}, {record['cn_2']} {record['conf_2']})")
+    print(f"{len(records)} records, query took {elapsed * 1000:.2f} ms")
+    store.close()
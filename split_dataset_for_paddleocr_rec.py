@@ -1,9 +1,15 @@
 # step 3: split_dataset_for_paddleocr_rec.py
-# How to use: python3 split_dataset_for_paddleocr_rec.py
+# How to use: python3 split_dataset_for_paddleocr_rec.py --train_ratio 0.9 --split_by source --strategy hardlink
+# The split is deterministic: every image goes to train or val by a stable hash of its name (or of its source image),
+# so the same label file gives the same split on every run, and new images never move old ones across splits.
+# The label file is read line by line, memory usage does not grow with the dataset size.
+# Incremental by default: images already staged from the same bytes are skipped (see build_cache.py).
 import os
-import random
-from shutil import copyfile
-from tqdm import tqdm
+import re
+import hashlib
+import argparse
+from file_staging import strategies, stage_files
+from build_cache import BuildCache, make_key
 
 images_path = '/home/user/project/data/updated_cropped_images'
 labels_path = '/home/user/project/data/cropped_container_number_labels.txt'
@@ -12,34 +18,103 @@ val_images_path = '/home/user/project/data/paddleocr_rec_data/RecEvalData'
 train_labels_path = '/home/user/project/data/paddleocr_rec_data/rec_train_label.txt'
 val_labels_path = '/home/user/project/data/paddleocr_rec_data/rec_eval_label.txt'
 
-def split_dataset(total_images, train_ratio, images_folder, labels_file, train_images_folder, val_images_folder, train_labels_file, val_labels_file):
-    with open(labels_file, 'r') as file:
-        lines = file.readlines()
+# change it whenever the staging logic changes, all images will be staged again
+TOOL_VERSION = 'split_dataset_for_paddleocr_rec/1'
 
-    total_images = min(total_images, len(lines))
+# crops are named {source image}_{cn_count:02}.jpg by cvat_to_pdlocrrec_label.py
+crop_name_pattern = re.compile(r'^(.*)_\d{2,}$')
 
-    train_indices = set(random.sample(range(total_images), int(total_images * train_ratio)))
 
+def source_image_name(image_name):
+    base_name = os.path.splitext(image_name)[0]
+    match = crop_name_pattern.match(base_name)
+    return match.group(1) if match else base_name
+
+
+def hash_fraction(key, seed=''):
+    # stable across runs, machines and python versions (unlike hash()), uniform in [0, 1)
+    digest = hashlib.blake2b(f"{seed}{key}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+def split_dataset(total_images, train_ratio, images_folder, labels_file, train_images_folder, val_images_folder, train_labels_file, val_labels_file,
+                  split_by='image', strategy='copy', seed='', workers=8, incremental=True):
+    """
+    Split the rec dataset into train and val, streaming the label file.
+
+    Args:
+        total_images (int): Max number of label lines to process.
+        train_ratio (float): Fraction of the images (or source images) used for training.
+        split_by (str): 'image' hashes the crop name, 'source' hashes the source image name,
+            so all crops of one photo land in the same split.
+        strategy (str): How images are staged: hardlink, symlink, reflink or copy, see file_staging.py.
+        seed (str): Change it to get another (still reproducible) split.
+        workers (int): Number of parallel staging workers.
+        incremental (bool): Skip the images already staged from the same bytes.
+    """
     if not os.path.exists(train_images_folder):
         os.makedirs(train_images_folder)
     if not os.path.exists(val_images_folder):
         os.makedirs(val_images_folder)
 
-    with open(train_labels_file, 'w') as train_labels, open(val_labels_file, 'w') as val_labels:
-        for i in tqdm(range(total_images), desc="Splitting dataset"):
-            line = lines[i]
-            image_name, label = line.split('\t')
-            source_image_path = os.path.join(images_folder, image_name)
+    counts = {'train': 0, 'val': 0, 'skipped': 0}
+    staged = []
+    cache = BuildCache(os.path.join(os.path.dirname(os.path.abspath(train_labels_file)), '.build_cache.sqlite'), 'split_dataset_for_paddleocr_rec')
+    with cache, open(labels_file, 'r') as file, open(train_labels_file, 'w') as train_labels, open(val_labels_file, 'w') as val_labels:
+        def split_pairs():
+            # generator, the label file is consumed as the images are staged
+            for i, line in enumerate(file):
+                if i >= total_images:
+                    break
+                image_name, label = line.split('\t')
+                source_image_path = os.path.join(images_folder, image_name)
+
+                key = source_image_name(image_name) if split_by == 'source' else image_name
+                if hash_fraction(key, seed) < train_ratio:
+                    train_labels.write(line)
+                    counts['train'] += 1
+                    target_image_path = os.path.join(train_images_folder, image_name)
+                else:
+                    val_labels.write(line)
+                    counts['val'] += 1
+                    target_image_path = os.path.join(val_images_folder, image_name)
+
+                build_key = make_key(TOOL_VERSION, strategy, cache.file_digest(source_image_path))
+                if incremental and cache.is_fresh(target_image_path, build_key):
+                    counts['skipped'] += 1
+                    continue
+                staged.append((target_image_path, build_key))
+                yield source_image_path, target_image_path
+
+        stage_files(split_pairs(), strategy=strategy, workers=workers, desc="Splitting dataset")
+        for target_image_path, build_key in staged:
+            cache.update(target_image_path, build_key)
+
+    print(f"Dataset split done. train: {counts['train']}, val: {counts['val']}, up to date: {counts['skipped']}")
+
 
-            if i in train_indices:
-                copyfile(source_image_path, os.path.join(train_images_folder, image_name))
-                train_labels.write(line)
-            else:
-                copyfile(source_image_path, os.path.join(val_images_folder, image_name))
-                val_labels.write(line)
+if __name__ == "__main__":
 
-    print("Dataset split done.")
+    parser = argparse.ArgumentParser(description="split the cropped CN dataset for PaddleOCR rec training")
+    parser.add_argument("--images_folder", default=images_path)
+    parser.add_argument("--labels_file", default=labels_path)
+    parser.add_argument("--train_images_folder", default=train_images_path)
+    parser.add_argument("--val_images_folder", default=val_images_path)
+    parser.add_argument("--train_labels_file", default=train_labels_path)
+    parser.add_argument("--val_labels_file", default=val_labels_path)
+    # change the total_images and train_ratio to fit your dataset
+    # train_ratio = 0.9 means 90% of the images will be used for training, 10% for validation
+    parser.add_argument("--total_images", type=int, default=99999)
+    parser.add_argument("--train_ratio", type=float, default=0.9)
+    parser.add_argument("--split_by", choices=['image', 'source'], default='source')
+    parser.add_argument("--strategy", choices=strategies, default='hardlink')
+    parser.add_argument("--seed", default='')
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--full_rebuild", action="store_true", help="ignore the build cache, stage every image")
 
-# change the total_images and train_ratio to fit your dataset
-# train_ratio = 0.9 means 90% of the images will be used for training, 10% for validation
-split_dataset(total_images=99999, train_ratio=0.9, images_folder=images_path, labels_file=labels_path, train_images_folder=train_images_path, val_images_folder=val_images_path, train_labels_file=train_labels_path, val_labels_file=val_labels_path)
+    args = parser.parse_args()
+    split_dataset(total_images=args.total_images, train_ratio=args.train_ratio, images_folder=args.images_folder, labels_file=args.labels_file,
+                  train_images_folder=args.train_images_folder, val_images_folder=args.val_images_folder,
+                  train_labels_file=args.train_labels_file, val_labels_file=args.val_labels_file,
+                  split_by=args.split_by, strategy=args.strategy, seed=args.seed, workers=args.workers,
+                  incremental=not args.full_rebuild)
@@ -0,0 +1,229 @@
+# stream_recognition.py
+# How to use: python3 stream_recognition.py --source gate_cam.mp4 --det_every 2 --crops_per_track 3 --output results.jsonl
+#             (--source 0 for the first camera)
+# Video / frame stream mode:
+# 1. CNDetector runs on every Nth frame
+# 2. container numbers (CN boxes and CN_ABC & CN_NUM pairs) are tracked across frames with a lightweight IoU tracker
+# 3. each track keeps only its sharpest crops (variance of Laplacian)
+# 4. when a track ends, its crops go through CharDetector + TextRecognizers in one batch and the results are voted
+# Recognizer work scales with the number of containers, not with the number of frames.
+import json
+import time
+import argparse
+from collections import Counter
+import cv2
+import numpy as np
+
+from cn_pipeline import CNPipeline, load_models, group_cn_boxes, crop_group, WRONG_CN
+from boxes import iou_matrix
+import profiling
+
+
+def sharpness(image):
+    # variance of the Laplacian, higher is sharper
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+class Track:
+    def __init__(self, track_id, group, frame_index):
+        self.track_id = track_id
+        self.group = group
+        self.box = group.union()
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.hits = 0
+        self.misses = 0 # detection passes since the last match
+        self.crops = [] # [(sharpness, crop)], sharpest first
+
+    def add(self, group, frame_index, crop, max_crops):
+        self.group = group
+        self.box = group.union()
+        self.last_frame = frame_index
+        self.hits += 1
+        self.misses = 0
+        if crop is None or crop.size == 0:
+            return
+        score = sharpness(crop)
+        if len(self.crops) < max_crops or score > self.crops[-1][0]:
+            # copy, the crop is a view of the frame
+            self.crops.append((score, crop.copy()))
+            self.crops.sort(key=lambda item: item[0], reverse=True)
+            del self.crops[max_crops:]
+
+
+class IoUTracker:
+    def __init__(self, iou_threshold=0.3, max_age=15, max_crops=3):
+        """
+        Args:
+            iou_threshold (float): Min IoU between a detection and the last box of a track to continue the track.
+            max_age (int): A track ends when it has not been matched in max_age detection passes (update calls),
+                so with detection on every Nth frame a track is not ended between two detections.
+            max_crops (int): Number of sharpest crops kept per track.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_crops = max_crops
+        self.tracks = []
+        self.next_id = 1
+
+    def update(self, frame, frame_index, groups):
+        """
+        Match the CN groups of one frame (see group_cn_boxes) to the tracks (greedy by IoU of the enclosing box),
+        returns the tracks that ended.
+        """
+        ious = iou_matrix([track.box for track in self.tracks], [group.union() for group in groups])
+        track_indices, box_indices = np.nonzero(ious >= self.iou_threshold)
+        pairs = sorted(zip(ious[track_indices, box_indices].tolist(), track_indices.tolist(), box_indices.tolist()), reverse=True)
+        matched_tracks = set()
+        matched_boxes = set()
+        for iou, t, b in pairs:
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+            self.tracks[t].add(groups[b], frame_index, crop_group(frame, groups[b]), self.max_crops)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+
+        for b, group in enumerate(groups):
+            if b not in matched_boxes:
+                track = Track(self.next_id, group, frame_index)
+                track.add(group, frame_index, crop_group(frame, group), self.max_crops)
+                self.tracks.append(track)
+                self.next_id += 1
+
+        ended = [track for track in self.tracks if track.misses > self.max_age]
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_age]
+        return ended
+
+    def flush(self):
+        ended = self.tracks
+        self.tracks = []
+        return ended
+
+
+def vote(crop_results):
+    # majority vote over the valid container numbers of a track, ties broken by the summed confidence
+    votes = Counter()
+    confidences = Counter()
+    for result in crop_results:
+        if result['cn'] is not None and result['cn'] != WRONG_CN:
+            votes[result['cn']] += 1
+            confidences[result['cn']] += result['cn_1'][1]
+    if not votes:
+        return None, 0
+    cn = max(votes, key=lambda text: (votes[text], confidences[text]))
+    return cn, votes[cn]
+
+
+class StreamRecognizer:
+    def __init__(self, pipeline, det_every=1, min_hits=2, tracker=None):
+        """
+        Args:
+            pipeline (CNPipeline): Loaded pipeline, its CNDetector and recognize_crops are used.
+            det_every (int): Run CNDetector on every Nth frame only.
+            min_hits (int): Tracks detected on fewer frames are dropped (false positives).
+        """
+        self.pipeline = pipeline
+        self.det_every = det_every
+        self.min_hits = min_hits
+        self.tracker = tracker if tracker is not None else IoUTracker()
+
+    def recognize_tracks(self, tracks, fps):
+        results = []
+        tracks = [track for track in tracks if track.hits >= self.min_hits and track.crops]
+        if not tracks:
+            return results
+        # all crops of all ended tracks in one batch
+        crops = [crop for track in tracks for _, crop in track.crops]
+        crop_results = self.pipeline.recognize_crops(crops)
+        beg = 0
+        for track in tracks:
+            track_results = crop_results[beg:beg + len(track.crops)]
+            beg += len(track.crops)
+            cn, num_votes = vote(track_results)
+            results.append({
+                'track_id': track.track_id,
+                'cn': cn,
+                'votes': num_votes,
+                'candidates': [r['cn'] for r in track_results],
+                'first_frame': track.first_frame,
+                'last_frame': track.last_frame,
+                'first_time_s': round(track.first_frame / fps, 3) if fps else None,
+                'box': track.box,
+                'boxes': track.group.tolist(),
+            })
+            print(f"Track {track.track_id}: CN {cn} ({num_votes}/{len(track_results)} votes), frames {track.first_frame}-{track.last_frame}")
+        return results
+
+    def run(self, source, output_file=None):
+        capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not capture.isOpened():
+            raise IOError(f"Can not open video source: {source}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or None
+        output = open(output_file, 'w') if output_file is not None else None
+
+        results = []
+        frame_index = 0
+        st = time.time()
+        try:
+            while True:
+                if frame_index % self.det_every != 0:
+                    # skip decoding of the frames that are not detected
+                    if not capture.grab():
+                        break
+                    frame_index += 1
+                    continue
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                # every container number of the frame: CN boxes and CN_ABC & CN_NUM pairs
+                groups = group_cn_boxes(self.pipeline.cn_detector.detect(frame))
+                # tracks age in detection passes (see IoUTracker), not in frames
+                ended = self.tracker.update(frame, frame_index, groups)
+                for result in self.recognize_tracks(ended, fps):
+                    results.append(result)
+                    if output is not None:
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+                frame_index += 1
+            for result in self.recognize_tracks(self.tracker.flush(), fps):
+                results.append(result)
+                if output is not None:
+                    output.write(json.dumps(result) + "\n")
+        finally:
+            capture.release()
+            if output is not None:
+                output.close()
+
+        elapsed = time.time() - st
+        print(f"{frame_index} frames, {len(results)} containers, {elapsed:.3f}s ({frame_index / max(elapsed, 1e-9):.1f} fps)")
+        return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="recognize container numbers in a video file or camera stream")
+    parser.add_argument("--source", required=True, help="video file path or camera index")
+    parser.add_argument("--det_every", type=int, default=1, help="run CNDetector on every Nth frame")
+    parser.add_argument("--iou_threshold", type=float, default=0.3)
+    parser.add_argument("--max_age", type=int, default=15, help="detection passes (every det_every frames) without a match before a track ends")
+    parser.add_argument("--crops_per_track", type=int, default=3, help="sharpest crops recognized per track")
+    parser.add_argument("--min_hits", type=int, default=2)
+    parser.add_argument("--output", default=None, help="JSON lines result file")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+    parser.add_argument("--roi_det", action="store_true", help="ROI-first CN detection of high-resolution frames")
+    parser.add_argument("--tile", action="store_true", help="with --roi_det, detect tiles when the coarse pass finds nothing")
+    parser.add_argument("--speculative_retry", action="store_true", help="recognize the original crop of a reassembled crop in the same batch")
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    pipeline = CNPipeline(*load_models(use_gpu=args.use_gpu, use_int8=args.use_int8, roi_det=args.roi_det, tile=args.tile),
+                          speculative_retry=args.speculative_retry)
+    profiling.setup(pipeline, args.profile_dir, args.profile_mode, args.profile_window)
+    tracker = IoUTracker(iou_threshold=args.iou_threshold, max_age=args.max_age, max_crops=args.crops_per_track)
+    StreamRecognizer(pipeline, det_every=args.det_every, min_hits=args.min_hits, tracker=tracker).run(args.source, args.output)
@@ -0,0 +1,300 @@
+# synth_cn.py
+# How to use: python3 synth_cn.py --output_folder synth_data --count 100000 --processes 8
+#             python3 synth_cn.py --output_folder synth_bench --count 2000 --no_rec   (realistic inputs for load_test.py)
+# Synthetic container number images, rendered with OpenCV (no font files needed):
+# - valid ISO 6346 codes: 3 letters owner code + U/J/Z + 6 digits serial + check digit (calculate_check_digit),
+#   with a size-type code (TS) next to it
+# - layouts: horizontal (one line), vertical (one column), two_line (CN_ABC above CN_NUM) and two_column
+#   (CN_ABC left of CN_NUM, both vertical), the check digit boxed as on real containers
+# - container-like ribbed background, random perspective, blur, noise and brightness / contrast
+# Output, in the formats of the real data tools:
+# - images/<name>.jpg + labels/<name>.txt: YOLO labels (classes of prepare_cvat_for_yolo.py)
+# - rec_images/<name>_01.jpg + rec_labels.txt: PaddleOCR rec crops & labels (as cvat_to_pdlocrrec_label.py), the
+#   two_line / two_column crops are CN_ABC & CN_NUM stitched like CNPipeline does (see crop_group)
+# Every image only depends on (--seed, image index): the same command gives the same data with any --processes.
+import os
+import time
+import string
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from check_digit_calculation import calculate_check_digit
+from prepare_cvat_for_yolo import interested_labels
+
+layouts = ('horizontal', 'vertical', 'two_line', 'two_column')
+fonts = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_TRIPLEX, cv2.FONT_HERSHEY_COMPLEX]
+ts_codes = ['22G1', '22G0', '42G1', '45G1', 'L5G1', '22R1', '45R1', '22U1', '42P1', '22T6']
+letters = list(string.ascii_uppercase)
+noise_fields = {} # (seed, width, height) -> noise field of a worker process, see noise_field
+
+
+def random_cn(rng):
+    owner = ''.join(rng.choice(letters, 3)) + rng.choice(['U', 'U', 'U', 'J', 'Z'])
+    serial = ''.join(str(d) for d in rng.integers(0, 10, 6))
+    return owner + serial + str(calculate_check_digit(owner + serial))
+
+
+def union(boxes):
+    boxes = np.array(boxes, dtype=np.float32)
+    return [float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max())]
+
+
+def layout_text(cn, ts, layout, font, scale, thickness):
+    """
+    Place the characters of a layout, relative to (0, 0).
+
+    Returns:
+        placements: [(text, x, y baseline, scale)]
+        boxes: {label: [x1, y1, x2, y2]}, no CN box for the two_line / two_column layouts (CN_ABC + CN_NUM pair)
+        c_digit: box of the rectangle drawn around the check digit
+    """
+    sizes = [cv2.getTextSize(c, font, scale, thickness)[0] for c in cn]
+    h = max(size[1] for size in sizes)
+    col_w = max(size[0] for size in sizes)
+    gap = 0.35 * h # between characters of a column, between lines
+    space = 0.6 * h # between owner code / serial / check digit of a line
+    tracking = 0.12 * h
+    pad = 0.25 * h # check digit rectangle
+    placements = []
+    char_boxes = []
+
+    def put(k, x, y):
+        w, ch = sizes[k]
+        placements.append((cn[k], x, y, scale))
+        char_boxes.append([x, y - ch, x + w, y])
+
+    if layout in ('horizontal', 'two_line'):
+        x, y = pad, h + pad
+        for k in range(11):
+            if k == 4 and layout == 'two_line':
+                x, y = pad, y + h + gap + 2 * pad
+            elif k in (4, 10):
+                x += space
+            put(k, x, y)
+            x += sizes[k][0] + tracking
+    else:
+        for k in range(11):
+            column = 1 if k >= 4 and layout == 'two_column' else 0
+            row = k - 4 if column == 1 else k
+            x = pad + column * (col_w + space + 2 * pad) + (col_w - sizes[k][0]) / 2
+            y = pad + h + row * (h + gap) + (pad * 2 if k == 10 else 0)
+            put(k, x, y)
+
+    c_digit = [char_boxes[10][0] - pad, char_boxes[10][1] - pad, char_boxes[10][2] + pad, char_boxes[10][3] + pad]
+    boxes = {'CN_ABC': union(char_boxes[:4]), 'CN_NUM': union(char_boxes[4:10] + [c_digit]), 'C_DIGIT': c_digit}
+    if layout in ('horizontal', 'vertical'):
+        boxes['CN'] = union([boxes['CN_ABC'], boxes['CN_NUM']])
+
+    # size-type code, below a line layout / right of a column layout, smaller
+    ts_scale = scale * 0.8
+    (ts_w, ts_h), _ = cv2.getTextSize(ts, font, ts_scale, thickness)
+    block = union(list(boxes.values()))
+    if layout in ('horizontal', 'two_line'):
+        ts_x, ts_y = block[0], block[3] + 1.5 * h + ts_h
+    else:
+        ts_x, ts_y = block[2] + 1.5 * h, block[1] + ts_h
+    placements.append((ts, ts_x, ts_y, ts_scale))
+    boxes['TS'] = [ts_x, ts_y - ts_h, ts_x + ts_w, ts_y]
+    return placements, boxes, c_digit
+
+
+def background(rng, width, height):
+    # painted corrugated steel: one row of vertical ribs, stretched to the image height
+    color = rng.integers(20, 230, 3).astype(np.float32)
+    period = rng.uniform(0.03, 0.08) * width
+    ribs = np.sin(np.arange(width, dtype=np.float32) * 2 * np.pi / period + rng.uniform(0, 2 * np.pi))
+    row = np.clip(color[None, :] + ribs[:, None] * rng.uniform(5, 30), 0, 255).astype(np.uint8)[None]
+    return cv2.resize(row, (width, height), interpolation=cv2.INTER_NEAREST), color
+
+
+def render_sample(rng, width, height, layout):
+    """
+    Returns (image, cn, boxes {label: [x1, y1, x2, y2]} in image coordinates).
+    """
+    cn = random_cn(rng)
+    ts = ts_codes[rng.integers(len(ts_codes))]
+    font = fonts[rng.integers(len(fonts))]
+    thickness = int(rng.integers(1, 4))
+    # character height 3 - 9% of the image height, shrunk until the layout fits
+    scale = rng.uniform(0.03, 0.09) * height / cv2.getTextSize('0', font, 1.0, thickness)[0][1]
+    while True:
+        placements, boxes, c_digit = layout_text(cn, ts, layout, font, scale, thickness)
+        x1, y1, x2, y2 = union(list(boxes.values()))
+        if (x2 - x1 <= width * 0.9 and y2 - y1 <= height * 0.9) or scale < 0.2:
+            break
+        scale *= 0.8
+
+    image, color = background(rng, width, height)
+    ox = rng.uniform(0.05 * width, max(0.05 * width, 0.95 * width - (x2 - x1))) - x1
+    oy = rng.uniform(0.05 * height, max(0.05 * height, 0.95 * height - (y2 - y1))) - y1
+    text_color = (20, 20, 20) if color.mean() > 128 else (235, 235, 235)
+    for text, x, y, text_scale in placements:
+        cv2.putText(image, text, (int(x + ox), int(y + oy)), font, text_scale, text_color, thickness, cv2.LINE_AA)
+    cv2.rectangle(image, (int(c_digit[0] + ox), int(c_digit[1] + oy)), (int(c_digit[2] + ox), int(c_digit[3] + oy)), text_color, max(1, thickness - 1))
+    boxes = {label: [box[0] + ox, box[1] + oy, box[2] + ox, box[3] + oy] for label, box in boxes.items()}
+    return image, cn, boxes
+
+
+def noise_field(seed, width, height, margin=64):
+    # gaussian noise around 128 (sigma 16), generated once per worker: cv2.randn of a full image costs more than
+    # the rest of the augmentation, every image adds a shifted window of this field instead
+    key = (seed, width, height)
+    if key not in noise_fields:
+        noise = np.empty((height + margin, width + margin, 3), np.uint8)
+        cv2.setRNGSeed(seed)
+        cv2.randn(noise, (128, 128, 128), (16, 16, 16))
+        noise_fields[key] = noise
+    return noise_fields[key]
+
+
+def augment(rng, image, boxes, perspective=0.06, noise=None):
+    # random perspective (the boxes become the bounding boxes of their warped corners), blur, noise, brightness / contrast
+    height, width = image.shape[:2]
+    if perspective > 0:
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        jitter = rng.uniform(-perspective, perspective, (4, 2)).astype(np.float32) * np.float32([width, height])
+        matrix = cv2.getPerspectiveTransform(corners, corners + jitter)
+        image = cv2.warpPerspective(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+        warped = {}
+        for label, (x1, y1, x2, y2) in boxes.items():
+            points = cv2.perspectiveTransform(np.float32([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]]), matrix)[0]
+            warped[label] = [float(np.clip(points[:, 0].min(), 0, width)), float(np.clip(points[:, 1].min(), 0, height)),
+                             float(np.clip(points[:, 0].max(), 0, width)), float(np.clip(points[:, 1].max(), 0, height))]
+        boxes = warped
+
+    if rng.random() < 0.5:
+        k = int(rng.choice([3, 5]))
+        image = cv2.GaussianBlur(image, (k, k), 0)
+    if noise is not None and rng.random() < 0.7:
+        x, y = rng.integers(0, noise.shape[1] - width + 1), rng.integers(0, noise.shape[0] - height + 1)
+        strength = rng.uniform(0.2, 1.0) # sigma 3 - 16
+        image = cv2.addWeighted(image, 1.0, noise[y:y + height, x:x + width], strength, -128 * strength)
+    image = cv2.convertScaleAbs(image, alpha=rng.uniform(0.7, 1.3), beta=rng.uniform(-40, 40))
+    return image, boxes
+
+
+def crop_box(image, box):
+    x1, y1, x2, y2 = [round(v) for v in box]
+    return image[y1:y2, x1:x2]
+
+
+def rec_crop(image, boxes):
+    # the CN box, or CN_ABC & CN_NUM stitched (horizontal lines side by side, vertical columns on top of each other)
+    if 'CN' in boxes:
+        return crop_box(image, boxes['CN'])
+    img_abc, img_num = crop_box(image, boxes['CN_ABC']), crop_box(image, boxes['CN_NUM'])
+    if img_abc.size == 0 or img_num.size == 0:
+        return None
+    if img_abc.shape[1] >= img_abc.shape[0]:
+        h = max(img_abc.shape[0], img_num.shape[0])
+        return cv2.hconcat([cv2.copyMakeBorder(img, 0, h - img.shape[0], 0, 0, cv2.BORDER_CONSTANT, value=[0, 0, 0]) for img in (img_abc, img_num)])
+    w = max(img_abc.shape[1], img_num.shape[1])
+    return cv2.vconcat([cv2.copyMakeBorder(img, 0, 0, 0, w - img.shape[1], cv2.BORDER_CONSTANT, value=[0, 0, 0]) for img in (img_abc, img_num)])
+
+
+def yolo_lines(boxes, width, height):
+    # prepare_cvat_for_yolo.py format: class x_center y_center width height, normalized
+    lines = []
+    for label, (x1, y1, x2, y2) in boxes.items():
+        lines.append(f"{interested_labels[label]} {(x1 + x2) / 2 / width} {(y1 + y2) / 2 / height} {(x2 - x1) / width} {(y2 - y1) / height}\n")
+    return lines
+
+
+def generate_chunk(task):
+    """
+    Render and write the images start .. start + count - 1, runs in a worker process.
+    Returns [(rec image name, cn)] and the number of images per layout.
+    """
+    start, count, config = task
+    rec_labels = []
+    layout_counts = dict.fromkeys(config['layouts'], 0)
+    jpeg = [cv2.IMWRITE_JPEG_QUALITY, config['quality']]
+    noise = noise_field(config['seed'], config['width'], config['height'])
+    for index in range(start, start + count):
+        rng = np.random.default_rng([config['seed'], index])
+        layout = config['layouts'][rng.integers(len(config['layouts']))]
+        image, cn, boxes = render_sample(rng, config['width'], config['height'], layout)
+        image, boxes = augment(rng, image, boxes, config['perspective'], noise)
+        layout_counts[layout] += 1
+        name = f"synth_{index:07d}"
+        if config['yolo']:
+            cv2.imwrite(os.path.join(config['output_folder'], 'images', name + '.jpg'), image, jpeg)
+            with open(os.path.join(config['output_folder'], 'labels', name + '.txt'), 'w') as file:
+                file.writelines(yolo_lines(boxes, config['width'], config['height']))
+        if config['rec']:
+            crop = rec_crop(image, boxes)
+            if crop is not None and crop.size != 0:
+                rec_name = f"{name}_01.jpg"
+                cv2.imwrite(os.path.join(config['output_folder'], 'rec_images', rec_name), crop, jpeg)
+                rec_labels.append((rec_name, cn))
+    return rec_labels, layout_counts
+
+
+def generate(output_folder, count, processes=None, chunk_size=256, width=640, height=480, layouts=layouts, perspective=0.06,
+             quality=90, seed=0, yolo=True, rec=True):
+    """
+    Generate count synthetic images with multiprocessing.
+
+    Args:
+        processes (int): Worker processes, default all CPUs.
+        chunk_size (int): Images per worker task.
+        width, height (int): Size of the full images.
+        layouts: Layouts to draw from, uniformly.
+        perspective (float): Max corner shift of the perspective warp, relative to the image size, 0 disables the warp.
+        yolo, rec (bool): Write the full images + YOLO labels / the rec crops + rec label file.
+    """
+    for folder, enabled in (('images', yolo), ('labels', yolo), ('rec_images', rec)):
+        if enabled:
+            os.makedirs(os.path.join(output_folder, folder), exist_ok=True)
+    config = {'output_folder': output_folder, 'width': width, 'height': height, 'layouts': list(layouts), 'perspective': perspective,
+              'quality': quality, 'seed': seed, 'yolo': yolo, 'rec': rec}
+    tasks = [(start, min(chunk_size, count - start), config) for start in range(0, count, chunk_size)]
+    layout_counts = dict.fromkeys(layouts, 0)
+    rec_count = 0
+
+    st = time.time()
+    with multiprocessing.Pool(processes or os.cpu_count()) as pool, tqdm(total=count, desc="Generating") as pbar:
+        rec_labels_file = open(os.path.join(output_folder, 'rec_labels.txt'), 'w') if rec else None
+        try:
+            # in order: the rec label file is the same for any number of processes
+            for rec_labels, counts in pool.imap(generate_chunk, tasks):
+                if rec_labels_file is not None:
+                    rec_labels_file.writelines(f"{name}\t{cn}\n" for name, cn in rec_labels)
+                rec_count += len(rec_labels)
+                for layout, n in counts.items():
+                    layout_counts[layout] += n
+                pbar.update(sum(counts.values()))
+        finally:
+            if rec_labels_file is not None:
+                rec_labels_file.close()
+    elapsed = time.time() - st
+    print(f"{count} images in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} images/s), {rec_count} rec crops, written to {output_folder}")
+    print(", ".join(f"{layout}: {n}" for layout, n in layout_counts.items()))
+    return layout_counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="synthetic ISO 6346 container number images with YOLO and PaddleOCR rec labels")
+    parser.add_argument("--output_folder", required=True)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=None, help="default all CPUs")
+    parser.add_argument("--chunk_size", type=int, default=256)
+    parser.add_argument("--image_size", default="640x480", help="WxH of the full images")
+    parser.add_argument("--layouts", default=",".join(layouts), help=f"comma separated, of {', '.join(layouts)}")
+    parser.add_argument("--perspective", type=float, default=0.06, help="max corner shift (fraction of the image size), 0: no warp, faster")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no_yolo", action="store_true", help="only the rec crops")
+    parser.add_argument("--no_rec", action="store_true", help="only the full images + YOLO labels")
+
+    args = parser.parse_args()
+    selected = args.layouts.split(',')
+    if any(layout not in layouts for layout in selected):
+        parser.error(f"--layouts must be of {', '.join(layouts)}")
+    w, h = [int(v) for v in args.image_size.lower().split('x')]
+    generate(args.output_folder, args.count, args.processes, args.chunk_size, w, h, selected, args.perspective,
+             args.quality, args.seed, yolo=not args.no_yolo, rec=not args.no_rec)
@@ -1,8 +1,21 @@
 # step 2: text_image_v2h.py
-# How to use: python3 text_image_v2h.py
-import cv2 
+# How to use: python3 text_image_v2h.py --batch_size 32 --workers 8
+# 1. horizontal images (read from the file header, no decoding) are copied byte-for-byte to the updated folder
+# 2. vertical images are decoded in parallel (one batch ahead), sent to the char detector in batches,
+#    rearranged horizontally and encoded in parallel
+# 3. vertical images the char detector cannot handle go to the need_manual_check_images_folder,
+#    and are listed in need_manual_check_manifest.txt (filename, reason)
+# 4. incremental by default: crops whose bytes and TOOL_VERSION did not change are skipped (see build_cache.py)
+import cv2
 import os
+import argparse
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from image_header import read_image_size
+from file_staging import strategies, stage_file, stage_files
 from v2h_char_detector import V2HCharDetector # character detection, vertical to horizontal
+from build_cache import BuildCache, make_key
 
 # cropped the container number images from the original container images
 cropped_images_folder = '/home/user/project/data/cropped_container_number_images'
@@ -11,37 +24,169 @@ updated_cropped_images_folder = '/home/user/project/data/updated_cropped_images'
 # the images that are not processed will be saved in the need_manual_check_images_folder
 need_manual_check_images_folder = '/home/user/project/data/need_manual_check_images'
 
-if not os.path.exists(updated_cropped_images_folder):
-    os.makedirs(updated_cropped_images_folder)
-if not os.path.exists(need_manual_check_images_folder):
-    os.makedirs(need_manual_check_images_folder)
+image_extensions = ('.png', '.jpg', '.jpeg')
 
-v2h_char_detector = V2HCharDetector() # it will return the rearranged horizontal image
+# change it whenever the conversion logic or the v2h char det model changes, all images will be rebuilt
+TOOL_VERSION = 'text_image_v2h/1'
 
-processed_count = 0
 
-for filename in os.listdir(cropped_images_folder):
-    if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-        image_path = os.path.join(cropped_images_folder, filename)
+def image_size(image_path):
+    # (width, height) from the header, decode only if the header can not be used
+    size = read_image_size(image_path)
+    if size is None:
         img = cv2.imread(image_path)
+        if img is None:
+            return None
+        size = (img.shape[1], img.shape[0])
+    return size
 
-        if img is not None:
-            height, width = img.shape[:2]
-            # check if image is vertical
-            if height > width:
-                # vertical image
-                print(filename + " is vertical)
-                # detect the characters and rearrange them horizontally, return the rearranged image
-                is_res_ok, processed_img = v2h_char_detector.detect(img)
-                processed_count += 1
-                if is_res_ok:
-                    cv2.imwrite(os.path.join(updated_cropped_images_folder , filename), processed_img)
-                else:
-                    # if the char detection is not ok, save the image to the need_manual_check_images_folder
-                    cv2.imwrite(os.path.join(need_manual_check_images_folder, filename), processed_img)
-                    print(filename, " is not processed, please check manually.")
+
+def batched(iterable, n):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+def check_writes(writes):
+    # wait for the background writes, a failed cv2.imwrite is reported (and not recorded in the build cache)
+    for path, write in writes:
+        if write.result() is False:
+            print(f"Can not write {path}, it is rebuilt on the next run.")
+
+
+def convert_v2h(input_folder, output_folder, manual_check_folder, batch_size=32, workers=8, strategy='copy', incremental=True, prune=False):
+    """
+    Convert the vertical CN crops to horizontal ones, keep the horizontal crops as they are.
+
+    Args:
+        input_folder (str): Cropped CN images from cvat_to_pdlocrrec_label.py.
+        output_folder (str): Horizontal images (original horizontal + rearranged vertical).
+        manual_check_folder (str): Vertical images the char detector could not rearrange.
+        batch_size (int): Number of vertical images per char detector call.
+        workers (int): Number of threads for header reading, decoding and encoding.
+        strategy (str): How horizontal images are staged, see file_staging.py.
+        incremental (bool): Skip the images already converted from the same bytes.
+        prune (bool): Remove the outputs whose input image no longer exists.
+    """
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    if not os.path.exists(manual_check_folder):
+        os.makedirs(manual_check_folder)
+
+    filenames = sorted(entry.name for entry in os.scandir(input_folder) if entry.name.lower().endswith(image_extensions))
+    manifest_file = os.path.join(manual_check_folder, 'need_manual_check_manifest.txt')
+
+    cache = BuildCache(os.path.join(output_folder, '.build_cache.sqlite'), 'text_image_v2h')
+    keys = {}
+
+    def inspect(filename):
+        # (width, height), build key and manual check reason of one input image, the key is None if the image is up to date
+        image_path = os.path.join(input_folder, filename)
+        key = make_key(TOOL_VERSION, cache.file_digest(image_path))
+        if incremental and cache.is_fresh(os.path.join(output_folder, filename), key):
+            return None, None, None
+        manual_check_path = os.path.join(manual_check_folder, filename)
+        if incremental and cache.is_fresh(manual_check_path, key):
+            return None, None, cache.info(manual_check_path)
+        return image_size(image_path), key, None
+
+    with cache, ThreadPoolExecutor(max_workers=workers) as executor, open(manifest_file, 'w') as manifest:
+        inspected = list(tqdm(executor.map(inspect, filenames), total=len(filenames), desc="Reading image sizes"))
+
+        horizontal = []
+        vertical = []
+        skipped_count = 0
+        for filename, (size, key, reason) in zip(filenames, inspected):
+            if key is None:
+                skipped_count += 1
+                if reason is not None:
+                    manifest.write(f"{filename}\t{reason}\n")
+            elif size is None:
+                manifest.write(f"{filename}\tunreadable image\n")
+            elif size[1] > size[0]:
+                vertical.append(filename)
+                keys[filename] = key
             else:
-                # horizontal image, no need to process
-                cv2.imwrite(os.path.join(updated_cropped_images_folder, filename), img)
+                horizontal.append(filename)
+                keys[filename] = key
+
+        # horizontal image, no need to process, no re-encoding
+        stage_files(((os.path.join(input_folder, f), os.path.join(output_folder, f)) for f in horizontal),
+                    strategy=strategy, workers=workers, desc="Copying horizontal images")
+        for filename in horizontal:
+            cache.update(os.path.join(output_folder, filename), keys[filename])
+
+        # it will return the rearranged horizontal image, not loaded if all vertical images are up to date
+        v2h_char_detector = V2HCharDetector() if vertical else None
+        processed_count = 0
+        manual_count = 0
+
+        def load(filename):
+            return filename, cv2.imread(os.path.join(input_folder, filename))
+
+        # decode the next batch while the detector runs on the current one, write results in the background
+        batches = list(batched(vertical, batch_size))
+        next_decoded = [executor.submit(load, f) for f in batches[0]] if batches else []
+        writes = []
+        with tqdm(total=len(vertical), desc="Converting vertical images") as pbar:
+            for i in range(len(batches)):
+                decoded = [future.result() for future in next_decoded]
+                if i + 1 < len(batches):
+                    next_decoded = [executor.submit(load, f) for f in batches[i + 1]]
+
+                batch = []
+                for filename, img in decoded:
+                    if img is None:
+                        manifest.write(f"{filename}\tunreadable image\n")
+                    else:
+                        batch.append((filename, img))
+                # detect the characters and rearrange them horizontally, return the rearranged images
+                results = v2h_char_detector.detect_batch([img for _, img in batch], batch_size=batch_size) if batch else []
+
+                check_writes(writes) # at most one batch of pending writes
+                writes = []
+                for (filename, _), (is_res_ok, processed_img, num_boxes) in zip(batch, results):
+                    processed_count += 1
+                    if is_res_ok:
+                        # recorded once the write has finished, and only if cv2.imwrite succeeded
+                        output_path = os.path.join(output_folder, filename)
+                        writes.append((output_path, executor.submit(cv2.imwrite, output_path, processed_img)))
+                        cache.update_after(writes[-1][1], output_path, keys[filename])
+                    else:
+                        # if the char detection is not ok, save the image to the need_manual_check_images_folder
+                        # (it is the original image, no re-encoding)
+                        manual_check_path = os.path.join(manual_check_folder, filename)
+                        writes.append((manual_check_path, executor.submit(stage_file, os.path.join(input_folder, filename), manual_check_path, strategy)))
+                        reason = f"{num_boxes} char boxes detected"
+                        manifest.write(f"{filename}\t{reason}\n")
+                        cache.update_after(writes[-1][1], manual_check_path, keys[filename], info=reason)
+                        manual_count += 1
+                pbar.update(len(decoded))
+        check_writes(writes)
+
+        if prune:
+            print(f"Stale images removed: {cache.prune()}")
+
+    print(f"{len(horizontal)} horizontal images copied, {processed_count} vertical images processed, {manual_count} need manual check, {skipped_count} up to date.")
+    print(f"Manual check list: {manifest_file}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="convert vertical CN crops to horizontal for PaddleOCR rec")
+    parser.add_argument("--input_folder", default=cropped_images_folder)
+    parser.add_argument("--output_folder", default=updated_cropped_images_folder)
+    parser.add_argument("--manual_check_folder", default=need_manual_check_images_folder)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--strategy", choices=strategies, default='copy')
+    parser.add_argument("--full_rebuild", action="store_true", help="ignore the build cache, convert everything")
+    parser.add_argument("--prune", action="store_true", help="remove outputs whose input image no longer exists")
 
-print(processed_count, " images processed.")
+    args = parser.parse_args()
+    convert_v2h(args.input_folder, args.output_folder, args.manual_check_folder,
+                batch_size=args.batch_size, workers=args.workers, strategy=args.strategy,
+                incremental=not args.full_rebuild, prune=args.prune)
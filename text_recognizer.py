@@ -12,13 +12,17 @@ sys.path.append(os.path.join(__dir__ , 'PaddleOCR'))
 import tools.infer.utility as utility # type: ignore
 from ppocr.postprocess import build_post_process # type: ignore
 from ppocr.utils.logging import get_logger # type: ignore
+from rec_buckets import load_buckets, bucket_index, buckets_file as default_buckets_file
 
 confidence_threshold = 0.6
 
 logger = get_logger()
 
 class TextRecognizer(object):
-    def __init__(self, args=utility.parse_args(), algo="ABINet", use_gpu=False):
+    def __init__(self, args=None, algo="ABINet", use_gpu=False, model_dir=None, use_int8=False, buckets_file=default_buckets_file):
+        if args is None:
+            # default args without parsing sys.argv, so the caller can have its own command line
+            args = utility.init_args().parse_args([])
         args.use_gpu = use_gpu
         self.rec_batch_num = 6 # batch size for recognition
         self.rec_algorithm = algo
@@ -42,11 +46,29 @@ class TextRecognizer(object):
                 "rm_symbol": True
             }
 
+        # model_dir can point to a quantized variant produced by quantize_models.py
+        if model_dir is not None:
+            args.rec_model_dir = model_dir
+        if use_int8:
+            # int8 inference on CPU runs through mkldnn
+            args.precision = 'int8'
+            args.enable_mkldnn = True
+        self.rec_model_dir = args.rec_model_dir
+
         self.postprocess_op = build_post_process(postprocess_params)
         self.postprocess_params = postprocess_params
 
         self.predictor, self.input_tensor, self.output_tensors, self.config = \
             utility.create_predictor(args, 'rec', logger)
+
+        # aspect-ratio buckets (rec_buckets.py): the crops are batched per bucket, and with a dynamic input width
+        # CPPDPadding runs each bucket with its own width (less padding). ABINet / CPPD stretch to a fixed shape.
+        self.buckets = load_buckets(buckets_file)
+        try:
+            dynamic_width = self.input_tensor.shape()[-1] == -1
+        except Exception:
+            dynamic_width = False
+        self.use_bucket_width = self.buckets is not None and dynamic_width and self.rec_algorithm == "CPPDPadding"
         
         #self.warmup() # paddleocr does not need warmup manually actually
         print("{} ADV_TextRecognizer loaded and warmed up successfully.".format(self.rec_algorithm))
@@ -107,46 +129,55 @@ class TextRecognizer(object):
 
         return resized_image
     
+    def norm_img(self, img, img_w=None):
+        # resize & normalize one image for the current rec algorithm, shape: (C, H, W), W = img_w if given
+        image_shape = self.rec_image_shape if img_w is None else self.rec_image_shape[:2] + [img_w]
+        if self.rec_algorithm == "CPPD":
+            return self.resize_norm_img_svtr(img, image_shape)
+        elif self.rec_algorithm in ["CPPDPadding"]:
+            return self.resize_norm_img_cppd_padding(img, image_shape)
+        elif self.rec_algorithm == "ABINet":
+            return self.resize_norm_img_abinet(img, image_shape)
+
+    def make_batches(self, img_list):
+        """
+        Split the images into batches of similar aspect ratio, returns [(image indices, input width or None)].
+        Without buckets the images are sorted by w / h ratio, with buckets each batch holds one bucket only.
+        """
+        ratios = np.array([img.shape[1] / float(img.shape[0]) for img in img_list])
+        # Sorting can speed up the recognition process
+        indices = np.argsort(ratios, kind='stable')
+        if self.buckets is None:
+            groups = [(indices, None)]
+        else:
+            bucket_ids = np.array([bucket_index(ratio, self.buckets) for ratio in ratios[indices]])
+            groups = [(indices[bucket_ids == b], self.buckets['widths'][b] if self.use_bucket_width else None)
+                      for b in np.unique(bucket_ids)]
+        batches = []
+        for group, img_w in groups:
+            for beg in range(0, len(group), self.rec_batch_num):
+                batches.append((group[beg:beg + self.rec_batch_num], img_w))
+        return batches
+
     def rec(self, img):
-        img_list = [img] # input one image at 1 time now, can add more
+        return self.rec_batch([img])[0]
+
+    def rec_batch(self, img_list):
+        # recognize a list of images, returns the good results of each image: [[[text, conf]] or [], ...]
         img_num = len(img_list)
-        # calculate the aspect ratio of all text bars
-        width_list = []
-        for img in img_list:
-            width_list.append(img.shape[1] / float(img.shape[0])) # w / h
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
+        if img_num == 0:
+            return []
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
 
         st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
+        for batch_indices, img_w in self.make_batches(img_list):
             norm_img_batch = []
-            imgC, imgH, imgW = self.rec_image_shape[:3]
-            max_wh_ratio = imgW / imgH
-            wh_ratio_list = []
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-                wh_ratio_list.append(wh_ratio)
-            
-            for ino in range(beg_img_no, end_img_no):
-                if self.rec_algorithm == "CPPD":
-                    norm_img = self.resize_norm_img_svtr(img_list[indices[ino]], self.rec_image_shape)
-                    norm_img = norm_img[np.newaxis, :]
-                    norm_img_batch.append(norm_img)
-                elif self.rec_algorithm in ["CPPDPadding"]:
-                    norm_img = self.resize_norm_img_cppd_padding(img_list[indices[ino]], self.rec_image_shape)
-                    norm_img = norm_img[np.newaxis, :]
-                    norm_img_batch.append(norm_img)
-                elif self.rec_algorithm == "ABINet":
-                    norm_img = self.resize_norm_img_abinet(img_list[indices[ino]], self.rec_image_shape)
-                    norm_img = norm_img[np.newaxis, :]
-                    norm_img_batch.append(norm_img)
-            
+            for index in batch_indices:
+                norm_img = self.norm_img(img_list[index], img_w)
+                norm_img = norm_img[np.newaxis, :]
+                norm_img_batch.append(norm_img)
+
             norm_img_batch = np.concatenate(norm_img_batch)
             norm_img_batch = norm_img_batch.copy()
 
@@ -166,11 +197,11 @@ class TextRecognizer(object):
             rec_result = self.postprocess_op(preds)
 
             for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+                rec_res[batch_indices[rno]] = rec_result[rno]
 
         # print(rec_res) # [('BCDU2107444', 0.9700266122817993)]
 
-        good_result = []
+        good_results = []
         # print(f"{len(rec_res)} lines text recognized.")
         for line in rec_res:
             # line: ('TTNU8655846', 0.9970707297325134)
@@ -179,14 +210,15 @@ class TextRecognizer(object):
             #print(f'rec text: {text}, confidence: {confidence}')
             if confidence > confidence_threshold:
                 print(f'{self.rec_algorithm} rec text: {text}, {len(text)} chars, good confidence: {confidence}. Keeping.')
-                good_result.append([text, confidence])
+                good_results.append([[text, confidence]])
             else:
                 print(f'{self.rec_algorithm} rec text: {text}, {len(text)} chars, low confidence: {confidence}. Ignoring.')
+                good_results.append([])
     
         #print("{} rec time: {}s".format(self.rec_algorithm, total_time.__round__(3)))
-        print(f"{len(good_result)} lines text recognized and returned. Took time: {time.time() - st:.3f}s")
-        #print(good_result) # [['BCDU2107444', 0.9700266122817993]]
-        return good_result
+        print(f"{sum(len(r) for r in good_results)}/{img_num} lines text recognized and returned. Took time: {time.time() - st:.3f}s")
+        #print(good_results) # [[['BCDU2107444', 0.9700266122817993]]]
+        return good_results
 """
 def main():
     text_recognizer = TextRecognizer(algo="ABINet")
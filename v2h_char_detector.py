@@ -1,16 +1,17 @@
 import os
-import time
 from ultralytics import YOLO
 import numpy as np
 import cv2
 
+from boxes import Boxes
+
 model_path = "/home/user/project/models/char_det_yolo8/nano/best.pt"
 
 confidence_threshold = 0.5
 
 class V2HCharDetector:
-    def __init__(self):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path=model_path):
+        self.model = YOLO(model_path, task='detect')
         self.warmup()
         print("v2h-CharDetector loaded and warmed up successfully.")
 
@@ -20,6 +21,24 @@ class V2HCharDetector:
     
     def detect(self, image):
         #cv2.imwrite("temp_images/cropped.jpg", image)
+        res = self.model(image, verbose=False)
+        is_res_ok, image, _ = self.process(image, res[0].boxes.numpy().data)
+        return is_res_ok, image
+
+    def detect_batch(self, images, batch_size=32):
+        """
+        Detect & rearrange a list of images, running the model on batches of images.
+        Returns a list of (is_res_ok, image, num_char_boxes), one per input image.
+        """
+        results = []
+        for beg in range(0, len(images), batch_size):
+            batch = images[beg:beg + batch_size]
+            res = self.model(batch, verbose=False)
+            for image, r in zip(batch, res):
+                results.append(self.process(image, r.boxes.numpy().data))
+        return results
+
+    def process(self, image, boxes):
         height, width, _ = image.shape
         is_vertical = False
         if height > width:
@@ -29,15 +48,12 @@ class V2HCharDetector:
             #print("input cn cropped image is horizontal.")
             pass
 
-        st = time.time()
-        res = self.model(image, verbose=False)
-        boxes = res[0].boxes.numpy().data
         # boxes: [[x1, y1, x2, y2, conf, cls],[...box2....],[...box3...],..., [...boxN...]]]
         num_boxes = len(boxes)
-        #print(f"{num_boxes} char boxes detected. Took {time.time() - st:.3f} seconds.")
+        #print(f"{num_boxes} char boxes detected.")
         #print('All chars det confidence:', [box[4] for box in boxes])
 
-        new_boxes = [box for box in boxes if box[4] >= confidence_threshold]
+        new_boxes = Boxes(boxes).filter(confidence_threshold)
 
         if num_boxes - len(new_boxes) > 0:
             print(f"{num_boxes - len(new_boxes)} char boxes removed, confidence below {confidence_threshold}.")
@@ -46,9 +62,8 @@ class V2HCharDetector:
             pass
         """
         debug_image = image.copy()
-        for box in new_boxes:
-            x1, y1, x2, y2, conf, cls = box
-            cv2.rectangle(debug_image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 1)
+        for x1, y1, x2, y2 in new_boxes.int_xyxy().tolist():
+            cv2.rectangle(debug_image, (x1, y1), (x2, y2), (0, 255, 0), 1)
         cv2.imwrite("temp_images/chars_debug.jpg", debug_image)
         """
         is_res_ok = True
@@ -70,7 +85,7 @@ class V2HCharDetector:
             #print(f"Manual op required. Only {len(new_boxes)} char boxes left, return original cropped image")
         
         #cv2.imwrite("temp_images/chars.jpg", image)
-        return is_res_ok ,image 
+        return is_res_ok, image, len(new_boxes)
     
     def reassemble_characters(self, image, is_vertical, boxes):
         # define the expansion size of character region
@@ -79,22 +94,11 @@ class V2HCharDetector:
         else:
             expand_x, expand_y = 2, 5
 
-        # store the cropped and adjusted character regions
-        cropped_images = []
-
-        # iterate over each bounding box, crop and expand the character region   
-        for box in boxes:
-            x1, y1, x2, y2 = box[:4]
+        # expand the character regions, make sure not to exceed the image boundary (all boxes at once)
+        expanded = boxes.expanded(expand_x, expand_y, image.shape[1], image.shape[0])
 
-            # calculate the expanded coordinates, make sure not to exceed the image boundary
-            x1_expanded = max(x1 - expand_x, 0)
-            y1_expanded = max(y1 - expand_y, 0)
-            x2_expanded = min(x2 + expand_x, image.shape[1])
-            y2_expanded = min(y2 + expand_y, image.shape[0])
-
-            # crop the expanded region
-            cropped = image[int(y1_expanded):int(y2_expanded), int(x1_expanded):int(x2_expanded)]
-            cropped_images.append(cropped)
+        # crop the expanded character regions
+        cropped_images = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in expanded.tolist()]
 
         # calculate the max height of all cropped regions
         max_height = max([img.shape[0] for img in cropped_images])
@@ -122,12 +126,10 @@ class V2HCharDetector:
     def reorder_boxes(self, is_vertical ,boxes):
         if is_vertical:
             # sort by y1 from top to bottom
-            boxes = sorted(boxes, key=lambda box: box[1])
+            return boxes.sorted('y')
         else:
             # sort by x1 from left to right
-            boxes = sorted(boxes, key=lambda box: box[0])
-
-        return boxes
+            return boxes.sorted('x')
 
 #detector = V2HCharDetector()
 #test_image = cv2.imread("test_images/crop_2.jpg")
@@ -0,0 +1,264 @@
+# watch_folder.py
+# How to use: python3 watch_folder.py --folder /data/gate_cam --batch_size 8 --result_db gate_results.sqlite
+# Ingestion daemon: the gate cameras drop JPEGs into a folder, new files are recognized in batches.
+# - inotify (optional package inotify_simple) or polling every --poll_interval seconds
+# - debounce: a file is read only when its size & mtime did not change for --settle seconds and it ends with the
+#   JPEG / PNG end marker (partially written files)
+# - checkpoint: processed files (path, size, mtime) are committed to a SQLite file after each batch, a restart skips them
+#   and continues with the rest (only the batch being recognized during a crash is recognized again)
+# - backpressure: one batch is decoded ahead of the inference, the other new files wait as paths only
+import os
+import time
+import heapq
+import signal
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+image_extensions = ('.jpg', '.jpeg', '.png')
+incomplete_timeout = 10 # x settle time, a file without end marker is read when unchanged for that long
+
+
+def is_complete(path):
+    # JPEG ends with the EOI marker, PNG with the IEND chunk: a file paused in the middle of a write is not complete
+    try:
+        with open(path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() < 12:
+                return False
+            file.seek(-12, os.SEEK_END)
+            tail = file.read()
+    except OSError:
+        return False
+    if path.lower().endswith('.png'):
+        return tail[4:8] == b'IEND'
+    return tail.rstrip(b'\x00')[-2:] == b'\xff\xd9'
+
+
+class Checkpoint:
+    def __init__(self, checkpoint_file):
+        self.db = sqlite3.connect(checkpoint_file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL") # a committed batch survives a power loss
+        self.db.execute("CREATE TABLE IF NOT EXISTS processed (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, status TEXT, cn TEXT, ts REAL)")
+        self.db.commit()
+
+    def load(self):
+        # path -> (size, mtime_ns) of the processed files
+        return {path: (size, mtime_ns) for path, size, mtime_ns in self.db.execute("SELECT path, size, mtime_ns FROM processed")}
+
+    def mark(self, records):
+        # records: [(path, size, mtime_ns, status, cn)], one transaction per batch
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO processed (path, size, mtime_ns, status, cn, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                                [record + (now,) for record in records])
+
+    def close(self):
+        self.db.close()
+
+
+class FolderWatcher:
+    def __init__(self, folder, poll_interval=1.0, use_inotify=True):
+        """
+        Reports the image files of folder that may have changed, with inotify if available, else by polling.
+        """
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.needs_scan = True # the first call (and an inotify queue overflow) lists the whole folder
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(folder, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY)
+            print(f"Watching {folder} with inotify.")
+        else:
+            print(f"Watching {folder} by polling every {poll_interval}s.")
+        self.last_scan = 0
+
+    def scan(self):
+        with os.scandir(self.folder) as entries:
+            return [entry.path for entry in entries if entry.is_file() and entry.name.lower().endswith(image_extensions)]
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds, returns the paths that may be new or changed.
+        """
+        if self.needs_scan:
+            self.needs_scan = False
+            self.last_scan = time.time()
+            return self.scan()
+        if self.inotify is None:
+            wait = self.last_scan + self.poll_interval - time.time()
+            if wait > 0:
+                time.sleep(min(wait, timeout))
+                if time.time() < self.last_scan + self.poll_interval:
+                    return []
+            self.last_scan = time.time()
+            return self.scan()
+        paths = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                print("inotify queue overflow, rescanning the folder.")
+                self.needs_scan = True
+            elif event.name.lower().endswith(image_extensions):
+                paths.add(os.path.join(self.folder, event.name))
+        return list(paths)
+
+
+class WatchFolderDaemon:
+    def __init__(self, pipeline, watcher, checkpoint, batch_size=8, settle_s=0.5, decode_workers=4):
+        """
+        Args:
+            pipeline (CNPipeline): Loaded pipeline, results go to its result store if it has one.
+            watcher (FolderWatcher): Source of new / changed files.
+            checkpoint (Checkpoint): Processed files.
+            batch_size (int): Max images per CNPipeline.run_batch call.
+            settle_s (float): A file is ready when its size & mtime did not change for settle_s seconds.
+        """
+        self.pipeline = pipeline
+        self.watcher = watcher
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.settle_s = settle_s
+        self.executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1) # runs decode(), which waits for the decode workers
+        self.processed = checkpoint.load()
+        self.pending = {} # path -> (size, mtime_ns, time of the last change)
+        self.in_flight = set() # taken from pending, not yet in the checkpoint
+        self.running = True
+        self.num_processed = 0
+        print(f"{len(self.processed)} files in the checkpoint.")
+
+    def stop(self, *args):
+        print("Stopping after the current batch ...")
+        self.running = False
+
+    def update_pending(self, paths, now):
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if path in self.in_flight or self.processed.get(path) == key:
+                continue
+            if path not in self.pending or self.pending[path][:2] != key:
+                self.pending[path] = key + (now,)
+
+    def take_ready_files(self, now):
+        """
+        Up to batch_size settled files, oldest first, removed from pending. They are re-checked with stat,
+        the size may change without an event while polling.
+        """
+        settled = [(path, value) for path, value in self.pending.items() if now - value[2] >= self.settle_s]
+        ready = []
+        for path, (size, mtime_ns, changed) in heapq.nsmallest(self.batch_size, settled, key=lambda item: item[1][1]):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                continue
+            if not is_complete(path) and now - changed < incomplete_timeout * self.settle_s:
+                # no end marker yet, some cameras append data after it: read anyway once it is unchanged for long
+                continue
+            del self.pending[path]
+            self.in_flight.add(path)
+            ready.append((path, size, mtime_ns))
+        return ready
+
+    def decode(self, files):
+        # (image, coarse image for the ROI-first CN detection or None) per file
+        return files, list(self.executor.map(self.pipeline.imread, [path for path, _, _ in files]))
+
+    def recognize(self, files, images):
+        st = time.time()
+        records = []
+        # images: (image, coarse) per file, see decode
+        valid = [(file, image, coarse) for file, (image, coarse) in zip(files, images) if image is not None]
+        for (path, size, mtime_ns), (image, _) in zip(files, images):
+            if image is None:
+                print(f"Can not read image: {path}")
+                records.append((path, size, mtime_ns, 'unreadable', None))
+        if valid:
+            results = self.pipeline.run_batch([image for _, image, _ in valid], draw=False, sources=[path for (path, _, _), _, _ in valid],
+                                              coarse_images=[coarse for _, _, coarse in valid])
+            for ((path, size, mtime_ns), _, _), result in zip(valid, results):
+                cns = [entry['cn'] for entry in result['cns'] if entry['cn'] is not None]
+                records.append((path, size, mtime_ns, result['status'], ",".join(cns) or None))
+        self.checkpoint.mark(records)
+        for path, size, mtime_ns, _, _ in records:
+            self.processed[path] = (size, mtime_ns)
+            self.in_flight.discard(path)
+        self.num_processed += len(records)
+        print(f"{len(records)} files recognized in {time.time() - st:.3f}s, {len(self.pending)} waiting.")
+
+    def run(self):
+        next_batch = None # future of (files, decoded images), decoded while the previous batch is recognized
+        while self.running:
+            # block on the file events only when there is nothing else to do
+            if next_batch is not None:
+                timeout = 0
+            elif self.pending:
+                timeout = min(self.settle_s, 0.1)
+            else:
+                timeout = 1.0
+            self.update_pending(self.watcher.changes(timeout), time.time())
+
+            if next_batch is None:
+                files = self.take_ready_files(time.time())
+                if files:
+                    next_batch = self.prefetch_executor.submit(self.decode, files)
+                continue
+            files, images = next_batch.result()
+            # prefetch the following batch, backpressure: never more than one batch ahead of the inference
+            following = self.take_ready_files(time.time())
+            next_batch = self.prefetch_executor.submit(self.decode, following) if following else None
+            self.recognize(files, images)
+        if next_batch is not None:
+            # decoded but not recognized: not in the checkpoint, recognized after the restart
+            next_batch.result()
+        print(f"{self.num_processed} files recognized.")
+
+
+if __name__ == "__main__":
+    from cn_pipeline import CNPipeline, load_models
+    from result_store import ResultStore
+    import profiling
+
+    parser = argparse.ArgumentParser(description="recognize the container numbers of the images dropped into a folder")
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--checkpoint", default=None, help="default: <folder>/.watch_checkpoint.sqlite")
+    parser.add_argument("--result_db", default=None, help="SQLite result store (result_store.py)")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--settle", type=float, default=0.5, help="seconds without size / mtime change before a file is read")
+    parser.add_argument("--poll_interval", type=float, default=1.0)
+    parser.add_argument("--no_inotify", action="store_true", help="always poll (e.g. network file systems)")
+    parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--use_int8", action="store_true")
+    parser.add_argument("--roi_det", action="store_true", help="ROI-first CN detection of high-resolution frames")
+    parser.add_argument("--speculative_retry", action="store_true", help="recognize the original crop of a reassembled crop in the same batch")
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args()
+    result_store = ResultStore(args.result_db) if args.result_db is not None else None
+    pipeline = CNPipeline(*load_models(use_gpu=args.use_gpu, use_int8=args.use_int8, roi_det=args.roi_det), result_store=result_store,
+                          speculative_retry=args.speculative_retry)
+    profiling.setup(pipeline, args.profile_dir, args.profile_mode, args.profile_window)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.folder, ".watch_checkpoint.sqlite"))
+    watcher = FolderWatcher(args.folder, poll_interval=args.poll_interval, use_inotify=not args.no_inotify)
+    daemon = WatchFolderDaemon(pipeline, watcher, checkpoint, batch_size=args.batch_size, settle_s=args.settle)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+    checkpoint.close()
+    if result_store is not None:
+        result_store.close()